@@ -85,12 +85,14 @@ setup(name=name,
           'monitor.genstatus = slapos.monitor.globalstate:main',
           'monitor.genrss = slapos.monitor.status2rss:main',
           'monitor.configwrite = slapos.monitor.monitor_config_write:main',
+          'monitor.history = slapos.monitor.history:main',
           'runResiliencyUnitTestTestNode = slapos.resiliencytest:runUnitTest',
           'runResiliencyScalabilityTestNode = slapos.resiliencytest:runResiliencyTest',
           'runStandaloneResiliencyTest = slapos.resiliencytest:runStandaloneResiliencyTest',
           'lampconfigure = slapos.lamp:run [lampconfigure]',
           'onetimedownload = slapos.onetimedownload:main',
           'onetimeupload = slapos.onetimeupload:main',
+          'promise-batch = slapos.promise.batch:main',
           'pubsubnotifier = slapos.pubsub.notifier:main',
           'pubsubserver = slapos.pubsub:main',
           'qemu-qmp-client = slapos.qemuqmpclient:main',
@@ -100,6 +102,8 @@ setup(name=name,
           'slaprunnerteststandalone = slapos.runner.runnertest:runStandaloneUnitTest',
           'zodbpack = slapos.zodbpack:run [zodbpack]',
           'networkbench = slapos.networkbench:main',
+          'networkbench-http = slapos.networkbench.httpbench:main',
+          'networkbench-query = slapos.networkbench.sink:query',
           'cachechecker = slapos.cachechecker:web_checker_utility'
         ]
       },
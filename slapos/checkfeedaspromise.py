@@ -5,9 +5,23 @@
 # a stalled state, in the case that no OK pattern has been found
 
 import argparse
+import calendar
 import datetime
+import email.utils
 import feedparser
+import json
+import os
+import re
 import sys
+import time
+import urllib2
+from cStringIO import StringIO
+from xml.etree import cElementTree as ElementTree
+
+ATOM_NAMESPACE = '{http://www.w3.org/2005/Atom}'
+
+iso_date_re = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)'
+                         r'(?:\.\d+)?(?:Z|([+-])(\d\d):?(\d\d))?$')
 
 
 def parseArguments():
@@ -24,6 +38,12 @@ def parseArguments():
   parser.add_argument('--ko-pattern', dest='ko_pattern_list', action='append',
                       default=[],
                       help='If this pattern is found, then promise fails')
+  parser.add_argument('--fast', dest='fast', action='store_true',
+                      help='Parse the feed incrementally, only keeping its last item')
+  parser.add_argument('--cache-file', dest='cache_file',
+                      help='With --fast, file where ETag and Last-Modified '
+                           'headers of feed urls are kept to only download '
+                           'modified feeds')
   parser.add_argument('--time-buffer', dest='time_buffer', type=int,
                       default=0,
                       help='Time delta in seconds before the promise really succeeds or fails')
@@ -37,7 +57,137 @@ def containsPattern(string, pattern_list):
   return False
 
 
+def parseDate(value):
+  """
+    Return the UTC time tuple of a RFC 822 date of RSS feeds, or of a
+    RFC 3339 date of Atom feeds, None if it can't be parsed.
+  """
+  value = value.strip()
+  date_tuple = email.utils.parsedate_tz(value)
+  if date_tuple is not None:
+    return time.gmtime(email.utils.mktime_tz(date_tuple))
+  match = iso_date_re.match(value)
+  if match is None:
+    return None
+  timestamp = calendar.timegm([int(x) for x in match.groups()[:6]])
+  sign, hours, minutes = match.groups()[6:]
+  if sign is not None:
+    offset = int(hours) * 3600 + int(minutes) * 60
+    timestamp -= offset if sign == '+' else -offset
+  return time.gmtime(timestamp)
+
+
+def getLastItem(source):
+  """
+    Parse the RSS or Atom feed read from the file object source and return
+    the title, description and publication date of its last item, None if
+    there is no item. Items are removed from the tree as soon as they are
+    parsed.
+  """
+  last_item = None
+  # parents of the element being parsed
+  element_list = []
+  for event, element in ElementTree.iterparse(source, ('start', 'end')):
+    if event == 'start':
+      element_list.append(element)
+      continue
+    element_list.pop()
+    if element.tag == 'item':
+      last_item = feedparser.FeedParserDict(
+        title=element.findtext('title', ''),
+        description=element.findtext('description', ''),
+        published=element.findtext('pubDate'),
+      )
+    elif element.tag == ATOM_NAMESPACE + 'entry':
+      last_item = feedparser.FeedParserDict(
+        title=element.findtext(ATOM_NAMESPACE + 'title', ''),
+        description=element.findtext(ATOM_NAMESPACE + 'summary') or
+                    element.findtext(ATOM_NAMESPACE + 'content', ''),
+        published=element.findtext(ATOM_NAMESPACE + 'published') or
+                  element.findtext(ATOM_NAMESPACE + 'updated'),
+      )
+    else:
+      continue
+    if element_list:
+      element_list[-1].remove(element)
+  if last_item is not None:
+    last_item.published_parsed = last_item.published and \
+      parseDate(last_item.published)
+  return last_item
+
+
+def loadCache(cache_file):
+  try:
+    with open(cache_file) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return {}
+
+
+def writeCache(cache_file, cache):
+  temp_file = '%s.tmp' % cache_file
+  with open(temp_file, 'w') as f:
+    json.dump(cache, f)
+  os.rename(temp_file, cache_file)
+
+
+def fetchLastItem(url, cache_file=None):
+  """
+    Return the last item of the feed at url. If cache_file is set, the feed
+    is only downloaded if it was modified since the previous call.
+  """
+  cache = loadCache(cache_file) if cache_file else {}
+  cached = cache.get(url)
+  request = urllib2.Request(url)
+  if cached is not None:
+    if cached.get('etag'):
+      request.add_header('If-None-Match', cached['etag'])
+    if cached.get('modified'):
+      request.add_header('If-Modified-Since', cached['modified'])
+  try:
+    response = urllib2.urlopen(request)
+  except urllib2.HTTPError, e:
+    if e.code == 304 and cached is not None:
+      item = cached['item']
+      return item and feedparser.FeedParserDict(item,
+        published_parsed=item['published'] and parseDate(item['published']))
+    raise
+  try:
+    last_item = getLastItem(response)
+  finally:
+    response.close()
+  if cache_file:
+    cache[url] = {
+      'etag': response.info().getheader('ETag'),
+      'modified': response.info().getheader('Last-Modified'),
+      'item': last_item and dict((key, last_item[key])
+        for key in ('title', 'description', 'published')),
+    }
+    writeCache(cache_file, cache)
+  return last_item
+
+
+def checkFeedAsPromiseFast(feed, option):
+  try:
+    if feed.lstrip().startswith('<'):
+      last_item = getLastItem(StringIO(feed))
+    elif feed.startswith(('http://', 'https://')):
+      last_item = fetchLastItem(feed, getattr(option, 'cache_file', None))
+    else:
+      with open(feed) as source:
+        last_item = getLastItem(source)
+  except SyntaxError, e:
+    return 'Feed malformed : %s' % e
+
+  if last_item is None:
+    return ''
+  return checkLastItem(last_item, option)
+
+
 def checkFeedAsPromise(feed, option):
+  if getattr(option, 'fast', False):
+    return checkFeedAsPromiseFast(feed, option)
+
   feed = feedparser.parse(feed)
 
   if feed.bozo:
@@ -49,7 +199,10 @@ def checkFeedAsPromise(feed, option):
   if len(feed.entries) == 0:
     return ''
 
-  last_item = feed.entries[-1]
+  return checkLastItem(feed.entries[-1], option)
+
+
+def checkLastItem(last_item, option):
   if option.title:
     candidate_string = last_item.title
   elif option.description:
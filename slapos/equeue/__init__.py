@@ -27,6 +27,7 @@
 ##############################################################################
 
 import argparse
+import contextlib
 import errno
 import gdbm
 import json
@@ -39,8 +40,8 @@ import socket
 import subprocess
 import sys
 import SocketServer
-import StringIO
 import threading
+import time
 
 # Copied from erp5.util:erp5/util/testnode/ProcessManager.py
 def subprocess_capture(p, log, log_prefix, get_output=True):
@@ -89,11 +90,27 @@ class EqueueServer(SocketServer.ThreadingUnixStreamServer):
     self.setDB(self.options.database[0])
     if getattr(self.options, 'takeover_triggered_file_path', None):
       self.takeover_triggered_file_path = self.options.takeover_triggered_file_path[0]
-    # Lock to only have one command running at the time
-    self.thread_lock = threading.Lock()
+    # Commands of the same executable are run one at the time, at most
+    # max_concurrent commands of different executables run at the same time.
+    self.max_concurrent = getattr(self.options, 'max_concurrent', 1) or 1
+    self.thread_lock = threading.BoundedSemaphore(self.max_concurrent)
+    self.command_lock_dict = {}
+    self.command_lock_dict_lock = threading.Lock()
+    # gdbm database can't be used by several threads at the same time
+    self.db_lock = threading.Lock()
     # Lockfile is used by other commands to know if an import is ongoing.
+    # It is kept while at least one command is running.
     self.lockfile = LockFile(self.options.lockfile)
     self.lockfile.break_lock()
+    self.lockfile_lock = threading.Lock()
+    self.running_command_count = 0
+    # Commands waiting to be run, by executable. Only the newest timestamp
+    # is kept, so a burst of notifications is run only once.
+    self.pending_dict = {}
+    self.pending_lock = threading.Lock()
+    self.metric_dict = dict.fromkeys(('received', 'coalesced', 'run',
+                                      'max_pending'), 0)
+    self.metric_dict.update(total_wait_time=0.0, max_wait_time=0.0)
 
   def setLogger(self, logfile, loglevel):
     self.logger = logging.getLogger("EQueue")
@@ -114,68 +131,229 @@ class EqueueServer(SocketServer.ThreadingUnixStreamServer):
       return True
     return False
 
+  def _getCommandLock(self, cmd_executable):
+    with self.command_lock_dict_lock:
+      try:
+        return self.command_lock_dict[cmd_executable]
+      except KeyError:
+        lock = self.command_lock_dict[cmd_executable] = threading.Lock()
+        return lock
+
+  @contextlib.contextmanager
+  def _lockfileAcquired(self):
+    with self.lockfile_lock:
+      if not self.running_command_count:
+        self.lockfile.acquire()
+      self.running_command_count += 1
+    try:
+      yield
+    finally:
+      with self.lockfile_lock:
+        self.running_command_count -= 1
+        if not self.running_command_count:
+          self.lockfile.release()
+
+  def _enqueueCommand(self, command, timestamp):
+    """
+      Add command to the pending queue. Return False if a command of the same
+      executable was already pending: it is updated to the newest timestamp
+      and will be run by the thread waiting for it.
+    """
+    cmd_executable = command.split('\0')[0]
+    with self.pending_lock:
+      self.metric_dict['received'] += 1
+      pending = self.pending_dict.get(cmd_executable)
+      if pending is not None:
+        self.metric_dict['coalesced'] += 1
+        if timestamp > pending[1]:
+          self.pending_dict[cmd_executable] = (command, timestamp, pending[2])
+        return False
+      self.pending_dict[cmd_executable] = (command, timestamp, time.time())
+      self.metric_dict['max_pending'] = max(self.metric_dict['max_pending'],
+                                            len(self.pending_dict))
+      return True
+
+  def _popPendingCommand(self, cmd_executable):
+    with self.pending_lock:
+      command, timestamp, enqueue_time = self.pending_dict.pop(cmd_executable)
+      wait_time = time.time() - enqueue_time
+      self.metric_dict['run'] += 1
+      self.metric_dict['total_wait_time'] += wait_time
+      self.metric_dict['max_wait_time'] = max(self.metric_dict['max_wait_time'],
+                                              wait_time)
+      self.logger.info("%s waited %.3fs in queue, %d pending, %d of %d "
+                       "notifications coalesced.", cmd_executable, wait_time,
+                       len(self.pending_dict), self.metric_dict['coalesced'],
+                       self.metric_dict['received'])
+      return command, timestamp
+
+  def getQueueMetricDict(self):
+    with self.pending_lock:
+      metric_dict = dict(self.metric_dict, pending=len(self.pending_dict))
+    run = metric_dict['run']
+    metric_dict['average_wait_time'] = \
+      metric_dict['total_wait_time'] / run if run else 0.0
+    return metric_dict
+
   def _runCommandIfNeeded(self, command, timestamp):
-    with self.thread_lock as thread_lock, self.lockfile as lockfile:
-      if self._hasTakeoverBeenTriggered():
-        self.logger.info('Takeover has been triggered, preventing to run import script.')
-        return
-      cmd_list = command.split('\0')
-      cmd_readable = ' '.join(cmd_list)
-      cmd_executable = cmd_list[0]
+    if self._enqueueCommand(command, timestamp):
+      self._runPendingCommand(command.split('\0')[0])
 
+  def _runPendingCommand(self, cmd_executable):
+    pending = True
+    try:
+      with self._getCommandLock(cmd_executable), self.thread_lock, \
+          self._lockfileAcquired():
+        # notifications received while waiting for the locks were coalesced
+        command, timestamp = self._popPendingCommand(cmd_executable)
+        pending = False
+        self._runCommand(cmd_executable, command, timestamp)
+    finally:
+      if pending:
+        # the locks could not be acquired: drop the command, otherwise all
+        # next notifications would be coalesced into it and never run
+        with self.pending_lock:
+          self.pending_dict.pop(cmd_executable, None)
+
+  def _runCommand(self, cmd_executable, command, timestamp):
+    cmd_list = command.split('\0')
+    cmd_readable = ' '.join(cmd_list)
+
+    if self._hasTakeoverBeenTriggered():
+      self.logger.info('Takeover has been triggered, preventing to run import script.')
+      return
+
+    with self.db_lock:
       if cmd_executable in self.db and timestamp <= int(self.db[cmd_executable]):
         self.logger.info("%s already run.", cmd_readable)
         return
 
-      self.logger.info("Running %s, %s with output:", cmd_readable, timestamp)
-      try:
-        sys.stdout.flush()
-        p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        subprocess_capture(p, self.logger.info, '', True)
-        if p.returncode == 0:
-          self.logger.info("%s finished successfully.", cmd_readable)
+    self.logger.info("Running %s, %s with output:", cmd_readable, timestamp)
+    try:
+      sys.stdout.flush()
+      p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE)
+      subprocess_capture(p, self.logger.info, '', True)
+      if p.returncode == 0:
+        self.logger.info("%s finished successfully.", cmd_readable)
+        with self.db_lock:
           self.db[cmd_executable] = str(timestamp)
-        else:
-          self.logger.warning("%s exited with status %s." % (cmd_readable, p.returncode))
-      except subprocess.CalledProcessError as e:
-        self.logger.warning("%s exited with status %s. output is: \n %s" % (
-            cmd_readable,
-            e.returncode,
-            e.output,
-        ))
+      else:
+        self.logger.warning("%s exited with status %s." % (cmd_readable, p.returncode))
+    except subprocess.CalledProcessError as e:
+      self.logger.warning("%s exited with status %s. output is: \n %s" % (
+          cmd_readable,
+          e.returncode,
+          e.output,
+      ))
+
+  def _parseRequest(self, request_string):
+    """
+      Return (id, command, timestamp) of a json request, command is None if
+      the request is invalid. id is only set by newline framed clients.
+    """
+    request_id = None
+    try:
+      request_parameters = json.loads(request_string)
+      request_id = request_parameters.get('id')
+      timestamp = request_parameters['timestamp']
+      command = str(request_parameters['command'])
+    except (ValueError, KeyError, TypeError, AttributeError):
+      self.logger.warning("Error during the unserialization of json "
+                          "message. The message was %r", request_string)
+      return request_id, None, None
+    self.logger.info("New command %r at %s", command, timestamp)
+    return request_id, command, timestamp
+
+  def _isLegacyRequest(self, request_string):
+    """
+      Legacy clients send a single json object, without newline, and wait
+      for the answer before closing the connection.
+    """
+    try:
+      return 'id' not in json.loads(request_string)
+    except (ValueError, TypeError):
+      return False
+
+  def _isMetricRequest(self, request_string):
+    """
+      A framed {"id": ..., "command": "metrics"} request, without timestamp,
+      asks for the queue metrics.
+    """
+    try:
+      request_parameters = json.loads(request_string)
+      return request_parameters.get('command') == 'metrics' and \
+        'timestamp' not in request_parameters
+    except (ValueError, AttributeError):
+      return False
+
+  def _processFramedRequest(self, request, request_string):
+    if self._isMetricRequest(request_string):
+      request.sendall(json.dumps({'id': json.loads(request_string).get('id'),
+                                  'metrics': self.getQueueMetricDict()}) + '\n')
+      return
+    request_id, command, timestamp = self._parseRequest(request_string)
+    if command is None:
+      answer = {'id': request_id, 'error': 'Invalid request'}
+    else:
+      answer = {'id': request_id, 'command': command}
+    request.sendall(json.dumps(answer) + '\n')
+    if command is not None and self._enqueueCommand(command, timestamp):
+      # don't block the next requests of the connection
+      thread = threading.Thread(target=self._runPendingCommand,
+                                args=(command.split('\0')[0],))
+      thread.daemon = True
+      thread.start()
 
   def process_request_thread(self, request, client_address):
     # Handle request
     self.logger.debug("Connection with file descriptor %d", request.fileno())
     request.settimeout(self.options.timeout)
-    request_string = StringIO.StringIO()
-    segment = None
+    request_string = ''
+    framed = False
     try:
-      while segment != '':
-        segment = request.recv(1024)
-        request_string.write(segment)
-    except socket.timeout:
-      pass
+      while True:
+        try:
+          segment = request.recv(4096)
+        except socket.timeout:
+          break
+        if not segment:
+          break
+        request_string += segment
+        if '\n' in request_string:
+          if not framed:
+            # Newline framed client, it sends as many json requests as it
+            # wants and each one is answered by a json line.
+            framed = True
+            request.settimeout(None)
+          line_list = request_string.split('\n')
+          request_string = line_list.pop()
+          for line in line_list:
+            if line.strip():
+              self._processFramedRequest(request, line)
+        elif not framed and self._isLegacyRequest(request_string):
+          # answer without waiting for the end of the connection
+          break
+    except socket.error, e:
+      self.logger.warning("Connection with %r failed: %s", request.fileno(), e)
+      framed = True
 
-    command = '127'
-    try:
-      request_parameters = json.loads(request_string.getvalue())
-      timestamp = request_parameters['timestamp']
-      command = str(request_parameters['command'])
-      self.logger.info("New command %r at %s", command, timestamp)
-
-    except (ValueError, IndexError) :
-      self.logger.warning("Error during the unserialization of json "
-                          "message of %r file descriptor. The message "
-                          "was %r", request.fileno(), request_string.getvalue())
+    if framed:
+      self.close_request(request)
+      return
 
+    command = '127'
+    request_id, parsed_command, timestamp = self._parseRequest(request_string)
+    if parsed_command is not None:
+      command = parsed_command
     try:
       request.send(command)
     except:
       self.logger.warning("Couldn't respond to %r", request.fileno())
     self.close_request(request)
-    self._runCommandIfNeeded(command, timestamp)
+    if parsed_command is not None:
+      self._runCommandIfNeeded(command, timestamp)
+
 # Well the following function is made for schrodinger's files,
 # It will work if the file exists or not
 def remove_existing_file(path):
@@ -187,7 +365,8 @@ def remove_existing_file(path):
 
 def main():
   parser = argparse.ArgumentParser(
-    description="Run a single threaded execution queue.")
+    description="Run an execution queue, commands of the same executable "
+                "being run one at the time.")
   parser.add_argument('--database', nargs=1, required=True,
                       help="Path to the database where the last "
                       "calls are stored")
@@ -202,6 +381,11 @@ def main():
                       dest='timeout', type=int, default=3)
   parser.add_argument('--lockfile',
                       help="Path to the lock file created when a command is run")
+  parser.add_argument('--max-concurrent', dest='max_concurrent', type=int,
+                      default=1, required=False,
+                      help="Maximum number of commands run at the same time. "
+                      "Commands of the same executable are always run one "
+                      "at the time.")
   parser.add_argument('--takeover-triggered-file-path', nargs=1, required=False,
                       help="Path to the file created by takeover script to state that it has been triggered.")
   parser.add_argument('socket', help="Path to the unix socket")
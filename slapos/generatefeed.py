@@ -10,6 +10,7 @@
 import argparse
 import collections
 import datetime
+import heapq
 import json
 import os
 import PyRSS2Gen as rss
@@ -25,6 +26,12 @@ def parseArguments():
                       default=50, required=False,
                       help='Maximum number of items in the feed')
 
+  parser.add_argument('--index-file', dest='index_file', type=str,
+                      required=False,
+                      help='Path of the index of the items of the feed. When '
+                           'set, only the items added since the previous run '
+                           'are read')
+
   parser.add_argument('--title', dest='feed_title', type=str, required=True,
                       help='Title of the feed')
   parser.add_argument('--link', dest='feed_link', type=str, required=True,
@@ -52,13 +59,101 @@ def getRSSItemListFromItemDict(item_dict):
   rss_item_list = []
 
   for item in item_dict:
-    item_dict[item]['pubDate'] = datetime.datetime.fromtimestamp(item_dict[item]['pubDate'])
-    rss_item_list.append(rss.RSSItem(**item_dict[item]))
+    rss_item_list.append(rss.RSSItem(**dict(item_dict[item],
+      pubDate=datetime.datetime.fromtimestamp(item_dict[item]['pubDate']))))
 
   return rss_item_list
 
 
+def loadItemIndex(index_file):
+  """ Return the {file: (pubDate, mtime)} dict of the items of the previous
+      run
+  """
+  try:
+    with open(index_file) as fd:
+      return dict((file_path, (pub_date, mtime))
+                  for pub_date, file_path, mtime in json.load(fd))
+  except (IOError, ValueError):
+    return {}
+
+
+def loadItem(file_path):
+  """ Return the content of an item, or None if it was removed or is being
+      written
+  """
+  try:
+    with open(file_path, 'r') as fd:
+      return json.load(fd)
+  except (IOError, OSError, ValueError):
+    return None
+
+
+def writeFileAtomically(path, content):
+  temp_path = '%s.tmp' % path
+  with open(temp_path, 'w') as fd:
+    fd.write(content)
+  os.rename(temp_path, path)
+
+
+def getIndexedItemDict(option):
+  """
+    Return the newest max_item items, and delete the others. The index only
+    keeps the date and mtime of every item, so only the items added or
+    modified since the previous run are read to select the newest ones.
+  """
+  index_dict = loadItemIndex(option.index_file)
+  index_file = os.path.abspath(option.index_file)
+  mtime_dict = {}
+  for filename in os.listdir(option.status_item_path):
+    file_path = os.path.join(option.status_item_path, filename)
+    if os.path.abspath(file_path) in (index_file, '%s.tmp' % index_file):
+      continue
+    try:
+      mtime_dict[file_path] = os.stat(file_path).st_mtime
+    except OSError:
+      # removed meanwhile
+      pass
+
+  item_dict = {}
+  new_index_dict = {}
+  for file_path, mtime in mtime_dict.iteritems():
+    indexed = index_dict.get(file_path)
+    if indexed is not None and indexed[1] == mtime:
+      new_index_dict[file_path] = indexed
+      continue
+    # an item removed meanwhile is skipped, and an item being written is
+    # read on next run
+    item = loadItem(file_path)
+    if item is not None:
+      item_dict[file_path] = item
+      new_index_dict[file_path] = item['pubDate'], mtime
+
+  if len(new_index_dict) > option.max_item:
+    kept_key_set = set(heapq.nlargest(option.max_item, new_index_dict,
+      key=lambda file_path: (new_index_dict[file_path][0], file_path)))
+    outdated_key_list = [file_path for file_path in new_index_dict
+                         if file_path not in kept_key_set]
+    for outdated_key in outdated_key_list:
+      del new_index_dict[outdated_key]
+      item_dict.pop(outdated_key, None)
+    deleteFileList(outdated_key_list)
+
+  writeFileAtomically(option.index_file, json.dumps(
+    [(pub_date, file_path, mtime)
+     for file_path, (pub_date, mtime) in new_index_dict.iteritems()]))
+
+  for file_path in new_index_dict:
+    if file_path not in item_dict:
+      item = loadItem(file_path)
+      if item is not None:
+        item_dict[file_path] = item
+  return item_dict
+
+
 def generateFeed(option):
+  if getattr(option, 'index_file', None):
+    return getFeed(option, getIndexedItemDict(option))
+
   item_dict = {} # {file: content}
 
   for filename in os.listdir(option.status_item_path):
@@ -76,6 +171,13 @@ def generateFeed(option):
       del sorted_item_dict[outdated_key]
     deleteFileList(outdated_key_list)
 
+  return getFeed(option, sorted_item_dict)
+
+
+def getFeed(option, item_dict):
+  sorted_item_dict = collections.OrderedDict(
+      sorted(item_dict.items(), key=lambda x: x[1]['pubDate']))
+
   # Generate feed
   feed = rss.RSS2(
     title=option.feed_title,
@@ -91,7 +193,7 @@ def generateFeed(option):
 def main():
   option = parseArguments()
   feed = generateFeed(option)
-  open(option.output, 'w').write(feed)
+  writeFileAtomically(option.output, feed)
 
 
 if __name__ == "__main__":
@@ -34,6 +34,7 @@ import time
 import json
 import argparse
 import psutil
+from collections import namedtuple
 from time import strftime
 from datetime import datetime, timedelta
 
@@ -49,10 +50,62 @@ def parseArguments():
                       help='ID of the computer partition to collect data from.')
   parser.add_argument('--collector_db',
                       help='The path of slapos collect database.')
+  parser.add_argument('--rollup_db',
+                      help='Path of the database where aggregated values of '
+                           'the collector database are kept. If set, only '
+                           'new collected rows are read at every run.')
+  parser.add_argument('--timeseries_db',
+                      help='Path of the database where statistic data are '
+                           'stored. If set, *.data.json files are exported '
+                           'from it with a bounded size.')
+  parser.add_argument('--timeseries_retention',
+                      help='Retention policy of statistic data, as '
+                           'max_age:resolution pairs. Example: '
+                           '"24h:0,30d:5m,365d:1h"')
 
   return parser.parse_args()
 
 
+class PartitionResourceSummary(namedtuple('PartitionResourceSummary', [
+    'date', 'cpu_percent_average', 'memory_used_average', 'disk_used_average',
+    'total_process', 'cpu_percent', 'cpu_time', 'cpu_num_threads',
+    'memory_percent', 'memory_rss', 'io_rw_counter', 'io_cycles_counter',
+    'disk_used'])):
+  """
+  Resources consumed by a partition, as computed by
+  ResourceCollect.getPartitionResourceSummary.
+
+  *_average values are computed over the whole day (None if nothing was
+  collected), the other values cover the one minute window starting at `date`.
+  """
+  __slots__ = ()
+
+  def getProcessDict(self):
+    return {'total_process': self.total_process,
+      'cpu_percent': self.cpu_percent,
+      'cpu_time': self.cpu_time,
+      'cpu_num_threads': self.cpu_num_threads,
+      'date': self.date
+    }
+
+  def getMemoryDict(self):
+    return {'memory_percent': self.memory_percent,
+      'memory_rss': self.memory_rss,
+      'date': self.date
+    }
+
+  def getIODict(self):
+    return {'io_rw_counter': self.io_rw_counter,
+      'io_cycles_counter': self.io_cycles_counter,
+      'disk_used': self.disk_used,
+      'date': self.date
+    }
+
+  def getConsumptionStatus(self):
+    """ Same result as ResourceCollect.getPartitionComsumptionStatus """
+    return (self.getProcessDict(), self.getMemoryDict(), self.getIODict())
+
+
 class ResourceCollect:
 
   def __init__(self, db_path = None):
@@ -62,17 +115,22 @@ class ResourceCollect:
     self.cursor = None
 
   def connect(self):
-    self.connection = sqlite3.connect(self.uri)
-    self.cursor = self.connection.cursor()
+    # keep the connection opened until close() is called, so several queries
+    # can share it
+    if self.connection is None:
+      self.connection = sqlite3.connect(self.uri)
+      self.cursor = self.connection.cursor()
 
   def close(self):
     assert self.connection is not None
     self.cursor.close()
     self.connection.close()
+    self.connection = None
+    self.cursor = None
 
-  def _execute(self, sql):
+  def _execute(self, sql, parameter_list=()):
     assert self.connection is not None
-    return self.cursor.execute(sql)
+    return self.cursor.execute(sql, parameter_list)
 
   def select(self, table, date=None, columns="*", where=None):
     """ Query database for a full table information """
@@ -142,7 +200,7 @@ class ResourceCollect:
   def getPartitionDiskUsedAverage(self, partition_id, date_scope):
     if not self.has_table('folder'):
       return
-    self.db.connect()
+    self.connect()
     query_result_cursor = self.select("folder", date_scope,
                        columns="SUM(disk_used)", 
                        where="partition = '%s'" % partition_id)
@@ -155,7 +213,7 @@ class ResourceCollect:
                        where="partition = '%s'" % partition_id)
   
     collect_amount = zip(*query_result_cursor)
-    self.db.close()
+    self.close()
   
     if len(collect_amount) and len(disk_used_sum):
       return round(disk_used_sum[0][0]/(collect_amount[0][0]*1024.0), 2)
@@ -255,6 +313,66 @@ date='%s' and partition='%s' and (time between '%s' and '%s') %s""" % (
     self.close()
     return (process_dict, memory_dict, io_dict)
 
+  def getPartitionResourceSummary(self, partition_id, date_scope=None,
+                                  min_time=None, max_time=None):
+    """
+      Compute day averages and last minute consumption of a partition with a
+      single scan of the `user` and `folder` tables.
+
+      The connection is kept opened, call close() once all queries are done.
+    """
+    now = datetime.now()
+    if date_scope is None:
+      date_scope = now.strftime('%Y-%m-%d')
+    if min_time is None:
+      min_time = (now - timedelta(minutes=1)).strftime('%H:%M:00')
+    if max_time is None:
+      max_time = (now - timedelta(minutes=1)).strftime('%H:%M:59')
+
+    self.connect()
+    window = "CASE WHEN time BETWEEN ? AND ? THEN %s END"
+    column_list = ['SUM(cpu_percent)', 'SUM(memory_rss)', 'COUNT(DISTINCT time)',
+                   'COUNT(%s)' % (window % 'pid')]
+    column_list.extend(['SUM(%s)' % (window % column) for column in (
+      'cpu_percent', 'cpu_time', 'cpu_num_threads', 'memory_percent',
+      'memory_rss', 'io_rw_counter', 'io_cycles_counter')])
+    parameter_list = [min_time, max_time] * 8 + [date_scope, partition_id]
+    (cpu_percent_sum, memory_rss_sum, sample_amount, total_process,
+     cpu_percent, cpu_time, cpu_num_threads, memory_percent, memory_rss,
+     io_rw_counter, io_cycles_counter) = self._execute(
+      "SELECT %s FROM user WHERE date = ? AND partition = ?" % (
+        ', '.join(column_list)), parameter_list).fetchone()
+
+    disk_used_sum = disk_used = None
+    collect_amount = 0
+    if self._execute("SELECT name FROM sqlite_master WHERE type='table' "
+                     "AND name='folder'").fetchone() is not None:
+      disk_used_sum, collect_amount, disk_used = self._execute(
+        "SELECT SUM(disk_used), COUNT(DISTINCT time), SUM(%s) FROM folder "
+        "WHERE date = ? AND partition = ?" % (window % 'disk_used'),
+        (min_time, max_time, date_scope, partition_id)).fetchone()
+
+    def average(value_sum, amount, divider=1.0):
+      if value_sum is None or not amount:
+        return None
+      return round(value_sum/(amount*divider), 2)
+
+    return PartitionResourceSummary(
+      date='%s %s' % (date_scope, min_time),
+      cpu_percent_average=average(cpu_percent_sum, sample_amount),
+      memory_used_average=average(memory_rss_sum, sample_amount, 1024*1024.0),
+      disk_used_average=average(disk_used_sum, collect_amount, 1024.0),
+      total_process=total_process,
+      cpu_percent=round((cpu_percent or 0), 2),
+      cpu_time=round((cpu_time or 0)/(60.0), 2),
+      cpu_num_threads=round((cpu_num_threads or 0), 2),
+      memory_percent=round((memory_percent or 0), 2),
+      memory_rss=round((memory_rss or 0)/(1024*1024.0), 2),
+      io_rw_counter=round((io_rw_counter or 0), 2),
+      io_cycles_counter=round((io_cycles_counter or 0), 2),
+      disk_used=round((disk_used or 0)/1024.0, 2),
+    )
+
 def appendToJsonFile(file_path, content, stepback=2):
   with open (file_path, mode="r+") as jfile:
     jfile.seek(0, 2)
@@ -315,7 +433,16 @@ def main():
   stat_info = os.stat(parser.output_folder)
   partition_user = pwd.getpwuid(stat_info.st_uid)[0]
 
-  process_result, memory_result, io_result = collector.getPartitionComsumptionStatus(partition_user)
+  if parser.rollup_db:
+    # imported here as rollup module depends on this one
+    from slapos.monitor.rollup import ResourceRollup
+    rollup = ResourceRollup(parser.rollup_db)
+    rollup.update(parser.collector_db, partition_user)
+    summary = rollup.getPartitionResourceSummary(partition_user)
+    rollup.close()
+  else:
+    summary = collector.getPartitionResourceSummary(partition_user)
+  process_result, memory_result, io_result = summary.getConsumptionStatus()
 
   label_list = ['date', 'total_process', 'cpu_percent', 'cpu_time', 'cpu_num_threads',
                   'memory_percent', 'memory_rss', 'io_rw_counter', 'io_cycles_counter',
@@ -330,18 +457,28 @@ def main():
   if not os.path.exists(io_file):
     initIODataFile(io_file)
 
+  if parser.timeseries_db:
+    from slapos.monitor.timeseries import appendToSeries, parseRetentionPolicy
+    retention_policy = None
+    if parser.timeseries_retention:
+      retention_policy = parseRetentionPolicy(parser.timeseries_retention)
+    appendData = lambda file_path, content: appendToSeries(
+      parser.timeseries_db, file_path, content, retention_policy)
+  else:
+    appendData = appendToJsonFile
+
   if process_result and process_result['total_process'] != 0.0:
-    appendToJsonFile(process_file, ", ".join(
+    appendData(process_file, ", ".join(
       [str(process_result[key]) for key in label_list if process_result.has_key(key)])
     )
     resource_status_dict.update(process_result)
   if memory_result and memory_result['memory_rss'] != 0.0:
-    appendToJsonFile(mem_file, ", ".join(
+    appendData(mem_file, ", ".join(
       [str(memory_result[key]) for key in label_list if memory_result.has_key(key)])
     )
     resource_status_dict.update(memory_result)
   if io_result and io_result['io_rw_counter'] != 0.0:
-    appendToJsonFile(io_file, ", ".join(
+    appendData(io_file, ", ".join(
       [str(io_result[key]) for key in label_list if io_result.has_key(key)])
     )
     resource_status_dict.update(io_result)
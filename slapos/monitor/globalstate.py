@@ -7,6 +7,7 @@ import json
 import ConfigParser
 import time
 from datetime import datetime
+from slapos.monitor.timeseries import appendToSeries, parseRetentionPolicy
 
 def softConfigGet(config, *args, **kwargs):
   try:
@@ -14,7 +15,8 @@ def softConfigGet(config, *args, **kwargs):
   except (ConfigParser.NoOptionError, ConfigParser.NoSectionError):
     return ""
 
-def generateStatisticsData(stat_file_path, content):
+def generateStatisticsData(stat_file_path, content, timeseries_db=None,
+                           retention_policy=None):
   # csv document for statictics
   if not os.path.exists(stat_file_path):
     with open(stat_file_path, 'w') as fstat:
@@ -33,13 +35,89 @@ def generateStatisticsData(stat_file_path, content):
       content['state']['warning'])
 
   # append to file
-  if current_state:
+  if current_state and timeseries_db:
+    appendToSeries(timeseries_db, stat_file_path, current_state,
+                   retention_policy)
+  elif current_state:
     with open (stat_file_path, mode="r+") as fstat:
       fstat.seek(0,2)
       position = fstat.tell() -2
       fstat.seek(position)
       fstat.write('%s}' % ',"{}"]'.format(current_state))
 
+def loadStatusFileList(file_list, index_file, previous_status_list=()):
+  """
+    Return parsed content of status files from file_list. index_file keeps
+    the mtime, size and title of every file, and the content of files which
+    did not change is taken from previous_status_list, the promises of the
+    previous global state, so only modified files are read again.
+    index_file is only rewritten when the list of files or the content of a
+    file changed, not when a file was written again with the same content.
+  """
+  index_dict = {}
+  if os.path.exists(index_file):
+    with open(index_file) as f:
+      try:
+        index_dict = json.loads(f.read())
+      except ValueError:
+        pass
+  previous_dict = dict((status.get('title'), status)
+                       for status in previous_status_list)
+
+  index_changed = set(index_dict) != set(file_list)
+  new_index_dict = {}
+  status_list = []
+  for file in file_list:
+    try:
+      stat = os.stat(file)
+    except OSError:
+      # file removed meanwhile
+      index_changed = True
+      continue
+    signature = [stat.st_mtime, stat.st_size]
+    cached = index_dict.get(file)
+    previous = None
+    if cached is not None and isinstance(cached[2], basestring):
+      previous = previous_dict.get(cached[2])
+      if previous is not None:
+        # time is added to promises of the global state
+        previous = dict(previous)
+        previous.pop('time', None)
+    if cached is not None and previous is not None and cached[:2] == signature:
+      content = previous
+      new_index_dict[file] = cached
+    else:
+      try:
+        with open(file, 'r') as temp_file:
+          content = json.loads(temp_file.read())
+      except (IOError, ValueError):
+        # bad json file ?
+        content = None
+      if cached is None or content != previous:
+        index_changed = True
+        new_index_dict[file] = signature + [
+          content.get('title') if isinstance(content, dict) else None]
+      else:
+        # written again with the same content, the index is kept as is
+        new_index_dict[file] = cached
+    if content is not None:
+      status_list.append(content)
+
+  if index_changed:
+    with open(index_file, 'w') as f:
+      f.write(json.dumps(new_index_dict))
+  return status_list
+
+def writeFileIfChanged(file_path, content):
+  """ Write content to file_path, only if it is not already its content """
+  if os.path.exists(file_path):
+    with open(file_path) as f:
+      if f.read() == content:
+        return False
+  with open(file_path, 'w') as f:
+    f.write(content)
+  return True
+
 def run(args_list):
   monitor_file, instance_file = args_list
 
@@ -52,6 +130,11 @@ def run(args_list):
   related_monitor_list = monitor_config.get("monitor", "monitor-url-list").split()
   statistic_folder = os.path.join(base_folder, 'data', '.jio_documents')
   parameter_file = os.path.join(base_folder, 'config', '.jio_documents', 'config.json')
+  timeseries_db = softConfigGet(monitor_config, 'monitor', 'timeseries-db')
+  retention_policy = softConfigGet(monitor_config, 'monitor',
+                                   'timeseries-retention')
+  if retention_policy:
+    retention_policy = parseRetentionPolicy(retention_policy)
 
   report_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
@@ -72,13 +155,16 @@ def run(args_list):
   promise_list = []
   global_state_file = os.path.join(base_folder, 'monitor.global.json')
   public_state_file = os.path.join(status_folder, 'monitor.global.json')
-  for file in file_list:
-    try:
-      with open(file, 'r') as temp_file:
-        tmp_json = json.loads(temp_file.read())
-    except ValueError:
-      # bad json file ?
-      continue
+  previous_status_list = []
+  if os.path.exists(global_state_file):
+    with open(global_state_file) as f:
+      try:
+        previous_status_list = json.loads(f.read())['_embedded']['promises']
+      except (ValueError, KeyError, TypeError):
+        pass
+  for tmp_json in loadStatusFileList(file_list,
+                                     os.path.join(base_folder, '_status_index'),
+                                     previous_status_list):
     if tmp_json['status'] == 'ERROR':
       error  += 1
     elif tmp_json['status'] == 'OK':
@@ -153,6 +239,8 @@ def run(args_list):
   public_state_dict['hosting-title'] = global_state_dict.get('hosting-title', '')
   public_state_dict['_links']['related_monitor'] = global_state_dict['_links'].get('related_monitor', [])
 
+  # State files are written at every run, their date being the date of the
+  # last run, not of the last change
   with open(global_state_file, 'w') as fglobal:
     fglobal.write(json.dumps(global_state_dict))
 
@@ -167,18 +255,16 @@ def run(args_list):
   data_document_list = [os.path.splitext(file)[0]
               for file in os.listdir(statistic_folder) if file.endswith('.json')]
 
-  with open(os.path.join(status_folder, '_document_list'), 'w') as lfile:
-    lfile.write('\n'.join(public_document_list))
-
-  with open(os.path.join(base_folder, '_document_list'), 'w') as lfile:
-    lfile.write('\n'.join(private_document_list))
-
-  with open(os.path.join(statistic_folder, '_document_list'), 'w') as lfile:
-    lfile.write('\n'.join(data_document_list))
+  writeFileIfChanged(os.path.join(status_folder, '_document_list'),
+                     '\n'.join(public_document_list))
+  writeFileIfChanged(os.path.join(base_folder, '_document_list'),
+                     '\n'.join(private_document_list))
+  writeFileIfChanged(os.path.join(statistic_folder, '_document_list'),
+                     '\n'.join(data_document_list))
 
   generateStatisticsData(
     os.path.join(statistic_folder, 'monitor_state.data.json'),
-    global_state_dict)
+    global_state_dict, timeseries_db, retention_policy or None)
 
   return 0
 
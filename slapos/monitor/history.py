@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Append only storage of promise status history.
+
+Every status is written as one json line in <name>.history.jsonl, and its
+date and offset are appended to the fixed size records of
+<name>.history.idx. Adding a status never reads or rewrites previous ones,
+and the last statuses or the statuses of a time range are found from the
+index without parsing the whole history.
+
+The {"date": ..., "data": [...]} document written in <name>.history.json
+by monitor.runpromise can be exported on demand, and an existing one is
+imported when the history is created.
+"""
+
+import argparse
+import json
+import os
+import struct
+import time
+
+# date of the status, offset of its line in the history file
+INDEX_RECORD = struct.Struct('<dQ')
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class PromiseHistory(object):
+
+  def __init__(self, history_folder, name):
+    self.history_file = os.path.join(history_folder, '%s.history.jsonl' % name)
+    self.index_file = os.path.join(history_folder, '%s.history.idx' % name)
+
+  def exists(self):
+    return self.count() > 0
+
+  def count(self):
+    try:
+      return os.path.getsize(self.index_file) // INDEX_RECORD.size
+    except OSError:
+      return 0
+
+  def append(self, status_dict, date=None):
+    if date is None:
+      date = time.time()
+    line = json.dumps(status_dict) + '\n'
+    with open(self.history_file, 'ab') as fhistory:
+      fhistory.seek(0, 2)
+      offset = fhistory.tell()
+      fhistory.write(line)
+    # a line is only visible once indexed, so a line written without its
+    # index record (crash in between) is ignored
+    with open(self.index_file, 'ab') as findex:
+      findex.seek(0, 2)
+      size = findex.tell()
+      if size % INDEX_RECORD.size:
+        # drop the incomplete record of an interrupted append, so that next
+        # records stay aligned
+        findex.truncate(size - size % INDEX_RECORD.size)
+      findex.write(INDEX_RECORD.pack(date, offset))
+
+  def importJsonFile(self, json_file):
+    """
+      Append the statuses of a <name>.history.json file, dated from their
+      start-date. Return False if json_file does not exist.
+    """
+    if not os.path.exists(json_file):
+      return False
+    with open(json_file) as f:
+      data_dict = json.load(f)
+    date = data_dict.get('date') or 0
+    for status_dict in data_dict.get('data', []):
+      try:
+        # dates of the index must not decrease
+        date = max(date, time.mktime(time.strptime(
+          status_dict['start-date'], DATE_FORMAT)))
+      except (KeyError, TypeError, ValueError):
+        pass
+      self.append(status_dict, date)
+    return True
+
+  def _readIndex(self, findex, position):
+    findex.seek(position * INDEX_RECORD.size)
+    return INDEX_RECORD.unpack(findex.read(INDEX_RECORD.size))
+
+  def _bisect(self, findex, date, count, after=False):
+    """
+      Position of the first record with a date greater or equal to date,
+      or strictly greater if after is True.
+    """
+    low, high = 0, count
+    while low < high:
+      middle = (low + high) // 2
+      middle_date = self._readIndex(findex, middle)[0]
+      if middle_date < date or (after and middle_date == date):
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def _readRange(self, findex, start, stop):
+    """ Return statuses between index positions start and stop """
+    if start >= stop:
+      return []
+    findex.seek(start * INDEX_RECORD.size)
+    data = findex.read((stop - start) * INDEX_RECORD.size)
+    offset_list = [INDEX_RECORD.unpack_from(data, position)[1]
+                   for position in xrange(0, len(data), INDEX_RECORD.size)]
+    status_list = []
+    with open(self.history_file, 'rb') as fhistory:
+      fhistory.seek(offset_list[0])
+      for offset in offset_list:
+        if fhistory.tell() != offset:
+          # skip lines which were not indexed
+          fhistory.seek(offset)
+        status_list.append(json.loads(fhistory.readline()))
+    return status_list
+
+  def getDate(self):
+    """ Date of the first status """
+    if not self.exists():
+      return None
+    with open(self.index_file, 'rb') as findex:
+      return self._readIndex(findex, 0)[0]
+
+  def getLast(self, amount):
+    count = self.count()
+    if not count:
+      return []
+    with open(self.index_file, 'rb') as findex:
+      return self._readRange(findex, max(0, count - amount), count)
+
+  def getRange(self, since=None, until=None):
+    """ Return statuses added between since and until dates """
+    count = self.count()
+    if not count:
+      return []
+    with open(self.index_file, 'rb') as findex:
+      start = 0 if since is None else self._bisect(findex, since, count)
+      stop = count if until is None else \
+        self._bisect(findex, until, count, after=True)
+      return self._readRange(findex, start, stop)
+
+  def export(self, since=None, until=None, last=None):
+    """
+      Return the history in the format of <name>.history.json files.
+    """
+    if last is not None:
+      data_list = self.getLast(last)
+    else:
+      data_list = self.getRange(since, until)
+    return {"date": self.getDate(), "data": data_list}
+
+
+def parseArguments():
+  parser = argparse.ArgumentParser(
+    description="Export promise history to the <name>.history.json format.")
+  parser.add_argument('--history_folder', required=True,
+                      help='Folder containing history files.')
+  parser.add_argument('--name', required=True,
+                      help='Name of the promise.')
+  parser.add_argument('--output',
+                      help='Path of the json file to write, instead of stdout.')
+  parser.add_argument('--last', type=int,
+                      help='Only export the last statuses.')
+  parser.add_argument('--since', type=float,
+                      help='Only export statuses added after this timestamp.')
+  parser.add_argument('--until', type=float,
+                      help='Only export statuses added before this timestamp.')
+  return parser.parse_args()
+
+def main():
+  parser = parseArguments()
+  history = PromiseHistory(parser.history_folder, parser.name)
+  content = json.dumps(history.export(parser.since, parser.until, parser.last))
+  if parser.output:
+    temp_output = '%s.tmp' % parser.output
+    with open(temp_output, 'w') as f:
+      f.write(content)
+    os.rename(temp_output, parser.output)
+  else:
+    print content
@@ -80,6 +80,9 @@ class Monitoring(object):
     self.private_folder = config.get("monitor", "private-folder")
     self.collector_db  = config.get("monitor", "collector-db")
     self.collect_script = config.get("monitor", "collect-script")
+    self.timeseries_db = softConfigGet(config, "monitor", "timeseries-db")
+    self.timeseries_retention = softConfigGet(config, "monitor",
+                                              "timeseries-retention")
     self.webdav_folder = config.get("monitor", "webdav-folder")
     self.report_script_folder = config.get("monitor", "report-folder")
     self.webdav_url = '%s/share' % config.get("monitor", "base-url")
@@ -94,6 +97,12 @@ class Monitoring(object):
     self.pid_file = config.get("monitor", "pid-file")
     self.monitor_promise_folder = softConfigGet(config, "monitor",
                                                 "monitor-promise-folder")
+    self.promise_workers = softConfigGet(config, "monitor", "promise-workers")
+    self.history_format = softConfigGet(config, "monitor", "history-format")
+    self.promise_min_period = softConfigGet(config, "monitor",
+                                            "promise-min-period")
+    self.promise_max_period = softConfigGet(config, "monitor",
+                                            "promise-max-period")
 
     self.config_folder = os.path.join(self.private_folder, 'config')
     self.report_folder = self.private_folder
@@ -416,6 +425,14 @@ class Monitoring(object):
       '--history_folder "%s"' % self.public_folder,
       '--instance_name "%s"' % self.title,
       '--hosting_name "%s"' % self.root_title]
+    if self.history_format:
+      promise_cmd_line.append('--history_format %s' % self.history_format)
+    if self.promise_workers:
+      promise_cmd_line.append('--promise_workers %s' % self.promise_workers)
+    if self.promise_max_period:
+      promise_cmd_line.append('--promise_max_period %s' % self.promise_max_period)
+      if self.promise_min_period:
+        promise_cmd_line.append('--promise_min_period %s' % self.promise_min_period)
 
     registered_promise_list = os.listdir(self.promise_folder)
     for service_name in service_name_list:
@@ -493,6 +510,10 @@ class Monitoring(object):
     command = "sleep $((1 + RANDOM % 60)) && " # Random sleep between 1 to 60 seconds
     command += "%s %s --output_folder %s --collector_db %s" % (self.python,
       self.collect_script, self.data_folder, self.collector_db)
+    if self.timeseries_db:
+      command += " --timeseries_db %s" % self.timeseries_db
+      if self.timeseries_retention:
+        command += " --timeseries_retention %s" % self.timeseries_retention
     self.addCronEntry('monitor_collect', '* * * * *', command)
 
     # Write an empty file when monitor bootstrap went until the end
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010-2016 Vifib SARL and Contributors.
+# All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+
+"""
+Per minute, hour and day aggregates of the slapos collect database, stored
+in a sidecar sqlite file.
+
+Rows of the collector `user` and `folder` tables are read only once: the
+last rowid processed is kept as a high-water mark and every update only
+aggregates the rows written since the previous one. The collector database
+is only read.
+
+The date and time of the last processed row are kept too: if this row was
+removed by slapos collect, its rowid may have been reused by new rows, and
+rows newer than this date and time are read instead.
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+from slapos.monitor.collect import PartitionResourceSummary
+
+# period stored for each resolution, computed from the collector time column
+# (HH:MM:SS)
+RESOLUTION_PERIOD_LENGTH = (('minute', 5), ('hour', 2), ('day', 0))
+
+USER_COLUMN_LIST = ['cpu_percent', 'cpu_time', 'cpu_num_threads',
+                    'memory_percent', 'memory_rss', 'io_rw_counter',
+                    'io_cycles_counter']
+
+class ResourceRollup(object):
+
+  # days of history kept for each resolution, None means forever
+  retention_dict = {'minute': 7, 'hour': 90, 'day': None}
+
+  def __init__(self, db_path):
+    self.uri = db_path
+    self.connection = sqlite3.connect(self.uri)
+    self._createTables()
+
+  def close(self):
+    self.connection.close()
+    self.connection = None
+
+  def _createTables(self):
+    with self.connection:
+      self.connection.execute("""CREATE TABLE IF NOT EXISTS rollup_state
+        (name TEXT PRIMARY KEY, last_rowid INTEGER, last_date TEXT,
+         last_time TEXT)""")
+      column_list = [row[1] for row in self.connection.execute(
+        "PRAGMA table_info(rollup_state)")]
+      for column in ('last_date', 'last_time'):
+        if column not in column_list:
+          self.connection.execute(
+            "ALTER TABLE rollup_state ADD COLUMN %s TEXT" % column)
+      for resolution, _ in RESOLUTION_PERIOD_LENGTH:
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS user_%s
+          (partition TEXT, date TEXT, period TEXT, sample_count INTEGER,
+           process_count INTEGER, %s,
+           PRIMARY KEY (partition, date, period))""" % (resolution,
+          ', '.join('%s REAL' % column for column in USER_COLUMN_LIST)))
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS folder_%s
+          (partition TEXT, date TEXT, period TEXT, sample_count INTEGER,
+           disk_used REAL, PRIMARY KEY (partition, date, period))""" % (
+          resolution))
+
+  def _getHighWaterMark(self, name):
+    """ Return the rowid, date and time of the last processed row """
+    row = self.connection.execute("""SELECT last_rowid, last_date, last_time
+      FROM rollup_state WHERE name = ?""", (name,)).fetchone()
+    return tuple(row) if row is not None else (0, None, None)
+
+  def _addToAggregate(self, table, key, column_list, value_list):
+    """ Add value_list to the aggregate row identified by key """
+    update_sql = "UPDATE %s SET %s WHERE partition = ? AND date = ? " \
+                 "AND period = ?" % (table, ', '.join(
+                   '%s = %s + ?' % (column, column) for column in column_list))
+    if not self.connection.execute(update_sql,
+                                   list(value_list) + list(key)).rowcount:
+      self.connection.execute(
+        "INSERT INTO %s (partition, date, period, %s) VALUES (%s)" % (
+          table, ', '.join(column_list),
+          ', '.join('?' * (3 + len(column_list)))),
+        list(key) + list(value_list))
+
+  def _rollupTable(self, table, partition_id, select_list, column_list):
+    name = '%s:%s' % (table, partition_id)
+    last_rowid, last_date, last_time = self._getHighWaterMark(name)
+    max_row = self.connection.execute("""SELECT rowid, date, time
+      FROM collector.%s ORDER BY rowid DESC LIMIT 1""" % table).fetchone()
+    if max_row is None:
+      # the table is empty
+      max_row = 0, last_date, last_time
+    if last_date is not None and last_rowid and self.connection.execute(
+        "SELECT date, time FROM collector.%s WHERE rowid = ?" % table,
+        (last_rowid,)).fetchone() != (last_date, last_time):
+      # the last processed row was removed and its rowid may have been
+      # reused, so rows are selected on their date and time, which needs
+      # to read the whole table
+      where = "(date > ? OR (date = ? AND time > ?)) AND rowid <= ?"
+      parameter_list = [last_date, last_date, last_time, max_row[0]]
+    elif max_row[0] > last_rowid:
+      where = "rowid > ? AND rowid <= ?"
+      parameter_list = [last_rowid, max_row[0]]
+    else:
+      where = None
+    if where is not None:
+      # COUNT(DISTINCT time) is additive between minutes, and a collect
+      # snapshot is written in a single transaction so it can't be split
+      # between two updates
+      for row in self.connection.execute("""SELECT date, substr(time, 1, 5),
+          COUNT(DISTINCT time), %s FROM collector.%s
+          WHERE %s AND partition = ?
+          GROUP BY date, substr(time, 1, 5)""" % (
+            ', '.join(select_list), table, where),
+          parameter_list + [partition_id]).fetchall():
+        date, minute = row[:2]
+        for resolution, length in RESOLUTION_PERIOD_LENGTH:
+          self._addToAggregate('%s_%s' % (table, resolution),
+                               (partition_id, date, minute[:length]),
+                               ['sample_count'] + column_list,
+                               [value or 0 for value in row[2:]])
+    self.connection.execute("""INSERT OR REPLACE INTO rollup_state
+      (name, last_rowid, last_date, last_time) VALUES (?, ?, ?, ?)""",
+      (name,) + tuple(max_row))
+
+  def update(self, collector_db_path, partition_id):
+    """
+      Aggregate rows of partition_id added in the collector database since
+      the last update.
+    """
+    self.connection.execute("ATTACH DATABASE ? AS collector",
+                            (collector_db_path,))
+    try:
+      with self.connection:
+        self._rollupTable('user', partition_id,
+          ['COUNT(pid)'] + ['SUM(%s)' % column for column in USER_COLUMN_LIST],
+          ['process_count'] + USER_COLUMN_LIST)
+        if self.connection.execute("SELECT name FROM collector.sqlite_master "
+            "WHERE type='table' AND name='folder'").fetchone() is not None:
+          self._rollupTable('folder', partition_id, ['SUM(disk_used)'],
+                            ['disk_used'])
+        self._purge()
+    finally:
+      self.connection.execute("DETACH DATABASE collector")
+
+  def _purge(self):
+    """ Remove aggregates older than the retention, counted from last date """
+    for resolution, _ in RESOLUTION_PERIOD_LENGTH:
+      retention = self.retention_dict.get(resolution)
+      if retention is None:
+        continue
+      for table in ('user', 'folder'):
+        table = '%s_%s' % (table, resolution)
+        last_date, = self.connection.execute(
+          "SELECT MAX(date) FROM %s" % table).fetchone()
+        if last_date is None:
+          continue
+        limit_date = (datetime.strptime(last_date, '%Y-%m-%d') -
+                      timedelta(days=retention)).strftime('%Y-%m-%d')
+        self.connection.execute("DELETE FROM %s WHERE date < ?" % table,
+                                (limit_date,))
+
+  def getHistory(self, partition_id, resolution='hour', table='user',
+                 since=None, until=None):
+    """
+      Return the aggregated rows of partition_id as a list of dict, ordered
+      by date and period. since and until are dates (YYYY-MM-DD).
+    """
+    where = "partition = ?"
+    parameter_list = [partition_id]
+    if since is not None:
+      where += " AND date >= ?"
+      parameter_list.append(since)
+    if until is not None:
+      where += " AND date <= ?"
+      parameter_list.append(until)
+    cursor = self.connection.execute(
+      "SELECT * FROM %s_%s WHERE %s ORDER BY date, period" % (
+        table, resolution, where), parameter_list)
+    column_list = [description[0] for description in cursor.description]
+    return [dict(zip(column_list, row)) for row in cursor]
+
+  def _getRow(self, table, column_list, key):
+    return self.connection.execute(
+      "SELECT %s FROM %s WHERE partition = ? AND date = ? AND period = ?" % (
+        ', '.join(column_list), table), key).fetchone()
+
+  def getPartitionResourceSummary(self, partition_id, date_scope=None,
+                                  min_time=None):
+    """
+      Same result as ResourceCollect.getPartitionResourceSummary, read from
+      the aggregated tables.
+    """
+    now = datetime.now()
+    if date_scope is None:
+      date_scope = now.strftime('%Y-%m-%d')
+    if min_time is None:
+      min_time = (now - timedelta(minutes=1)).strftime('%H:%M:00')
+
+    def average(value_sum, amount, divider=1.0):
+      if value_sum is None or not amount:
+        return None
+      return round(value_sum/(amount*divider), 2)
+
+    day = self._getRow('user_day',
+                       ['sample_count', 'cpu_percent', 'memory_rss'],
+                       (partition_id, date_scope, '')) or (0, None, None)
+    minute = self._getRow('user_minute', ['process_count'] + USER_COLUMN_LIST,
+                          (partition_id, date_scope, min_time[:5])) or \
+      [0] + [None] * len(USER_COLUMN_LIST)
+    folder_day = self._getRow('folder_day', ['sample_count', 'disk_used'],
+                              (partition_id, date_scope, '')) or (0, None)
+    folder_minute = self._getRow('folder_minute', ['disk_used'],
+                                 (partition_id, date_scope, min_time[:5])) or \
+      (None,)
+
+    (total_process, cpu_percent, cpu_time, cpu_num_threads, memory_percent,
+     memory_rss, io_rw_counter, io_cycles_counter) = minute
+    return PartitionResourceSummary(
+      date='%s %s' % (date_scope, min_time),
+      cpu_percent_average=average(day[1], day[0]),
+      memory_used_average=average(day[2], day[0], 1024*1024.0),
+      disk_used_average=average(folder_day[1], folder_day[0], 1024.0),
+      total_process=total_process,
+      cpu_percent=round((cpu_percent or 0), 2),
+      cpu_time=round((cpu_time or 0)/(60.0), 2),
+      cpu_num_threads=round((cpu_num_threads or 0), 2),
+      memory_percent=round((memory_percent or 0), 2),
+      memory_rss=round((memory_rss or 0)/(1024*1024.0), 2),
+      io_rw_counter=round((io_rw_counter or 0), 2),
+      io_cycles_counter=round((io_cycles_counter or 0), 2),
+      disk_used=round((folder_minute[0] or 0)/1024.0, 2),
+    )
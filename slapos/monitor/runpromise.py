@@ -3,18 +3,46 @@
 
 import sys
 import os
+import errno
+import select
 import subprocess
 import json
 import psutil
 import time
+from collections import deque
 from shutil import copyfile
 import glob
 import argparse
 import traceback
+from slapos.monitor.history import PromiseHistory
 
 # Promise timeout after 12 seconds
 promise_timeout = 12
 
+# Time given to a timed out promise to exit after SIGTERM, before SIGKILL
+promise_kill_grace_time = 1
+
+# Scheduled promises run if their next run is less than this number of
+# seconds away, as runs started by cron are not exactly one period apart
+promise_schedule_tolerance = 5
+
+def stopProcess(process_handler, grace_time=promise_kill_grace_time):
+  """
+  Terminate process_handler, kill it if it is still running after
+  grace_time seconds, and reap it.
+  """
+  deadline = time.time() + grace_time
+  try:
+    process_handler.terminate()
+    while process_handler.poll() is None and time.time() < deadline:
+      time.sleep(0.05)
+    if process_handler.poll() is None:
+      process_handler.kill()
+  except OSError as e:
+    if e.errno != errno.ESRCH:
+      raise
+  process_handler.wait()
+
 def parseArguments():
   """
   Parse arguments for monitor collector instance.
@@ -45,6 +73,31 @@ def parseArguments():
   parser.add_argument('--hosting_name',
                       default='UNKNOWN Hosting Subscription',
                       help='Hosting Subscription name.')
+  parser.add_argument('--history_format',
+                      default='json', choices=['json', 'jsonl'],
+                      help='Format of status history files. jsonl history '
+                           'is appended to <name>.history.jsonl, and can be '
+                           'exported with monitor.history.')
+  parser.add_argument('--promise_workers',
+                      default=1, type=int,
+                      help='Number of promises of --promise_folder to run '
+                           'at the same time.')
+  parser.add_argument('--promise_min_period',
+                      default=60, type=int,
+                      help='Minimum time in seconds between two runs of a '
+                           'successful promise, when --promise_max_period '
+                           'is set.')
+  parser.add_argument('--promise_max_period',
+                      default=0, type=int,
+                      help='Maximum time in seconds between two runs of a '
+                           'successful promise. The period of a promise '
+                           'doubles, from --promise_min_period, every time it '
+                           'succeeds again. Failing or modified promises are '
+                           'run every time. 0 runs all promises every time.')
+  parser.add_argument('--promise_timeout',
+                      default=promise_timeout, type=int,
+                      help='Maximum time in seconds given to a promise to '
+                           'finish.')
 
   return parser
 
@@ -123,10 +176,12 @@ class RunPromise(object):
     promise_folder_list = [self.config.promise_folder]
     if self.config.monitor_promise_folder:
       promise_folder_list.append(self.config.monitor_promise_folder)
-    status_list = self.checkPromises(promise_folder_list)
     promises_status_file = os.path.join(self.config.output, '_promise_status')
+    promises_schedule_file = os.path.join(self.config.output,
+                                          '_promise_schedule')
     previous_state_dict = {}
     new_state_dict = {}
+    schedule_dict = {}
     base_dict = {
       '_links': {"monitor": {"href": self.config.monitor_url}},
       'instance': self.config.instance_name,
@@ -140,12 +195,32 @@ class RunPromise(object):
         except ValueError:
           pass
 
+    # next runs are computed from the start of this run, so that a promise
+    # whose period is a multiple of the cron period is not delayed by the
+    # duration of the run
+    start_time = time.time()
+    promise_list = self.getPromiseList(promise_folder_list)
+    max_period = getattr(self.config, 'promise_max_period', 0)
+    if max_period > 0:
+      if os.path.exists(promises_schedule_file):
+        with open(promises_schedule_file) as f:
+          try:
+            schedule_dict = json.loads(f.read())
+          except ValueError:
+            pass
+      promise_list = self.getScheduledPromiseList(promise_list,
+                                                  previous_state_dict,
+                                                  schedule_dict,
+                                                  new_state_dict,
+                                                  start_time)
+    status_list = self.checkPromiseList(promise_list)
+
     for status_dict in status_list:
       status_dict.update(base_dict)
       if previous_state_dict.has_key(status_dict['title']):
-        status, time = previous_state_dict[status_dict['title']].split('#')
+        status, change_time = previous_state_dict[status_dict['title']].split('#')
         if status_dict['status'] == status:
-          status_dict['change-time'] = float(time)
+          status_dict['change-time'] = float(change_time)
 
       promise_result_file = os.path.join(self.config.output, 
                                          "%s.status.json" % status_dict['title'])
@@ -163,8 +238,68 @@ class RunPromise(object):
     with open(promises_status_file, "w") as outputfile:
       json.dump(new_state_dict, outputfile)
 
+    if max_period > 0:
+      self.updatePromiseSchedule(promise_list, status_list,
+                                 previous_state_dict, schedule_dict,
+                                 start_time)
+      with open(promises_schedule_file, "w") as outputfile:
+        json.dump(schedule_dict, outputfile)
+
     os.remove(self.config.pid_path)
 
+  def getScheduledPromiseList(self, promise_list, previous_state_dict,
+                              schedule_dict, new_state_dict, now):
+    """
+      Return promises of promise_list which have to run at now. The state of
+      skipped promises is copied to new_state_dict, their status file is
+      kept as is.
+    """
+    scheduled_promise_list = []
+    title_list = [os.path.basename(promise_script)
+                  for promise_script in promise_list]
+    for title in schedule_dict.keys():
+      if title not in title_list:
+        # promise was removed
+        del schedule_dict[title]
+    for promise_script, title in zip(promise_list, title_list):
+      schedule = schedule_dict.get(title)
+      if schedule is not None and title in previous_state_dict and \
+          schedule['next-run'] > now + promise_schedule_tolerance and \
+          schedule['mtime'] == os.stat(promise_script).st_mtime and \
+          os.path.exists(os.path.join(self.config.output,
+                                      "%s.status.json" % title)):
+        new_state_dict[title] = previous_state_dict[title]
+      else:
+        scheduled_promise_list.append(promise_script)
+    return scheduled_promise_list
+
+  def updatePromiseSchedule(self, promise_list, status_list,
+                            previous_state_dict, schedule_dict, now):
+    """
+      Compute the next run of promises which ran at now: failing promises run
+      every time, the period of successful ones doubles at every success.
+    """
+    min_period = self.config.promise_min_period
+    max_period = self.config.promise_max_period
+    mtime_dict = dict((os.path.basename(promise_script),
+                       os.stat(promise_script).st_mtime)
+                      for promise_script in promise_list)
+    for status_dict in status_list:
+      title = status_dict['title']
+      previous_status = previous_state_dict.get(title, '#').split('#')[0]
+      if status_dict['status'] != 'OK':
+        period = 0
+      elif previous_status == 'OK' and title in schedule_dict:
+        period = min(max(schedule_dict[title]['period'] * 2, min_period),
+                     max_period)
+      else:
+        period = min(min_period, max_period)
+      schedule_dict[title] = {
+        'period': period,
+        'next-run': now + period,
+        'mtime': mtime_dict[title],
+      }
+
   def updateStatusHistoryFolder(self, name, status_file, history_folder, promise_type):
     history_path = os.path.join(history_folder)
     if not os.path.exists(status_file):
@@ -185,7 +320,22 @@ class RunPromise(object):
         traceback.print_exc()
         return
 
-    if promise_type == 'status':
+    if promise_type == 'status' and \
+        getattr(self.config, 'history_format', 'json') == 'jsonl':
+      history = PromiseHistory(history_path, name)
+      if not history.exists():
+        # keep the history written in the json format
+        history.importJsonFile(os.path.join(history_path,
+                                            '%s.history.json' % name))
+      status_dict.pop('_links', None)
+      if history.exists():
+        # Remove useless informations
+        status_dict.pop('hosting_subscription', '')
+        status_dict.pop('title', '')
+        status_dict.pop('instance', '')
+        status_dict.pop('type', '')
+      history.append(status_dict)
+    elif promise_type == 'status':
       filename = '%s.history.json' % name
       history_file = os.path.join(history_path, filename)
       # Remove links from history (not needed)
@@ -259,9 +409,9 @@ class RunPromise(object):
       stderr=subprocess.PIPE
     )
 
-  def checkPromises(self, promise_dir_list):
+  def getPromiseList(self, promise_dir_list):
     """
-      Run all promises found into specified folder
+      Return executable files found into specified folders
     """
     promise_list = []
     for promise_dir in promise_dir_list:
@@ -269,33 +419,53 @@ class RunPromise(object):
         continue
       promise_list.extend([os.path.join(promise_dir, promise)
                             for promise in os.listdir(promise_dir)])
+    return [promise_script for promise_script in promise_list
+            if os.path.isfile(promise_script) and
+               os.access(promise_script, os.X_OK)]
+
+  def getPromiseTimeout(self):
+    return getattr(self.config, 'promise_timeout', None) or promise_timeout
+
+  def newPromiseResult(self, promise_script):
+    return {
+      "status": "ERROR",
+      "type": "status",
+      "title": os.path.basename(promise_script),
+      "start-date" : time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())),
+      "change-time": time.time()
+    }
 
-    promise_result_list = []
+  def startPromise(self, promise_script):
+    process_handler = subprocess.Popen([promise_script],
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       stdin=subprocess.PIPE)
+    process_handler.stdin.flush()
+    process_handler.stdin.close()
+    process_handler.stdin = None
+    return process_handler
 
-    # Check whether every promise is kept
-    for promise_script in promise_list:
+  def checkPromises(self, promise_dir_list):
+    """
+      Run all promises found into specified folder
+    """
+    return self.checkPromiseList(self.getPromiseList(promise_dir_list))
 
-      if not os.path.isfile(promise_script) or not os.access(promise_script, os.X_OK):
-        # Not executable file
-        continue
+  def checkPromiseList(self, promise_list):
+    """
+      Run promises of promise_list
+    """
+    if getattr(self.config, 'promise_workers', 1) > 1:
+      return self.checkPromisesConcurrently(promise_list,
+                                            self.config.promise_workers)
 
-      command = [promise_script]
-      promise_name = os.path.basename(command[0])
-      result_dict = {
-        "status": "ERROR",
-        "type": "status",
-        "title": promise_name,
-        "start-date" : time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())),
-        "change-time": time.time()
-      }
+    promise_timeout = self.getPromiseTimeout()
+    promise_result_list = []
 
-      process_handler = subprocess.Popen(command,
-                                         stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE,
-                                         stdin=subprocess.PIPE)
-      process_handler.stdin.flush()
-      process_handler.stdin.close()
-      process_handler.stdin = None
+    # Check whether every promise is kept
+    for promise_script in promise_list:
+      result_dict = self.newPromiseResult(promise_script)
+      process_handler = self.startPromise(promise_script)
 
       sleep_time = 0.1
       increment_limit = int(promise_timeout / sleep_time)
@@ -325,6 +495,93 @@ class RunPromise(object):
 
     return promise_result_list
 
+  def checkPromisesConcurrently(self, promise_list, worker_count):
+    """
+      Run promises of promise_list, at most worker_count at the same time.
+
+      Outputs are read as soon as they are available by polling the pipes
+      of all running promises, results are returned in the order of
+      promise_list.
+    """
+    promise_timeout = self.getPromiseTimeout()
+    promise_result_list = [None] * len(promise_list)
+    waiting_queue = deque(enumerate(promise_list))
+    running_dict = {}   # index -> promise state
+    fd_dict = {}        # pipe file descriptor -> (index, output name)
+    poller = select.poll()
+
+    def finishPromise(index, timed_out=False):
+      state = running_dict.pop(index)
+      for fd, pipe in state['pipe_dict'].items():
+        poller.unregister(fd)
+        del fd_dict[fd]
+        pipe.close()
+      process_handler = state['process']
+      result_dict = state['result']
+      stdout = ''.join(state['stdout'])
+      stderr = ''.join(state['stderr'])
+      if timed_out:
+        stopProcess(process_handler)
+        result_dict["message"] = (stderr or stdout) + \
+          '\nPROMISE TIME OUT AFTER %s SECONDS' % promise_timeout
+      elif process_handler.wait() == 0:
+        result_dict["message"] = stdout
+        result_dict["status"] = "OK"
+      else:
+        result_dict["message"] = stderr or stdout
+      promise_result_list[index] = result_dict
+
+    while waiting_queue or running_dict:
+      while waiting_queue and len(running_dict) < worker_count:
+        index, promise_script = waiting_queue.popleft()
+        result_dict = self.newPromiseResult(promise_script)
+        process_handler = self.startPromise(promise_script)
+        state = running_dict[index] = {
+          'process': process_handler,
+          'result': result_dict,
+          'deadline': time.time() + promise_timeout,
+          'stdout': [],
+          'stderr': [],
+          'pipe_dict': {},
+        }
+        for name in ('stdout', 'stderr'):
+          pipe = getattr(process_handler, name)
+          state['pipe_dict'][pipe.fileno()] = pipe
+          fd_dict[pipe.fileno()] = (index, name)
+          poller.register(pipe.fileno(), select.POLLIN | select.POLLHUP)
+
+      now = time.time()
+      wait_time = max(0, min(state['deadline'] for state in
+                             running_dict.itervalues()) - now)
+      if any(not state['pipe_dict'] for state in running_dict.itervalues()):
+        # pipes were closed, but the process is still running
+        wait_time = min(wait_time, 0.1)
+      try:
+        event_list = poller.poll(wait_time * 1000)
+      except select.error as e:
+        if e.args[0] != errno.EINTR:
+          raise
+        event_list = []
+      for fd, _ in event_list:
+        index, name = fd_dict[fd]
+        state = running_dict[index]
+        data = os.read(fd, 4096)
+        if data:
+          state[name].append(data)
+        else:
+          poller.unregister(fd)
+          del fd_dict[fd]
+          state['pipe_dict'].pop(fd).close()
+
+      now = time.time()
+      for index, state in running_dict.items():
+        if not state['pipe_dict'] and state['process'].poll() is not None:
+          finishPromise(index)
+        elif state['deadline'] <= now:
+          finishPromise(index, timed_out=True)
+
+    return promise_result_list
+
 
 def main():
   arg_parser = parseArguments()
@@ -7,7 +7,7 @@ import hashlib
 import PyRSS2Gen
 import argparse
 
-def parseArguments():
+def parseArguments(argument_list=None):
   """
   Parse arguments for monitor Rss Generator.
   """
@@ -28,43 +28,95 @@ def parseArguments():
   parser.add_argument('--hosting_name',
                       default='',
                       help='Hosting Subscription name.')
+  parser.add_argument('--index_file',
+                      help='Path of the file where feed items are kept, so '
+                           'only modified status files are read again.')
+  parser.add_argument('--max_items',
+                      default=0, type=int,
+                      help='Maximum number of items in the feed, newest '
+                           'ones are kept. 0 means no limit.')
 
-  return parser.parse_args()
+  return parser.parse_args(argument_list)
 
-def getKey(item):
-  return item.pubDate
+def loadItemIndex(index_file):
+  if index_file and os.path.exists(index_file):
+    with open(index_file) as f:
+      try:
+        return json.loads(f.read())
+      except ValueError:
+        pass
+  return {}
+
+def updateItemIndex(items_folder, index_dict):
+  """
+    Update index_dict from status files of items_folder, only modified
+    status files are read. Return True if the index changed.
+  """
+  index_changed = False
+  filename_set = set()
+  for filename in os.listdir(items_folder):
+    if not filename.endswith(".status.json"):
+      continue
+    filename_set.add(filename)
+    filepath = os.path.join(items_folder, filename)
+    try:
+      stat = os.stat(filepath)
+    except OSError:
+      continue
+    signature = [stat.st_mtime, stat.st_size]
+    if filename in index_dict and index_dict[filename]['signature'] == signature:
+      continue
+    try:
+      result_dict = json.load(open(filepath, "r"))
+    except ValueError:
+      print "Failed to load json file: %s" % filepath
+      continue
+    index_dict[filename] = {
+      'signature': signature,
+      'title': result_dict['title'],
+      'status': result_dict['status'],
+      'message': result_dict.get('message', ''),
+      'change-time': result_dict['change-time'],
+    }
+    index_changed = True
+  for filename in index_dict.keys():
+    if filename not in filename_set:
+      del index_dict[filename]
+      index_changed = True
+  return index_changed
+
+def newRSSItem(item, parser):
+  description = item['message']
+  event_time = datetime.fromtimestamp(item['change-time'])
+  return PyRSS2Gen.RSSItem(
+    categories = [item['status']],
+    source = PyRSS2Gen.Source(item['title'], parser.public_url),
+    title = '[%s] %s' % (item['status'], item['title']),
+    comments = description,
+    description = "%s: %s\n%s" % (event_time, item['status'], description),
+    link = parser.private_url,
+    pubDate = event_time,
+    guid = PyRSS2Gen.Guid(base64.b64encode("%s, %s" % (parser.hosting_name, item['title'])))
+  )
 
-def genrss():
-  parser = parseArguments()
+def genrss(parser=None):
+  if parser is None:
+    parser = parseArguments()
 
-  rss_item_list = []
   report_date = datetime.utcnow()
-  for filename in os.listdir(parser.items_folder):
-    if filename.endswith(".status.json"):
-      filepath = os.path.join(parser.items_folder, filename)
-      result_dict = None
-      try:
-        result_dict = json.load(open(filepath, "r"))
-      except ValueError:
-        print "Failed to load json file: %s" % filepath
-        continue
-      description = result_dict.get('message', '')
-      event_time = datetime.fromtimestamp(result_dict['change-time'])
-      rss_item = PyRSS2Gen.RSSItem(
-        categories = [result_dict['status']],
-        source = PyRSS2Gen.Source(result_dict['title'], parser.public_url),
-        title = '[%s] %s' % (result_dict['status'], result_dict['title']),
-        comments = description,
-        description = "%s: %s\n%s" % (event_time, result_dict['status'], description),
-        link = parser.private_url,
-        pubDate = event_time,
-        guid = PyRSS2Gen.Guid(base64.b64encode("%s, %s" % (parser.hosting_name, result_dict['title'])))
-      )
-      rss_item_list.append(rss_item)
+  index_dict = loadItemIndex(parser.index_file)
+  if updateItemIndex(parser.items_folder, index_dict) and parser.index_file:
+    with open(parser.index_file, 'w') as findex:
+      findex.write(json.dumps(index_dict))
 
+  # oldest items first, keep only the newest ones
+  item_list = sorted(index_dict.itervalues(),
+                     key=lambda item: (item['change-time'], item['title']))
+  if parser.max_items > 0:
+    item_list = item_list[-parser.max_items:]
+  rss_item_list = [newRSSItem(item, parser) for item in item_list]
 
   ### Build the rss feed
-  sorted(rss_item_list, key=getKey)
   rss_feed = PyRSS2Gen.RSS2 (
     title = parser.instance_name,
     link = parser.feed_url,
@@ -73,8 +125,11 @@ def genrss():
     items = rss_item_list
     )
 
-  with open(parser.output, 'w') as frss:
+  # write to a temporary file first, so the feed is never read half written
+  temp_output = '%s.tmp' % parser.output
+  with open(temp_output, 'w') as frss:
     frss.write(rss_feed.to_xml())
+  os.rename(temp_output, parser.output)
 
 def main():
   exit(genrss())
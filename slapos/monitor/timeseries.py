@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010-2016 Vifib SARL and Contributors.
+# All Rights Reserved.
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsibility of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# guarantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+##############################################################################
+
+"""
+Bounded storage for the monitor *.data.json statistic files.
+
+Those files contain a header and one "date, value, value..." string per
+collect. Rows are stored in a sqlite database and, as they get older, are
+merged into buckets of lower resolution, so the amount of rows exported to
+the json file stays bounded whatever the age of the partition.
+
+Compaction is done at most every COMPACT_INTERVAL seconds. In between, the
+new rows are only appended to the json file instead of exporting it again.
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# (maximum age in seconds, resolution in seconds) of every storage tier.
+# Rows are kept with full resolution for one day, then merged in 5 minutes
+# buckets for 30 days, then in hourly buckets for a year.
+DEFAULT_RETENTION_POLICY = ((86400, 0), (30 * 86400, 300), (365 * 86400, 3600))
+
+# minimum interval in seconds between two compactions of a store
+COMPACT_INTERVAL = 3600
+
+_DURATION_UNIT_DICT = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parseDuration(value):
+  """ Convert "30", "5m", "24h" or "30d" to seconds """
+  value = value.strip()
+  if value[-1] in _DURATION_UNIT_DICT:
+    return int(value[:-1]) * _DURATION_UNIT_DICT[value[-1]]
+  return int(value)
+
+def parseRetentionPolicy(policy):
+  """
+    Parse a retention policy written as "max_age:resolution" pairs separated
+    by comas, ordered by age. Example: "24h:0,30d:5m,365d:1h"
+    The first tier keeps the collected rows, so its resolution must be 0,
+    the resolution of the next ones must be positive.
+  """
+  policy_list = []
+  for tier in policy.split(','):
+    max_age, resolution = tier.split(':')
+    resolution = parseDuration(resolution)
+    if policy_list and resolution <= 0:
+      raise ValueError("Resolution of tier %r must be positive" % tier)
+    if not policy_list and resolution != 0:
+      raise ValueError("Resolution of first tier %r must be 0" % tier)
+    policy_list.append((parseDuration(max_age), resolution))
+  return tuple(policy_list)
+
+def _parseValue(value):
+  value = value.strip()
+  try:
+    return int(value)
+  except ValueError:
+    return float(value)
+
+def _formatValue(value):
+  if isinstance(value, float):
+    return str(round(value, 2))
+  return str(value)
+
+
+class TimeSeriesStore(object):
+
+  def __init__(self, db_path, retention_policy=DEFAULT_RETENTION_POLICY):
+    self.uri = db_path
+    self.retention_policy = retention_policy
+    self.connection = sqlite3.connect(self.uri)
+    with self.connection:
+      self.connection.execute("""CREATE TABLE IF NOT EXISTS series
+        (name TEXT PRIMARY KEY, header TEXT, date REAL)""")
+      self.connection.execute("""CREATE TABLE IF NOT EXISTS point
+        (name TEXT, resolution INTEGER, timestamp INTEGER,
+         sample_count INTEGER, value_list TEXT,
+         PRIMARY KEY (name, resolution, timestamp))""")
+      self.connection.execute("""CREATE TABLE IF NOT EXISTS property
+        (name TEXT PRIMARY KEY, value TEXT)""")
+
+  def close(self):
+    self.connection.close()
+    self.connection = None
+
+  def getProperty(self, name, default=None):
+    row = self.connection.execute("SELECT value FROM property WHERE name = ?",
+                                  (name,)).fetchone()
+    return default if row is None else json.loads(row[0])
+
+  def setProperty(self, name, value):
+    with self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO property (name, value) VALUES (?, ?)",
+        (name, json.dumps(value)))
+
+  def hasSeries(self, name):
+    return self.connection.execute("SELECT name FROM series WHERE name = ?",
+                                   (name,)).fetchone() is not None
+
+  def createSeries(self, name, header, date=None):
+    with self.connection:
+      self.connection.execute(
+        "INSERT OR IGNORE INTO series (name, header, date) VALUES (?, ?, ?)",
+        (name, header, time.time() if date is None else date))
+
+  def importJsonFile(self, name, json_file):
+    """
+      Create series name from an existing statistic file, keeping its
+      header, its creation date and its rows. Malformed rows are skipped.
+    """
+    with open(json_file) as f:
+      data_dict = json.load(f)
+    header = data_dict['data'][0]
+    self.createSeries(name, header, data_dict.get('date'))
+    for line in data_dict['data'][1:]:
+      try:
+        self.append(name, line, commit=False)
+      except (ValueError, AttributeError):
+        pass
+    self.connection.commit()
+
+  def append(self, name, line, commit=True):
+    """ Add a "date, value, value..." row to series name, return its
+        timestamp
+    """
+    date, value_list = line.split(',', 1)
+    timestamp = int(time.mktime(time.strptime(date.strip(), DATE_FORMAT)))
+    value_list = [_parseValue(value) for value in value_list.split(',')]
+    self.connection.execute("""INSERT OR REPLACE INTO point
+      (name, resolution, timestamp, sample_count, value_list)
+      VALUES (?, 0, ?, 1, ?)""", (name, timestamp, json.dumps(value_list)))
+    if commit:
+      self.connection.commit()
+    return timestamp
+
+  def isCompactionDue(self, now=None):
+    last_compaction = self.getProperty('last_compaction')
+    return last_compaction is None or \
+      (time.time() if now is None else now) - last_compaction >= \
+      COMPACT_INTERVAL
+
+  def compact(self, now=None):
+    """
+      Merge rows older than the maximum age of their tier into the next
+      tier, and drop the rows older than the last tier.
+    """
+    if now is None:
+      now = time.time()
+    with self.connection:
+      for index, (max_age, resolution) in enumerate(self.retention_policy):
+        limit = int(now - max_age)
+        if index + 1 < len(self.retention_policy):
+          next_resolution = self.retention_policy[index + 1][1]
+          for name, timestamp, sample_count, value_list in \
+              self.connection.execute("""SELECT name, timestamp, sample_count,
+                value_list FROM point WHERE resolution = ? AND timestamp < ?
+                """, (resolution, limit)).fetchall():
+            self._mergePoint(name, next_resolution,
+                             timestamp - timestamp % next_resolution,
+                             sample_count, json.loads(value_list))
+        self.connection.execute(
+          "DELETE FROM point WHERE resolution = ? AND timestamp < ?",
+          (resolution, limit))
+      self.connection.execute(
+        "INSERT OR REPLACE INTO property (name, value) VALUES (?, ?)",
+        ('last_compaction', json.dumps(now)))
+
+  def _mergePoint(self, name, resolution, timestamp, sample_count,
+                  value_list):
+    row = self.connection.execute("""SELECT sample_count, value_list
+      FROM point WHERE name = ? AND resolution = ? AND timestamp = ?""",
+      (name, resolution, timestamp)).fetchone()
+    if row is not None:
+      # weighted average of both points
+      total_count = row[0] + sample_count
+      value_list = [
+        (float(bucket_value) * row[0] + float(value) * sample_count) /
+          total_count
+        for bucket_value, value in zip(json.loads(row[1]), value_list)]
+      sample_count = total_count
+    self.connection.execute("""INSERT OR REPLACE INTO point
+      (name, resolution, timestamp, sample_count, value_list)
+      VALUES (?, ?, ?, ?, ?)""",
+      (name, resolution, timestamp, sample_count, json.dumps(value_list)))
+
+  def export(self, name, since=None, until=None):
+    """
+      Return series name in the statistic file format, limited to rows
+      between since and until timestamps.
+    """
+    header, date = self.connection.execute(
+      "SELECT header, date FROM series WHERE name = ?", (name,)).fetchone()
+    where = "name = ?"
+    parameter_list = [name]
+    if since is not None:
+      where += " AND timestamp >= ?"
+      parameter_list.append(since)
+    if until is not None:
+      where += " AND timestamp <= ?"
+      parameter_list.append(until)
+    data_list = [header]
+    for timestamp, value_list in self.connection.execute(
+        "SELECT timestamp, value_list FROM point WHERE %s "
+        "ORDER BY timestamp, resolution" % where, parameter_list):
+      data_list.append(', '.join(
+        [time.strftime(DATE_FORMAT, time.localtime(timestamp))] +
+        [_formatValue(value) for value in json.loads(value_list)]))
+    return {"date": date, "data": data_list}
+
+  def _setExportedFile(self, name, json_file):
+    stat = os.stat(json_file)
+    self.setProperty('export:%s' % name,
+                     [json_file, stat.st_mtime, stat.st_size])
+
+  def isExportedFile(self, name, json_file):
+    """ Return whether json_file was written by the last export of name """
+    try:
+      stat = os.stat(json_file)
+    except OSError:
+      return False
+    return self.getProperty('export:%s' % name) == \
+      [json_file, stat.st_mtime, stat.st_size]
+
+  def exportToFile(self, name, json_file, since=None, until=None):
+    temp_file = '%s.tmp' % json_file
+    with open(temp_file, 'w') as f:
+      f.write(json.dumps(self.export(name, since, until)))
+    os.rename(temp_file, json_file)
+    self._setExportedFile(name, json_file)
+
+  def appendToFile(self, name, json_file, since, until=None):
+    """
+      Add the rows between since and until timestamps at the end of
+      json_file, which must have been written by exportToFile.
+    """
+    line_list = self.export(name, since, until)['data'][1:]
+    if line_list:
+      with open(json_file, 'r+') as f:
+        # replace the closing ']}' of the json document
+        f.seek(-2, 2)
+        f.write(''.join(', %s' % json.dumps(line) for line in line_list))
+        f.write(']}')
+      self._setExportedFile(name, json_file)
+
+
+def appendToSeries(db_path, json_file, content, retention_policy=None):
+  """
+    Drop-in replacement of appending content to json_file: content is added
+    to the store and to json_file. json_file is only exported again from the
+    store when it was compacted, or when the file is not the last export.
+  """
+  name = os.path.basename(json_file).split('.')[0]
+  store = TimeSeriesStore(db_path,
+                          retention_policy or DEFAULT_RETENTION_POLICY)
+  try:
+    if not store.hasSeries(name):
+      store.importJsonFile(name, json_file)
+    timestamp = store.append(name, content)
+    compacted = store.isCompactionDue()
+    if compacted:
+      store.compact()
+    if compacted or not store.isExportedFile(name, json_file):
+      store.exportToFile(name, json_file)
+    else:
+      store.appendToFile(name, json_file, timestamp, timestamp)
+  finally:
+    store.close()
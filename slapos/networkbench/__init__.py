@@ -2,7 +2,6 @@ import socket
 import logging
 import time
 import logging.handlers
-import subprocess
 import re
 import sys
 import shutil
@@ -12,9 +11,11 @@ import pycurl
 import argparse
 import json
 from StringIO import StringIO
-from ping import ping, ping6
-from dnsbench import resolve
-from http import get_curl, request
+from http import get_curl
+from engine import run_concurrently, run_sequentially
+from sink import SegmentHandler, compress_file
+from daemon import ConfigurationLoader, NetworkBenchDaemon, \
+  RollingStatistics, StatisticsHandler
 import textwrap
 
 class HelpFormatter(argparse.ArgumentDefaultsHelpFormatter):
@@ -115,12 +116,9 @@ def rotate_logfile(handler, log_file):
     today = time.strftime("%Y-%m-%d")
     shutil.move("%s.%s" % (log_file, today),
                 "%s.%s" % (log_file, last_date))
-    # The simpler the better
-    sp = subprocess.Popen("gzip %s.%s" % (log_file, last_date),
-               stdout=subprocess.PIPE, stdin=subprocess.PIPE, shell=True)
-    sp.communicate()
+    compress_file("%s.%s" % (log_file, last_date))
 
-def create_logger(name, log_folder, verbose):
+def create_logger(name, log_folder, verbose, sink_folder=None):
   new_logger = logging.getLogger(name)
 
   new_logger.setLevel(logging.DEBUG)
@@ -139,27 +137,37 @@ def create_logger(name, log_folder, verbose):
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(logging.Formatter(format))
     new_logger.addHandler(handler)
-  return new_logger
-
-def run_all(config_dict, log_folder, verbose):
-  dns_logger = create_logger("dns", log_folder, verbose)
-  name_dict = config_dict.get("dns", {})
-  for name in name_dict:
-    expected = name_dict[name].get("expected")
-    dns_logger.info(';'.join(str(x) for x in resolve(name, expected)))
-
-  ping_logger = create_logger("ping", log_folder, verbose)
-  for host in config_dict.get("ping",[]):
-    ping_logger.info(';'.join(str(x) for x in ping(host)))
 
-  ping6_logger = create_logger("ping6", log_folder, verbose)
-  for host in config_dict.get("ping6", []):
-    ping6_logger.info(';'.join(str(x) for x in ping6(host)))
+  if sink_folder:
+    new_logger.addHandler(SegmentHandler(sink_folder, name, botname))
+  return new_logger
 
-  http_logger = create_logger("http", log_folder, verbose)
-  url_dict = config_dict.get("url", {})
-  for url in url_dict:
-    http_logger.info(';'.join(str(x) for x in request(url, url_dict[url])))
+def run_all(config_dict, log_folder, verbose, max_concurrency=1,
+            sink_folder=None):
+  logger_dict = dict((name, create_logger(name, log_folder, verbose,
+                                          sink_folder))
+                     for name in ("dns", "ping", "ping6", "http"))
+  if max_concurrency > 1:
+    run_concurrently(config_dict, logger_dict, max_concurrency)
+  else:
+    run_sequentially(config_dict, logger_dict)
+
+def run_daemon(config_path, log_folder, verbose, period_dict, jitter=0.1,
+               max_concurrency=1, config_refresh=600, sink_folder=None,
+               statistics_file=None, statistics_window=900):
+  statistics = RollingStatistics(statistics_window)
+  logger_dict = {}
+  for name in ("dns", "ping", "ping6", "http"):
+    logger = logger_dict[name] = create_logger(name, log_folder, verbose,
+                                               sink_folder)
+    logger.addHandler(StatisticsHandler(statistics, name))
+  daemon = NetworkBenchDaemon(ConfigurationLoader(config_path), logger_dict,
+                              period_dict, jitter=jitter,
+                              max_concurrency=max_concurrency,
+                              config_refresh=config_refresh,
+                              statistics=statistics,
+                              statistics_file=statistics_file)
+  daemon.run()
 
 def main():
   parser = argparse.ArgumentParser(
@@ -174,9 +182,57 @@ def main():
   _('-d', '--delay', default=random.randint(0, 30), 
                      help="Delay before start to run," \
                           "as this script can be called on cron.")
+  _('-m', '--max-concurrency', type=int, default=1,
+                     help="Maximum number of probes of each kind (dns and "
+                          "ping, http) run at the same time.")
+  _('-s', '--sink-dir',
+                     help="Directory where results are also written as daily "
+                          "CSV segments, to be queried with "
+                          "networkbench-query.")
+  _('-D', '--daemon', action='store_true',
+                     help="Run continuously, each kind of probe at its own "
+                          "period, instead of once.")
+  _('--config-refresh', type=float, default=600,
+                     help="Daemon mode: interval in seconds between checks "
+                          "of configuration changes.")
+  _('--dns-period', type=float, default=60,
+                     help="Daemon mode: interval in seconds between dns "
+                          "probes, 0 to disable them.")
+  _('--ping-period', type=float, default=60,
+                     help="Daemon mode: interval in seconds between ping "
+                          "probes, 0 to disable them.")
+  _('--http-period', type=float, default=60,
+                     help="Daemon mode: interval in seconds between http "
+                          "probes, 0 to disable them.")
+  _('--jitter', type=float, default=0.1,
+                     help="Daemon mode: random variation of the periods, as "
+                          "a fraction of them.")
+  _('--stats-file',
+                     help="Daemon mode: JSON file where latency statistics "
+                          "of the last results are written.")
+  _('--stats-window', type=float, default=900,
+                     help="Daemon mode: time in seconds covered by the "
+                          "statistics.")
 
   config = parser.parse_args()
 
+  if config.daemon:
+    run_daemon(config.conf.strip(),
+               log_folder=config.logdir,
+               verbose=config.verbose,
+               period_dict={
+                 'dns': config.dns_period,
+                 'ping': config.ping_period,
+                 'http': config.http_period,
+               },
+               jitter=config.jitter,
+               max_concurrency=config.max_concurrency,
+               config_refresh=config.config_refresh,
+               sink_folder=config.sink_dir,
+               statistics_file=config.stats_file,
+               statistics_window=config.stats_window)
+    return
+
   print("Downloading %s..." % config.conf.strip())
   config_dict = load_configuration(config.conf)
 
@@ -185,5 +241,7 @@ def main():
 
   run_all(config_dict, 
           log_folder=config.logdir, 
-          verbose=config.verbose)
+          verbose=config.verbose,
+          max_concurrency=config.max_concurrency,
+          sink_folder=config.sink_dir)
 
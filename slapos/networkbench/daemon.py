@@ -0,0 +1,276 @@
+"""
+Continuous mode of networkbench.
+
+Every kind of probe runs in its own thread at its own period, with some
+jitter so that bots do not probe the same targets at the same time. Curl
+handles and the DNS resolver are kept between runs. The configuration is
+checked for changes at its own interval, with a conditional request when
+it is remote, and rolling statistics of the last results are written to
+a JSON file.
+"""
+
+import collections
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from StringIO import StringIO
+
+import dns.resolver
+import pycurl
+
+from engine import run_concurrently, run_sequentially
+from http import new_curl
+from sink import FIELD_DICT, LATENCY_FIELD_DICT, SUCCESS_DICT, get_row, \
+  percentile
+
+# probe kind -> keys of the configuration it runs
+PROBE_DICT = {
+  'dns': ('dns',),
+  'ping': ('ping', 'ping6'),
+  'http': ('url',),
+}
+
+# interval in seconds between writes of the statistics file
+STATISTICS_INTERVAL = 60
+
+class ConfigurationLoader(object):
+  """ Load the configuration again only if it changed """
+
+  def __init__(self, path):
+    self.path = path
+    self.config_dict = {}
+    self.mtime = None
+    self.etag = None
+    self.last_modified = None
+    self.curl = None
+
+  def is_url(self):
+    return self.path.split('://', 1)[0] in ('http', 'https', 'ftp', 'file')
+
+  def read(self):
+    mtime = os.stat(self.path).st_mtime
+    if mtime == self.mtime:
+      return None
+    with open(self.path) as f:
+      config_dict = json.load(f)
+    self.mtime = mtime
+    return config_dict
+
+  def download(self):
+    if self.curl is None:
+      self.curl = pycurl.Curl()
+    buffer = StringIO()
+    curl = new_curl(buffer, self.path, self.curl)
+    header_list = []
+    curl.setopt(curl.HEADERFUNCTION, header_list.append)
+    request_header_list = []
+    if self.etag:
+      request_header_list.append('If-None-Match: %s' % self.etag)
+    if self.last_modified:
+      request_header_list.append('If-Modified-Since: %s' % self.last_modified)
+    curl.setopt(curl.HTTPHEADER, request_header_list)
+    curl.perform()
+
+    response_code = curl.getinfo(pycurl.HTTP_CODE)
+    if response_code == 304:
+      return None
+    if response_code not in (200, 0):
+      raise IOError("Unexpected response %s" % response_code)
+    config_dict = json.loads(buffer.getvalue())
+    self.etag = self.last_modified = None
+    for header in header_list:
+      name, _, value = header.partition(':')
+      name = name.strip().lower()
+      if name == 'etag':
+        self.etag = value.strip()
+      elif name == 'last-modified':
+        self.last_modified = value.strip()
+    return config_dict
+
+  def refresh(self):
+    """ Load the configuration if it changed, and return True if it did.
+        The previous configuration is kept if it can not be loaded.
+    """
+    try:
+      config_dict = self.download() if self.is_url() else self.read()
+    except (IOError, OSError, ValueError, pycurl.error):
+      print "Unable to load configuration %s, error:" % self.path
+      traceback.print_exc(file=sys.stderr)
+      sys.stderr.flush()
+      return False
+    if config_dict is None or config_dict == self.config_dict:
+      return False
+    self.config_dict = config_dict
+    return True
+
+  def close(self):
+    if self.curl is not None:
+      self.curl.close()
+      self.curl = None
+
+class RollingStatistics(object):
+  """ Latency of the results of the last window seconds, per target """
+
+  def __init__(self, window=900):
+    self.window = window
+    self.lock = threading.Lock()
+    # (kind, target) -> deque of (timestamp, latency or None if failed)
+    self.result_dict = {}
+
+  def add(self, kind, timestamp, info_list):
+    field_dict = dict(zip(FIELD_DICT[kind], get_row(kind, info_list)))
+    success_field, success_value = SUCCESS_DICT[kind]
+    latency = field_dict[LATENCY_FIELD_DICT[kind]]
+    if str(field_dict[success_field]) != success_value or not latency:
+      latency = None
+    else:
+      latency = float(latency)
+    key = kind, field_dict[FIELD_DICT[kind][0]]
+    with self.lock:
+      result_deque = self.result_dict.setdefault(key, collections.deque())
+      result_deque.append((timestamp, latency))
+      while result_deque[0][0] < timestamp - self.window:
+        result_deque.popleft()
+
+  def get_summary(self, now=None):
+    """ Return {kind: {target: {count, failed, last, p50, p90, p99}}},
+        latencies being in milliseconds.
+    """
+    limit = (now or time.time()) - self.window
+    summary_dict = {}
+    with self.lock:
+      for key, result_deque in self.result_dict.items():
+        while result_deque and result_deque[0][0] < limit:
+          result_deque.popleft()
+        if not result_deque:
+          del self.result_dict[key]
+          continue
+        kind, target = key
+        latency_list = sorted(latency for _, latency in result_deque
+                              if latency is not None)
+        target_dict = summary_dict.setdefault(kind, {})[target] = {
+          'count': len(result_deque),
+          'failed': len(result_deque) - len(latency_list),
+          'last': result_deque[-1][1],
+        }
+        for value in (50, 90, 99):
+          target_dict['p%s' % value] = percentile(latency_list, value) \
+            if latency_list else None
+    return summary_dict
+
+  def write(self, path):
+    temp_path = '%s.tmp' % path
+    with open(temp_path, 'w') as f:
+      json.dump({
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'window': self.window,
+        'statistics': self.get_summary(),
+      }, f)
+    os.rename(temp_path, path)
+
+class StatisticsHandler(logging.Handler):
+  """ Add the results logged with an info_list extra attribute to
+      statistics.
+  """
+
+  def __init__(self, statistics, kind):
+    logging.Handler.__init__(self)
+    self.statistics = statistics
+    self.kind = kind
+
+  def emit(self, record):
+    info_list = getattr(record, 'info_list', None)
+    if info_list is None:
+      return
+    try:
+      self.statistics.add(self.kind, record.created, info_list)
+    except Exception:
+      self.handleError(record)
+
+class NetworkBenchDaemon(object):
+
+  def __init__(self, loader, logger_dict, period_dict, jitter=0.1,
+               max_concurrency=1, config_refresh=600, statistics=None,
+               statistics_file=None):
+    self.loader = loader
+    self.logger_dict = logger_dict
+    self.period_dict = period_dict
+    self.jitter = jitter
+    self.max_concurrency = max_concurrency
+    self.config_refresh = config_refresh
+    self.statistics = statistics
+    self.statistics_file = statistics_file
+    self.stop_event = threading.Event()
+
+  def get_delay(self, period):
+    return period * (1 + random.uniform(-self.jitter, self.jitter))
+
+  def run_probe(self, kind):
+    """ Run the probes of kind every period, until stopped """
+    period = self.period_dict[kind]
+    resolver = dns.resolver.Resolver()
+    # connections are kept between runs
+    curl = pycurl.Curl()
+    multi = pycurl.CurlMulti()
+    try:
+      self.stop_event.wait(random.uniform(0, period * self.jitter))
+      while not self.stop_event.is_set():
+        start = time.time()
+        config_dict = self.loader.config_dict
+        probe_config_dict = dict((key, config_dict[key])
+                                 for key in PROBE_DICT[kind]
+                                 if key in config_dict)
+        try:
+          if self.max_concurrency > 1:
+            run_concurrently(probe_config_dict, self.logger_dict,
+                             self.max_concurrency, resolver, multi)
+          else:
+            run_sequentially(probe_config_dict, self.logger_dict, resolver,
+                             curl)
+        except Exception:
+          traceback.print_exc(file=sys.stderr)
+          sys.stderr.flush()
+        self.stop_event.wait(max(0, start + self.get_delay(period)
+                                    - time.time()))
+    finally:
+      curl.close()
+      multi.close()
+
+  def stop(self):
+    self.stop_event.set()
+
+  def run(self):
+    self.loader.refresh()
+    thread_list = []
+    for kind, period in self.period_dict.iteritems():
+      if period > 0:
+        thread = threading.Thread(target=self.run_probe, args=(kind,))
+        thread.daemon = True
+        thread.start()
+        thread_list.append(thread)
+
+    interval = self.config_refresh
+    if self.statistics_file:
+      interval = min(interval, STATISTICS_INTERVAL)
+    next_refresh = time.time() + self.config_refresh
+    try:
+      while not self.stop_event.is_set():
+        self.stop_event.wait(interval)
+        if time.time() >= next_refresh:
+          if self.loader.refresh():
+            print "Configuration %s changed" % self.loader.path
+          next_refresh = time.time() + self.config_refresh
+        if self.statistics_file:
+          self.statistics.write(self.statistics_file)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.stop()
+      for thread in thread_list:
+        thread.join()
+      self.loader.close()
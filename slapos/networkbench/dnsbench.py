@@ -2,12 +2,14 @@ import socket
 import time
 import dns.resolver
 
-def resolve(name, expected_list=None):
-  """ Resolve name using standard system name resolution.
+def resolve(name, expected_list=None, resolver=None):
+  """ Resolve name using standard system name resolution, or resolver.
   """
+  if resolver is None:
+    resolver = dns.resolver.get_default_resolver()
   begin = time.time()
   try:
-    ip_list = [i.to_text() for i in dns.resolver.query(name, "A")]
+    ip_list = [i.to_text() for i in resolver.query(name, "A")]
     resolution = 200
     status = "OK"
   except dns.resolver.NXDOMAIN:
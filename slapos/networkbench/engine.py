@@ -0,0 +1,92 @@
+import sys
+import threading
+import traceback
+from Queue import Queue
+
+import icmp
+from ping import ping, ping6, ping_list
+from dnsbench import resolve
+from http import request, request_multi
+
+def log_result(logger, info_list):
+  logger.info(';'.join(str(x) for x in info_list),
+              extra={'info_list': info_list})
+
+def run_task(logger, function, args):
+  result = function(*args)
+  # ping_list returns the results of several hosts
+  for info_list in result if isinstance(result, list) else (result,):
+    log_result(logger, info_list)
+
+def get_task_list(config_dict, logger_dict, resolver=None, native_ping=False):
+  """ Return the (logger, function, argument tuple) of the dns and ping
+      probes of config_dict, in the order they are run by run_all.
+      With native_ping, hosts are pinged from an ICMP socket when it is
+      allowed, instead of running the ping command for each host.
+  """
+  task_list = []
+  name_dict = config_dict.get("dns", {})
+  for name in name_dict:
+    task_list.append((logger_dict["dns"], resolve,
+                      (name, name_dict[name].get("expected"), resolver)))
+  for name, protocol, function in (("ping", "4", ping),
+                                   ("ping6", "6", ping6)):
+    host_list = config_dict.get(name, [])
+    if host_list and native_ping and icmp.is_available(protocol):
+      # all hosts are pinged at the same time over one socket
+      task_list.append((logger_dict[name], ping_list,
+                        (host_list, 10, protocol)))
+    else:
+      for host in host_list:
+        task_list.append((logger_dict[name], function, (host,)))
+  return task_list
+
+def worker(queue):
+  while True:
+    task = queue.get()
+    if task is None:
+      break
+    try:
+      run_task(*task)
+    except Exception:
+      traceback.print_exc(file=sys.stderr)
+      sys.stderr.flush()
+
+def run_concurrently(config_dict, logger_dict, max_concurrency,
+                     resolver=None, multi=None):
+  """ Run every probe of config_dict, at most max_concurrency dns and
+      ping probes and max_concurrency http requests at the same time.
+      Results are logged as soon as they are available.
+      resolver and multi are reused for dns and http probes if given.
+  """
+  queue = Queue()
+  task_list = get_task_list(config_dict, logger_dict, resolver,
+                            native_ping=True)
+  thread_list = []
+  for _ in xrange(min(max_concurrency, len(task_list))):
+    thread = threading.Thread(target=worker, args=(queue,))
+    thread.daemon = True
+    thread.start()
+    thread_list.append(thread)
+  for task in task_list:
+    queue.put(task)
+  for _ in thread_list:
+    queue.put(None)
+
+  # http requests are multiplexed in this thread while workers run
+  url_dict = config_dict.get("url", {})
+  if url_dict:
+    http_logger = logger_dict["http"]
+    request_multi(url_dict, lambda info_list: log_result(http_logger,
+                                                         info_list),
+                  max_concurrency, multi)
+
+  for thread in thread_list:
+    thread.join()
+
+def run_sequentially(config_dict, logger_dict, resolver=None, curl=None):
+  for task in get_task_list(config_dict, logger_dict, resolver):
+    run_task(*task)
+  url_dict = config_dict.get("url", {})
+  for url in url_dict:
+    log_result(logger_dict["http"], request(url, url_dict[url], curl))
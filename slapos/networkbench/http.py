@@ -1,15 +1,24 @@
 import sys
 import pycurl
-from StringIO import StringIO
 
-def get_curl(buffer, url):
-  curl = pycurl.Curl()
+def new_curl(buffer, url, curl=None):
+  """ Return a curl handle to get url into buffer. If curl is given, it is
+      reset and reused, keeping its connections and DNS cache.
+  """
+  if curl is None:
+    curl = pycurl.Curl()
+  else:
+    curl.reset()
   curl.setopt(curl.URL, url)
   curl.setopt(curl.CONNECTTIMEOUT, 10)
   curl.setopt(curl.TIMEOUT, 30)
   curl.setopt(curl.WRITEDATA, buffer)
   curl.setopt(curl.SSL_VERIFYPEER, False)
   curl.setopt(curl.SSL_VERIFYHOST, False)
+  return curl
+
+def get_curl(buffer, url, curl=None):
+  curl = new_curl(buffer, url, curl)
   result = "OK"
   try:
     curl.perform()
@@ -20,20 +29,30 @@ def get_curl(buffer, url):
     result = "FAIL"
   return curl, result
 
-def request(url, expected_dict):
-  
-  buffer = StringIO()
-  curl, result = get_curl(buffer, url)
+class TextScanner(object):
+  """ Look for text in the data written by curl, without keeping more than
+      the end of the previous chunk.
+  """
+
+  def __init__(self, text=None):
+    self.text = None if text is None else str(text)
+    self.found = self.text == ''
+    self.tail = ''
 
-  body = buffer.getvalue()
-  
+  def write(self, data):
+    if self.text and not self.found:
+      data = self.tail + data
+      self.found = self.text in data
+      self.tail = data[max(0, len(data) - len(self.text) + 1):]
+
+def get_request_info(curl, url, expected_dict, scanner, result):
   rendering_time = "%s;%s;%s;%s;%s" % \
     (curl.getinfo(curl.NAMELOOKUP_TIME),
      curl.getinfo(curl.CONNECT_TIME),
      curl.getinfo(curl.PRETRANSFER_TIME),
      curl.getinfo(curl.STARTTRANSFER_TIME),
      curl.getinfo(curl.TOTAL_TIME))
-  
+
   response_code = curl.getinfo(pycurl.HTTP_CODE)
 
   expected_response = expected_dict.get("expected_response", None)
@@ -42,13 +61,93 @@ def request(url, expected_dict):
     result = "UNEXPECTED (%s != %s)" % (expected_response, response_code)
 
   expected_text = expected_dict.get("expected_text", None)
-  if expected_text is not None and \
-      str(expected_text) not in str(body):
+  if expected_text is not None and not scanner.found:
     result = "UNEXPECTED (%s not in page content)" % (expected_text)
 
-  curl.close()
+  return ('GET', url, response_code, rendering_time, result)
 
-  info_list = ('GET', url, response_code, rendering_time, result)
+def request(url, expected_dict, curl=None):
+
+  scanner = TextScanner(expected_dict.get("expected_text", None))
+  info_curl, result = get_curl(scanner, url, curl)
+
+  info_list = get_request_info(info_curl, url, expected_dict, scanner, result)
+  if curl is None:
+    info_curl.close()
 
   return info_list
 
+def perform_multi(multi, curl_iterator, callback, max_concurrency=10):
+  """ Perform the transfers of the curl handles of curl_iterator, at most
+      max_concurrency at the same time. callback is called with every
+      handle and its error message, or None, as soon as its transfer is
+      finished, and the handle is closed after.
+  """
+  running_list = []
+  try:
+    while True:
+      while len(running_list) < max_concurrency:
+        curl = next(curl_iterator, None)
+        if curl is None:
+          break
+        multi.add_handle(curl)
+        running_list.append(curl)
+      if not running_list:
+        break
+
+      while multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+        pass
+
+      while True:
+        _, ok_list, error_list = multi.info_read()
+        for curl in ok_list:
+          callback(curl, None)
+        for curl, _, message in error_list:
+          callback(curl, message)
+        for curl in ok_list + [error[0] for error in error_list]:
+          multi.remove_handle(curl)
+          curl.close()
+          running_list.remove(curl)
+        if not (ok_list or error_list):
+          break
+
+      if running_list:
+        # libcurl may need to be called before any socket is ready
+        timeout = multi.timeout()
+        multi.select(1.0 if timeout < 0 else min(timeout / 1000., 1.0))
+  finally:
+    for curl in running_list:
+      multi.remove_handle(curl)
+      curl.close()
+
+def request_multi(url_dict, callback, max_concurrency=10, multi=None):
+  """ Same as request for every url of url_dict, with at most
+      max_concurrency transfers at the same time. callback is called
+      with the result of every url as soon as it is available.
+      If multi is given, its connections are reused and it is not closed.
+  """
+  def curl_iterator():
+    for url in url_dict:
+      scanner = TextScanner(url_dict[url].get("expected_text", None))
+      curl = new_curl(scanner, url)
+      curl.url = url
+      curl.scanner = scanner
+      yield curl
+
+  def done(curl, error):
+    result = "OK"
+    if error is not None:
+      sys.stderr.write("%s: %s\n" % (curl.url, error))
+      sys.stderr.flush()
+      result = "FAIL"
+    callback(get_request_info(curl, curl.url, url_dict[curl.url],
+                              curl.scanner, result))
+
+  close = multi is None
+  if close:
+    multi = pycurl.CurlMulti()
+  try:
+    perform_multi(multi, curl_iterator(), done, max_concurrency)
+  finally:
+    if close:
+      multi.close()
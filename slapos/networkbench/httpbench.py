@@ -0,0 +1,198 @@
+"""
+Benchmark of http targets.
+
+Every target is requested count times one after the other, then count
+times with concurrency requests at the same time, each on new
+connections (cold) and on kept alive connections. Latency percentiles of
+every step of the requests are shown per target and mode, in
+milliseconds.
+
+The expected text of a target is searched in the body as it is received,
+without keeping the body.
+"""
+
+import argparse
+import json
+import sys
+
+import pycurl
+
+from http import TextScanner, get_request_info, new_curl, perform_multi
+from sink import percentile
+
+# name -> curl info of the timings of a request, in seconds
+TIMING_LIST = (
+  ('namelookup', pycurl.NAMELOOKUP_TIME),
+  ('connect', pycurl.CONNECT_TIME),
+  ('appconnect', pycurl.APPCONNECT_TIME),
+  ('pretransfer', pycurl.PRETRANSFER_TIME),
+  ('starttransfer', pycurl.STARTTRANSFER_TIME),
+  ('redirect', pycurl.REDIRECT_TIME),
+  ('total', pycurl.TOTAL_TIME),
+)
+
+MODE_LIST = ('sequential-cold', 'sequential-keepalive',
+             'concurrent-cold', 'concurrent-keepalive')
+
+PERCENTILE_LIST = (50, 90, 99)
+
+def prepare_curl(url, expected_dict, keep_alive, follow_redirect, curl=None):
+  scanner = TextScanner(expected_dict.get("expected_text", None))
+  curl = new_curl(scanner, url, curl)
+  curl.scanner = scanner
+  if not keep_alive:
+    curl.setopt(curl.FRESH_CONNECT, 1)
+    curl.setopt(curl.FORBID_REUSE, 1)
+  if follow_redirect:
+    curl.setopt(curl.FOLLOWLOCATION, 1)
+    curl.setopt(curl.MAXREDIRS, 10)
+  return curl
+
+def get_sample(curl, url, expected_dict, result):
+  """ Return the timings in milliseconds, download speed in bytes per
+      second, size and result of the last request of curl.
+  """
+  info_list = get_request_info(curl, url, expected_dict, curl.scanner, result)
+  sample = dict((name, curl.getinfo(info) * 1000)
+                for name, info in TIMING_LIST)
+  sample.update(
+    code=info_list[2],
+    result=info_list[4],
+    speed=curl.getinfo(pycurl.SPEED_DOWNLOAD),
+    size=curl.getinfo(pycurl.SIZE_DOWNLOAD),
+    connect_count=curl.getinfo(pycurl.NUM_CONNECTS),
+  )
+  return sample
+
+def bench_sequential(url, expected_dict, count, keep_alive=True,
+                     follow_redirect=False):
+  """ Request url count times, one after the other. With keep_alive, the
+      same handle is used and its connection reused.
+  """
+  sample_list = []
+  curl = None
+  try:
+    for _ in xrange(count):
+      if curl is not None and not keep_alive:
+        curl.close()
+        curl = None
+      curl = prepare_curl(url, expected_dict, keep_alive, follow_redirect,
+                          curl)
+      result = "OK"
+      try:
+        curl.perform()
+      except pycurl.error:
+        result = "FAIL"
+      sample_list.append(get_sample(curl, url, expected_dict, result))
+  finally:
+    if curl is not None:
+      curl.close()
+  return sample_list
+
+def bench_concurrent(url, expected_dict, count, concurrency, keep_alive=True,
+                     follow_redirect=False):
+  """ Request url count times, concurrency requests at the same time. With
+      keep_alive, connections are reused by the next requests.
+  """
+  sample_list = []
+  def done(curl, error):
+    sample_list.append(get_sample(curl, url, expected_dict,
+                                  "OK" if error is None else "FAIL"))
+  multi = pycurl.CurlMulti()
+  try:
+    perform_multi(multi, (prepare_curl(url, expected_dict, keep_alive,
+                                       follow_redirect)
+                          for _ in xrange(count)), done, concurrency)
+  finally:
+    multi.close()
+  return sample_list
+
+def bench(url, expected_dict, count=10, concurrency=4, mode_list=MODE_LIST,
+          follow_redirect=False):
+  """ Return {mode: sample list} of url """
+  sample_dict = {}
+  for mode in mode_list:
+    keep_alive = mode.endswith('keepalive')
+    if mode.startswith('sequential'):
+      sample_dict[mode] = bench_sequential(url, expected_dict, count,
+                                           keep_alive, follow_redirect)
+    else:
+      sample_dict[mode] = bench_concurrent(url, expected_dict, count,
+                                           concurrency, keep_alive,
+                                           follow_redirect)
+  return sample_dict
+
+def get_summary(sample_list, percentile_list=PERCENTILE_LIST):
+  """ Return the number of requests, failures, new connections, and the
+      percentiles of timings, speed and size of the successful ones.
+  """
+  ok_list = [sample for sample in sample_list if sample['result'] == 'OK']
+  summary_dict = {
+    'count': len(sample_list),
+    'failed': len(sample_list) - len(ok_list),
+    'connect_count': sum(sample['connect_count'] for sample in sample_list),
+  }
+  for name in [name for name, _ in TIMING_LIST] + ['speed', 'size']:
+    value_list = sorted(sample[name] for sample in ok_list)
+    summary_dict[name] = dict(('p%s' % x, percentile(value_list, x)
+                               if value_list else None)
+                              for x in percentile_list)
+  return summary_dict
+
+def format_summary(url, mode, summary_dict, percentile_list=PERCENTILE_LIST):
+  line_list = ["%s %s: %s requests, %s failed, %s new connections" % (
+    url, mode, summary_dict['count'], summary_dict['failed'],
+    summary_dict['connect_count'])]
+  for name in [name for name, _ in TIMING_LIST] + ['speed', 'size']:
+    value_dict = summary_dict[name]
+    line_list.append("  %-14s %s" % (name, ' '.join(
+      "p%s=%s" % (x, '-' if value_dict['p%s' % x] is None
+                  else '%.3f' % value_dict['p%s' % x])
+      for x in percentile_list)))
+  return '\n'.join(line_list)
+
+def main(argument_list=None):
+  parser = argparse.ArgumentParser(
+    description="Benchmark http targets on cold and kept alive "
+                "connections, sequentially and concurrently.")
+  _ = parser.add_argument
+  _('url_list', nargs='*', metavar='URL', help="Url to benchmark.")
+  _('-c', '--conf',
+    help="Path or url of a networkbench configuration, whose urls are "
+         "benchmarked with their expectations.")
+  _('-n', '--count', type=int, default=10,
+    help="Number of requests per target and mode.")
+  _('-C', '--concurrency', type=int, default=4,
+    help="Number of requests at the same time in concurrent modes.")
+  _('-m', '--mode', action='append', dest='mode_list', choices=MODE_LIST,
+    help="Mode to run, can be given several times (default: all).")
+  _('-L', '--follow-redirect', action='store_true',
+    help="Follow redirections.")
+  _('-j', '--json', action='store_true',
+    help="Show the summaries as JSON.")
+  config = parser.parse_args(argument_list)
+
+  url_dict = dict((url, {}) for url in config.url_list)
+  if config.conf:
+    from slapos.networkbench import load_configuration
+    url_dict.update(load_configuration(config.conf).get("url", {}))
+  if not url_dict:
+    parser.error("no url to benchmark")
+
+  result_dict = {}
+  for url in sorted(url_dict):
+    sample_dict = bench(url, url_dict[url], config.count,
+                        config.concurrency,
+                        config.mode_list or MODE_LIST,
+                        config.follow_redirect)
+    result_dict[url] = url_summary_dict = {}
+    for mode in config.mode_list or MODE_LIST:
+      url_summary_dict[mode] = summary_dict = get_summary(sample_dict[mode])
+      if not config.json:
+        print format_summary(url, mode, summary_dict)
+  if config.json:
+    print json.dumps(result_dict, indent=2, sort_keys=True)
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,176 @@
+import errno
+import itertools
+import os
+import select
+import socket
+import struct
+import time
+
+# protocol -> (family, proto, echo request type, echo reply type, title)
+ICMP_CONF = {
+  '4': (socket.AF_INET, socket.IPPROTO_ICMP, 8, 0, 'PING'),
+  '6': (socket.AF_INET6, getattr(socket, 'IPPROTO_ICMPV6', 58), 128, 129,
+        'PING6'),
+}
+
+# same payload size as ping
+PAYLOAD = '\0' * 56
+
+# shared by all sockets of the process, as raw sockets receive the replies
+# of each other
+sequence = itertools.count()
+
+def open_socket(protocol="4"):
+  """ Return an ICMP socket, using an unprivileged datagram socket if the
+      system allows it (net.ipv4.ping_group_range), or a raw socket if the
+      process is privileged, or None.
+  """
+  family, proto = ICMP_CONF[protocol][:2]
+  for socket_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+    try:
+      sock = socket.socket(family, socket_type, proto)
+    except socket.error:
+      continue
+    sock.setblocking(0)
+    return sock
+  return None
+
+def is_available(protocol="4"):
+  sock = open_socket(protocol)
+  if sock is None:
+    return False
+  sock.close()
+  return True
+
+def checksum(data):
+  if len(data) % 2:
+    data += '\0'
+  total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+  total = (total >> 16) + (total & 0xffff)
+  total += total >> 16
+  return ~total & 0xffff
+
+def build_echo_request(request_type, identifier, seq):
+  header = struct.pack('!BBHHH', request_type, 0, 0, identifier, seq)
+  return struct.pack('!BBHHH', request_type, 0,
+                     checksum(header + PAYLOAD), identifier, seq) + PAYLOAD
+
+def parse_echo_reply(sock, data, reply_type, identifier):
+  """ Return the sequence number of an echo reply, or None """
+  if sock.family == socket.AF_INET and sock.type == socket.SOCK_RAW:
+    # skip IP header
+    data = data[(ord(data[0]) & 0x0f) * 4:]
+  if len(data) < 8:
+    return None
+  icmp_type, _, _, reply_identifier, seq = struct.unpack('!BBHHH', data[:8])
+  if icmp_type != reply_type:
+    return None
+  # the kernel sets and checks the identifier of datagram sockets
+  if sock.type == socket.SOCK_RAW and reply_identifier != identifier:
+    return None
+  return seq
+
+def get_address(host, family):
+  try:
+    address = socket.getaddrinfo(host, None, family)[0][4][0]
+  except socket.gaierror:
+    return None
+  return address.split('%')[0]
+
+def ping_many(sock, host_list, timeout=10, protocol="4", count=10, interval=1):
+  """ Send count echo requests to every host of host_list over sock, one
+      every interval seconds, and wait for the replies until all are
+      received or timeout seconds passed. Return a ping result for every
+      host, in the same format as ping.
+  """
+  family, _, request_type, reply_type, test_title = ICMP_CONF[protocol]
+  identifier = os.getpid() & 0xffff
+  host_count = len(host_list)
+  address_list = [get_address(host, family) for host in host_list]
+  error_list = [None if address else "Cannot resolve host"
+                for address in address_list]
+  sent_list = [0] * host_count
+  rtt_list = [[] for _ in host_list]
+  # sequence number -> (host index, sending time)
+  pending_dict = {}
+
+  def receive():
+    while True:
+      try:
+        data, source = sock.recvfrom(4096)
+      except socket.error, e:
+        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return
+        raise
+      received = time.time()
+      seq = parse_echo_reply(sock, data, reply_type, identifier)
+      if seq not in pending_dict:
+        continue
+      index, sent = pending_dict[seq]
+      if source[0].split('%')[0] != address_list[index]:
+        continue
+      del pending_dict[seq]
+      rtt_list[index].append((received - sent) * 1000)
+
+  start = time.time()
+  deadline = start + timeout
+  sent_round = 0
+  next_send = start
+  while True:
+    now = time.time()
+    if sent_round < count and now >= next_send:
+      for index, address in enumerate(address_list):
+        if error_list[index] is not None:
+          continue
+        seq = next(sequence) & 0xffff
+        try:
+          sock.sendto(build_echo_request(request_type, identifier, seq),
+                      (address, 0))
+        except socket.error, e:
+          if e.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH):
+            error_list[index] = "Network is unreachable"
+            continue
+          if e.errno not in (errno.EAGAIN, errno.ENOBUFS):
+            raise
+        pending_dict[seq] = index, time.time()
+        sent_list[index] += 1
+        # read replies as they come, so that the socket buffer does not
+        # overflow when there are many hosts
+        receive()
+      sent_round += 1
+      next_send = start + sent_round * interval
+      if next_send >= deadline:
+        # no time left to wait for the replies of another round
+        count = sent_round
+
+    if sent_round == count and \
+        sum(sent_list) == sum(len(rtt) for rtt in rtt_list):
+      break
+    now = time.time()
+    if now >= deadline:
+      break
+    wait = deadline - now
+    if sent_round < count:
+      wait = min(wait, next_send - now)
+    if select.select([sock], [], [], max(0, wait))[0]:
+      receive()
+
+  info_list = []
+  for host, error, sent, rtt in zip(host_list, error_list, sent_list,
+                                    rtt_list):
+    if error == "Network is unreachable":
+      info_list.append((test_title, host, 600, 'failed', 100, error))
+    elif error is not None or not sent:
+      info_list.append((test_title, host, 600, 'failed', -1,
+                        error or "Cannot ping host"))
+    else:
+      packet_lost_ratio = str((sent - len(rtt)) * 100 // sent)
+      if rtt:
+        min_rtt, avg_rtt, max_rtt = ["%.3f" % x for x in
+                                     (min(rtt), sum(rtt) / len(rtt), max(rtt))]
+        info_list.append((test_title, host, 200, avg_rtt, packet_lost_ratio,
+                          'min %s max %s avg %s' % (min_rtt, max_rtt, avg_rtt)))
+      else:
+        info_list.append((test_title, host, 600, 'failed', packet_lost_ratio,
+                          "Cannot ping host"))
+  return info_list
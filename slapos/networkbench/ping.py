@@ -1,5 +1,6 @@
 import subprocess
 import re
+import icmp
 
 # rtt min/avg/max/mdev = 1.102/1.493/2.203/0.438 ms
 ping_re = re.compile(
@@ -49,3 +50,17 @@ def ping(host, timeout=10, protocol="4"):
 def ping6(host, timeout=10):
   return ping(host, timeout=10, protocol='6')
 
+
+def ping_list(host_list, timeout=10, protocol="4"):
+  """ Ping all hosts of host_list at the same time over a single ICMP
+      socket, or one after the other with the ping binary if no ICMP socket
+      can be opened.
+  """
+  sock = icmp.open_socket(protocol)
+  if sock is None:
+    return [ping(host, timeout=timeout, protocol=protocol)
+            for host in host_list]
+  try:
+    return icmp.ping_many(sock, host_list, timeout=timeout, protocol=protocol)
+  finally:
+    sock.close()
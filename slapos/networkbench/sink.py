@@ -0,0 +1,284 @@
+"""
+Structured storage of networkbench results.
+
+Results of every kind of probe are appended to daily CSV segments with
+typed columns, network_bench.<kind>.<YYYY-MM-DD>.csv, timings being in
+milliseconds. Segments of previous days are compressed with gzip as soon
+as a new day starts.
+
+networkbench-query computes latency percentiles per target from the
+segments, without parsing the text logs.
+"""
+
+import argparse
+import csv
+import glob
+import gzip
+import logging
+import math
+import os
+import re
+import shutil
+import sys
+import time
+
+# kind -> columns after timestamp and bot name, the first one being the
+# target
+FIELD_DICT = {
+  'dns': ('name', 'code', 'time', 'status', 'ip_list'),
+  'ping': ('host', 'code', 'avg', 'loss', 'min', 'max', 'message'),
+  'http': ('url', 'code', 'namelookup', 'connect', 'pretransfer',
+           'starttransfer', 'total', 'result'),
+}
+FIELD_DICT['ping6'] = FIELD_DICT['ping']
+
+# kind -> (column, value) of successful probes
+SUCCESS_DICT = {
+  'dns': ('status', 'OK'),
+  'ping': ('code', '200'),
+  'ping6': ('code', '200'),
+  'http': ('result', 'OK'),
+}
+
+LATENCY_FIELD_DICT = {
+  'dns': 'time',
+  'ping': 'avg',
+  'ping6': 'avg',
+  'http': 'total',
+}
+
+segment_re = re.compile(r'network_bench\.(?P<kind>\w+)\.'
+                        r'(?P<date>\d{4}-\d{2}-\d{2})\.csv(?P<gz>\.gz)?$')
+
+ping_message_re = re.compile(r'min (?P<min>[\d\.]+) max (?P<max>[\d\.]+)')
+
+def to_millisecond(value):
+  try:
+    return "%.3f" % (float(value) * 1000)
+  except (TypeError, ValueError):
+    return ''
+
+def to_float(value):
+  try:
+    return "%.3f" % float(value)
+  except (TypeError, ValueError):
+    return ''
+
+def get_row(kind, info_list):
+  """ Return the columns of FIELD_DICT[kind] from the result of a probe """
+  if kind == 'dns':
+    _, name, code, resolving_time, status, ip_list = info_list
+    if isinstance(ip_list, list):
+      ip_list = ' '.join(ip_list)
+    return [name, code, to_millisecond(resolving_time), status, ip_list]
+  if kind in ('ping', 'ping6'):
+    _, host, code, avg, loss, message = info_list
+    match = ping_message_re.match(str(message))
+    min_rtt, max_rtt = match.groups() if match else ('', '')
+    return [host, code, to_float(avg), loss, min_rtt, max_rtt, message]
+  if kind == 'http':
+    _, url, code, rendering_time, result = info_list
+    return [url, code] + [to_millisecond(x) for x in
+                          rendering_time.split(';')] + [result]
+  raise ValueError("Unknown kind %r" % kind)
+
+def compress_file(path):
+  """ Replace path with a gzip compressed path.gz """
+  temp_path = path + '.gz.tmp'
+  with open(path, 'rb') as source:
+    destination = gzip.open(temp_path, 'wb')
+    try:
+      shutil.copyfileobj(source, destination)
+    finally:
+      destination.close()
+  os.rename(temp_path, path + '.gz')
+  os.remove(path)
+
+class SegmentWriter(object):
+  """ Append the results of a kind of probe to daily CSV segments """
+
+  def __init__(self, folder, kind):
+    self.folder = folder
+    self.kind = kind
+    self.date = None
+    self.file = None
+    self.writer = None
+
+  def get_path(self, date):
+    return os.path.join(self.folder, 'network_bench.%s.%s.csv' % (
+      self.kind, date))
+
+  def compress_previous(self):
+    """ Compress the segments older than the current one """
+    for path in glob.glob(self.get_path('*')):
+      match = segment_re.search(path)
+      if match and not match.group('gz') and match.group('date') < self.date:
+        compress_file(path)
+
+  def open(self, date):
+    self.close()
+    self.date = date
+    self.compress_previous()
+    path = self.get_path(date)
+    is_new = not os.path.exists(path)
+    self.file = open(path, 'ab')
+    self.writer = csv.writer(self.file)
+    if is_new:
+      self.writer.writerow(('timestamp', 'bot') + FIELD_DICT[self.kind])
+
+  def write(self, timestamp, bot, info_list):
+    date = time.strftime('%Y-%m-%d', time.localtime(timestamp))
+    if date != self.date:
+      self.open(date)
+    self.writer.writerow(["%.3f" % timestamp, bot] +
+                         [unicode(x).encode('utf-8') if isinstance(x, unicode)
+                          else x for x in get_row(self.kind, info_list)])
+    self.file.flush()
+
+  def close(self):
+    if self.file is not None:
+      self.file.close()
+      self.file = self.writer = None
+
+class SegmentHandler(logging.Handler):
+  """ Write the results logged with an info_list extra attribute to
+      segments, other records are ignored.
+  """
+
+  def __init__(self, folder, kind, bot):
+    logging.Handler.__init__(self)
+    self.bot = bot
+    self.segment_writer = SegmentWriter(folder, kind)
+
+  def emit(self, record):
+    info_list = getattr(record, 'info_list', None)
+    if info_list is None:
+      return
+    try:
+      self.segment_writer.write(record.created, self.bot, info_list)
+    except Exception:
+      self.handleError(record)
+
+  def close(self):
+    self.acquire()
+    try:
+      self.segment_writer.close()
+    finally:
+      self.release()
+    logging.Handler.close(self)
+
+def get_segment_list(folder, kind, begin=None, end=None):
+  """ Return the segments of kind which may contain results between begin
+      and end timestamps, oldest first.
+  """
+  begin_date = end_date = None
+  if begin is not None:
+    begin_date = time.strftime('%Y-%m-%d', time.localtime(begin))
+  if end is not None:
+    end_date = time.strftime('%Y-%m-%d', time.localtime(end))
+  segment_list = []
+  for name in os.listdir(folder):
+    match = segment_re.match(name)
+    if match is None or match.group('kind') != kind:
+      continue
+    date = match.group('date')
+    if (begin_date is None or begin_date <= date) and \
+        (end_date is None or date <= end_date):
+      segment_list.append((date, os.path.join(folder, name)))
+  return [path for _, path in sorted(segment_list)]
+
+def iter_row(folder, kind, begin=None, end=None):
+  """ Yield the rows of kind between begin and end timestamps as dicts,
+      with a float timestamp.
+  """
+  for path in get_segment_list(folder, kind, begin, end):
+    if path.endswith('.gz'):
+      segment = gzip.open(path, 'rb')
+    else:
+      segment = open(path, 'rb')
+    try:
+      for row in csv.DictReader(segment):
+        try:
+          row['timestamp'] = timestamp = float(row['timestamp'])
+        except (TypeError, ValueError):
+          # partially written row
+          continue
+        if (begin is None or begin <= timestamp) and \
+            (end is None or timestamp < end):
+          yield row
+    finally:
+      segment.close()
+
+def percentile(sorted_list, value):
+  """ Nearest rank percentile of a sorted list """
+  rank = int(math.ceil(value / 100. * len(sorted_list)))
+  return sorted_list[max(rank, 1) - 1]
+
+def get_latency_summary(folder, kind, begin=None, end=None,
+                        percentile_list=(50, 90, 99)):
+  """ Return {target: (count, failure count, [latency percentiles])} of the
+      results of kind between begin and end timestamps, latencies being in
+      milliseconds. Failed probes are not part of the percentiles.
+  """
+  latency_field = LATENCY_FIELD_DICT[kind]
+  target_field = FIELD_DICT[kind][0]
+  success_field, success_value = SUCCESS_DICT[kind]
+  latency_dict = {}
+  failure_dict = {}
+  for row in iter_row(folder, kind, begin, end):
+    target = row[target_field]
+    latency_list = latency_dict.setdefault(target, [])
+    failure_dict.setdefault(target, 0)
+    latency = row[latency_field]
+    if row[success_field] != success_value or not latency:
+      failure_dict[target] += 1
+    else:
+      latency_list.append(float(latency))
+  summary_dict = {}
+  for target, latency_list in latency_dict.iteritems():
+    latency_list.sort()
+    failure_count = failure_dict[target]
+    summary_dict[target] = (len(latency_list) + failure_count, failure_count,
+      [percentile(latency_list, x) if latency_list else None
+       for x in percentile_list])
+  return summary_dict
+
+def parse_time(value):
+  for date_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+    try:
+      return time.mktime(time.strptime(value, date_format))
+    except ValueError:
+      pass
+  raise argparse.ArgumentTypeError("invalid date: %r" % value)
+
+def query(argument_list=None):
+  parser = argparse.ArgumentParser(
+    description="Show latency percentiles per target from the segments "
+                "written by networkbench --sink-dir.")
+  _ = parser.add_argument
+  _('-s', '--sink-dir', default=".",
+    help="Directory where the segments are.")
+  _('-k', '--kind', default="http", choices=sorted(FIELD_DICT),
+    help="Kind of probe.")
+  _('-b', '--begin', type=parse_time,
+    help="Start of the time range, as YYYY-MM-DD[ HH:MM[:SS]].")
+  _('-e', '--end', type=parse_time,
+    help="End of the time range (excluded), as YYYY-MM-DD[ HH:MM[:SS]].")
+  _('-p', '--percentile', type=float, action='append', dest='percentile_list',
+    help="Percentile to show, can be given several times (default: 50 90 99).")
+  config = parser.parse_args(argument_list)
+  percentile_list = config.percentile_list or [50, 90, 99]
+
+  summary_dict = get_latency_summary(config.sink_dir, config.kind,
+                                     config.begin, config.end,
+                                     percentile_list)
+  print "\t".join(["target", "count", "failed"] +
+                  ["p%g (ms)" % x for x in percentile_list])
+  for target in sorted(summary_dict):
+    count, failure_count, value_list = summary_dict[target]
+    print "\t".join([target, str(count), str(failure_count)] +
+                    ["-" if x is None else "%.3f" % x for x in value_list])
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(query())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Run a list of promise checks in a single process.
+
+Promise modules are imported once and their main function is called with
+the arguments of every check, several checks running at the same time.
+The result of every check is written as a <title>.status.json file, in the
+format written by monitor.runpromise.
+
+Checks are read from a configuration file, one section per check:
+
+  [apache-port]
+  promise = is-local-tcp-port-opened
+  argument-list = 127.0.0.1 8080
+
+promise is the name of a promise of slapos.promise or the dotted name of
+a module with a main(argument_list) function returning 0 on success.
+"""
+
+import argparse
+import ConfigParser
+import importlib
+import json
+import os
+import shlex
+import sys
+import threading
+import time
+import traceback
+from cStringIO import StringIO
+
+PROMISE_MODULE_DICT = {
+  'check-web-page-http-cache-hit':
+    'slapos.promise.check_web_page_http_cache_hit',
+  'is-local-tcp-port-opened': 'slapos.promise.is_local_tcp_port_opened',
+  'is-process-older-than-dependency-set':
+    'slapos.promise.is_process_older_than_dependency_set',
+}
+
+class ThreadOutput(object):
+  """
+    Replacement of sys.stdout and sys.stderr writing to the buffer of the
+    current thread, if it has one.
+  """
+
+  def __init__(self, output):
+    self.output = output
+    self.local = threading.local()
+
+  def write(self, data):
+    getattr(self.local, 'buffer', self.output).write(data)
+
+  def flush(self):
+    getattr(self.local, 'buffer', self.output).flush()
+
+  def __getattr__(self, name):
+    return getattr(self.output, name)
+
+
+class CheckOutput(object):
+  """
+    Output of a check. Once the check timed out, what it writes is ignored.
+  """
+
+  def __init__(self):
+    self.buffer = StringIO()
+    self.expired = False
+
+  def write(self, data):
+    if not self.expired:
+      self.buffer.write(data)
+
+  def flush(self):
+    pass
+
+  def expire(self):
+    self.expired = True
+
+  def getvalue(self):
+    return self.buffer.getvalue()
+
+
+def loadPromiseModule(promise):
+  return importlib.import_module(PROMISE_MODULE_DICT.get(promise, promise))
+
+
+def newPromiseResult(title):
+  return {
+    "status": "ERROR",
+    "type": "status",
+    "title": title,
+    "start-date" : time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time())),
+    "change-time": time.time()
+  }
+
+
+def runCheck(module, argument_list, result_dict, stdout, stderr, output=None):
+  """
+    Run the main function of module and fill result_dict, its output being
+    written to output, the buffer of the current thread in stdout and stderr
+    ThreadOutput.
+  """
+  if output is None:
+    output = CheckOutput()
+  stdout.local.buffer = stderr.local.buffer = output
+  try:
+    try:
+      exit_code = module.main(argument_list)
+    except SystemExit, e:
+      exit_code = e.code
+    if not exit_code:
+      result_dict["status"] = "OK"
+    elif not isinstance(exit_code, int):
+      # sys.exit(message)
+      output.write(str(exit_code))
+  except Exception:
+    output.write(traceback.format_exc())
+  finally:
+    del stdout.local.buffer, stderr.local.buffer
+  result_dict["message"] = output.getvalue()
+
+
+def runCheckList(check_list, worker_count=4, timeout=20):
+  """
+    Run the checks of check_list, a list of (title, promise, argument_list),
+    at most worker_count at the same time. A check which does not finish
+    before timeout seconds is reported as failed and its worker slot is
+    given to the next check. Results are returned in the order of check_list.
+
+    Threads can't be stopped, so a timed out check is left running in
+    background, using resources until it finishes by itself. Its result and
+    what it writes to sys.stdout and sys.stderr are ignored, but once
+    runCheckList returned, what it writes goes to the restored sys.stdout
+    and sys.stderr.
+  """
+  original_stdout, original_stderr = sys.stdout, sys.stderr
+  stdout = sys.stdout if isinstance(sys.stdout, ThreadOutput) \
+    else ThreadOutput(sys.stdout)
+  stderr = sys.stderr if isinstance(sys.stderr, ThreadOutput) \
+    else ThreadOutput(sys.stderr)
+  sys.stdout, sys.stderr = stdout, stderr
+  try:
+    result_list = [newPromiseResult(title) for title, _, _ in check_list]
+    pending_list = []
+    for index, (_, promise, argument_list) in enumerate(check_list):
+      try:
+        module = loadPromiseModule(promise)
+      except ImportError, e:
+        result_list[index]["message"] = "Can't load promise %s: %s" % (
+          promise, e)
+        continue
+      pending_list.append((index, module, argument_list))
+    pending_list.reverse()
+
+    # set when a check finishes
+    finished = threading.Event()
+    def target(*args):
+      try:
+        runCheck(*args)
+      finally:
+        finished.set()
+
+    # index in check_list -> (thread, deadline, output)
+    running_dict = {}
+    while pending_list or running_dict:
+      finished.clear()
+      now = time.time()
+      for index, (thread, deadline, output) in running_dict.items():
+        if not thread.is_alive():
+          del running_dict[index]
+        elif deadline <= now:
+          # the thread may still change its result and write output
+          output.expire()
+          result_list[index] = dict(result_list[index], status="ERROR",
+            message='PROMISE TIME OUT AFTER %s SECONDS' % timeout)
+          del running_dict[index]
+      while pending_list and len(running_dict) < worker_count:
+        index, module, argument_list = pending_list.pop()
+        output = CheckOutput()
+        thread = threading.Thread(target=target, args=(module,
+          argument_list, result_list[index], stdout, stderr, output))
+        thread.daemon = True
+        thread.start()
+        running_dict[index] = thread, time.time() + timeout, output
+      if running_dict:
+        finished.wait(max(0, min(deadline for _, deadline, _
+                                 in running_dict.itervalues()) - time.time()))
+    return result_list
+  finally:
+    sys.stdout, sys.stderr = original_stdout, original_stderr
+
+
+def loadCheckList(config_file):
+  config = ConfigParser.ConfigParser()
+  config.read(config_file)
+  check_list = []
+  for section in config.sections():
+    argument_list = ''
+    if config.has_option(section, 'argument-list'):
+      argument_list = config.get(section, 'argument-list')
+    check_list.append((section, config.get(section, 'promise'),
+                       shlex.split(argument_list)))
+  return check_list
+
+
+def writeStatus(output_directory, result_dict, base_dict):
+  """
+    Write result_dict as <title>.status.json, keeping the change-time of
+    the previous status if it did not change.
+  """
+  result_dict.update(base_dict)
+  status_file = os.path.join(output_directory,
+                             '%s.status.json' % result_dict['title'])
+  try:
+    with open(status_file) as f:
+      previous_dict = json.load(f)
+    if previous_dict['status'] == result_dict['status'] and \
+        'change-time' in previous_dict:
+      result_dict['change-time'] = previous_dict['change-time']
+  except (IOError, ValueError, KeyError):
+    pass
+  temp_file = '%s.tmp' % status_file
+  with open(temp_file, 'w') as f:
+    json.dump(result_dict, f)
+  os.rename(temp_file, status_file)
+
+
+def parseArguments(argument_list=None):
+  parser = argparse.ArgumentParser(
+    description="Run promise checks in a single process.")
+  parser.add_argument('--config', required=True,
+                      help='Configuration file listing the checks to run.')
+  parser.add_argument('--output', required=True,
+                      help='Folder where <check>.status.json files are written.')
+  parser.add_argument('--workers', type=int, default=4,
+                      help='Number of checks run at the same time.')
+  parser.add_argument('--timeout', type=float, default=20,
+                      help='Maximum time in seconds of a check.')
+  parser.add_argument('--monitor_url', default='',
+                      help='Monitor url added to the statuses.')
+  parser.add_argument('--instance_name', default='',
+                      help='Instance name added to the statuses.')
+  parser.add_argument('--hosting_name', default='',
+                      help='Hosting subscription name added to the statuses.')
+  return parser.parse_args(argument_list)
+
+
+def main(argument_list=None):
+  option = parseArguments(argument_list)
+  base_dict = {
+    '_links': {"monitor": {"href": option.monitor_url}},
+    'instance': option.instance_name,
+    'hosting_subscription': option.hosting_name,
+  }
+  result_list = runCheckList(loadCheckList(option.config), option.workers,
+                             option.timeout)
+  for result_dict in result_list:
+    writeStatus(option.output, result_dict, base_dict)
+  if any(result_dict['status'] != 'OK' for result_dict in result_list):
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
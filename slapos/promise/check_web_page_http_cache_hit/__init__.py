@@ -122,13 +122,13 @@ def getConfig(config_parser, section, option, default=None, raw=False, vars=None
   except ConfigParser.NoOptionError:
     return default
 
-def main():
+def main(argument_list=None):
   parser = argparse.ArgumentParser()
   parser.add_argument("-K", "--config", nargs=1, metavar="FILE", help="read config from FILE")
   parser.add_argument("-c", "--cookie-jar", nargs=1, metavar="FILE", help="write cookies to FILE after operation")
   parser.add_argument("--resolve", nargs="+", default=[], metavar="HOST:PORT:ADDRESS", help="force resolve of HOST:PORT to ADDRESS")
   parser.add_argument("url-list", nargs="*", metavar="URL", default=[])
-  args = parser.parse_args()
+  args = parser.parse_args(argument_list)
   args.url_list = getattr(args, "url-list")
 
   if args.config is not None:
@@ -15,25 +15,69 @@ import socket
 import struct
 assert struct.calcsize('I') == 4
 
-def isLocalTcpPortOpened(ip_address, port):
-  family = socket.getaddrinfo(ip_address, 0)[0][0]
-  conf = {
-    socket.AF_INET6: (4, "/proc/net/tcp6"),
-    socket.AF_INET: (1, "/proc/net/tcp"),
-  }
+# st column value of sockets in LISTEN state
+TCP_LISTEN = '0A'
 
-  int_count = conf[family][0]
-  tcp_path = conf[family][1]
+TCP_CONF = {
+  socket.AF_INET6: (4, "/proc/net/tcp6"),
+  socket.AF_INET: (1, "/proc/net/tcp"),
+}
 
+def getTcpAddress(ip_address, port):
+  """ Return the family and the /proc/net/tcp notation of ip_address:port """
+  family = socket.getaddrinfo(ip_address, 0)[0][0]
+  int_count = TCP_CONF[family][0]
   ip_addr_hex = ('%08X' * int_count) % struct.unpack('I' * int_count, socket.inet_pton(family, ip_address))
-  full_addr_hex = ip_addr_hex + ":%04X" % port
+  return family, ip_addr_hex + ":%04X" % port
+
+def getListeningAddressSet(family):
+  """ Return the local addresses of the listening sockets of family """
+  with open(TCP_CONF[family][1]) as tcp_file:
+    next(tcp_file) # header
+    return set(local_address
+               for _, local_address, _, state in (
+                 line.split(None, 4)[:4] for line in tcp_file)
+               if state == TCP_LISTEN)
+
+def isLocalTcpPortOpened(ip_address, port):
+  family, full_addr_hex = getTcpAddress(ip_address, port)
+  return full_addr_hex in getListeningAddressSet(family)
+
+def getClosedLocalTcpPortList(address_list):
+  """
+    Return the (ip_address, port) of address_list which are not listening.
+    /proc/net/tcp and /proc/net/tcp6 are read at most once.
+  """
+  listening_address_dict = {}
+  closed_address_list = []
+  for ip_address, port in address_list:
+    family, full_addr_hex = getTcpAddress(ip_address, port)
+    if family not in listening_address_dict:
+      listening_address_dict[family] = getListeningAddressSet(family)
+    if full_addr_hex not in listening_address_dict[family]:
+      closed_address_list.append((ip_address, port))
+  return closed_address_list
 
-  return any(full_addr_hex == line.split()[1] for line in open(tcp_path).readlines())
+def parseAddress(address):
+  """ Parse ip:port or [ipv6]:port """
+  ip_address, port = address.rsplit(':', 1)
+  return ip_address.strip('[]'), int(port)
 
-def main():
-  if isLocalTcpPortOpened(sys.argv[1], int(sys.argv[2])):
-    return 0
-  return 1
+def main(argument_list=None):
+  if argument_list is None:
+    argument_list = sys.argv[1:]
+  if len(argument_list) == 2 and argument_list[1].isdigit():
+    address_list = [(argument_list[0], int(argument_list[1]))]
+  else:
+    # several ip:port
+    address_list = [parseAddress(address) for address in argument_list]
+  closed_address_list = getClosedLocalTcpPortList(address_list)
+  for ip_address, port in closed_address_list:
+    print "%s:%s is not listening" % (
+      '[%s]' % ip_address if ':' in ip_address else ip_address, port)
+  if closed_address_list:
+    return 1
+  return 0
 
 if __name__ == "__main__":
   sys.exit(main())
@@ -12,12 +12,17 @@ import sys
 import os
 import errno
 import argparse
+import json
+import stat
+import time
 
 import psutil
 
 ignored_extension_set = set([".pyc"])
 
-def moduleIsModifiedSince(top, since, followlinks=False):
+def moduleIsModifiedSince(top, since, followlinks=False, cache=None):
+  if cache is not None:
+    return cache.getMaxMtime(top) > since
   for root, dir_list, file_list in os.walk(top, followlinks=followlinks):
     if root == top:
       continue
@@ -32,37 +37,179 @@ def moduleIsModifiedSince(top, since, followlinks=False):
         return True
   return False
 
-def isProcessOlderThanDependencySet(pid, python_path_list, kill=False):
+class DirectoryMtimeCache(object):
+  """
+    Modification date of the newest file of every folder, kept in a file
+    between runs. A folder is only listed again if its own modification
+    date changed, which happens when entries are added, removed or renamed,
+    as done when packages are installed. A file modified in place is not
+    detected until an entry of its folder changes.
+
+    Folders which were not used by a run are removed from the saved cache.
+    As modification dates may only have a one second resolution, a folder
+    listed during the second of its modification date is listed again on
+    next run.
+  """
+
+  def __init__(self, path=None, followlinks=False):
+    self.path = path
+    self.followlinks = followlinks
+    # folder -> [folder mtime, is a package, newest file mtime, folder list]
+    self.entry_dict = {}
+    # folders used since the cache was loaded
+    self.seen_set = set()
+    if path is not None:
+      try:
+        with open(path) as f:
+          self.entry_dict = json.load(f)
+      except (IOError, ValueError):
+        pass
+
+  def save(self):
+    temp_path = '%s.tmp' % self.path
+    with open(temp_path, 'w') as f:
+      json.dump(dict((path, entry) for path, entry in self.entry_dict.iteritems()
+                     if path in self.seen_set), f)
+    os.rename(temp_path, self.path)
+
+  def _getEntry(self, path):
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      return None
+    self.seen_set.add(path)
+    entry = self.entry_dict.get(path)
+    if entry is not None and entry[0] == mtime:
+      return entry
+    list_time = time.time()
+    try:
+      name_list = os.listdir(path)
+    except OSError:
+      return None
+    max_mtime = 0
+    dir_list = []
+    for name in name_list:
+      name_path = os.path.join(path, name)
+      try:
+        name_stat = os.stat(name_path)
+      except OSError:
+        # broken symlink
+        continue
+      if stat.S_ISDIR(name_stat.st_mode):
+        if self.followlinks or not os.path.islink(name_path):
+          dir_list.append(name_path)
+      elif os.path.splitext(name)[1] not in ignored_extension_set:
+        max_mtime = max(max_mtime, name_stat.st_mtime)
+    if int(mtime) >= int(list_time):
+      # the folder may be modified again in the same second, without its
+      # modification date changing
+      mtime = None
+    entry = self.entry_dict[path] = [mtime, '__init__.py' in name_list,
+                                     max_mtime, dir_list]
+    return entry
+
+  def _getPackageMaxMtime(self, path):
+    entry = self._getEntry(path)
+    if entry is None or not entry[1]:
+      return 0
+    return max([entry[2]] + [self._getPackageMaxMtime(dir_path)
+                             for dir_path in entry[3]])
+
+  def getMaxMtime(self, top):
+    """
+      Return the modification date of the newest file of the packages found
+      in top.
+    """
+    entry = self._getEntry(top)
+    if entry is None:
+      return 0
+    return max([0] + [self._getPackageMaxMtime(dir_path)
+                      for dir_path in entry[3]])
+
+def isProcessOlderThanDependencySet(pid, python_path_list, kill=False,
+                                    cache=None):
   process = psutil.Process(pid)
   start_time = process.create_time()
-  if any(moduleIsModifiedSince(product_path, start_time) for product_path in python_path_list):
+  if any(moduleIsModifiedSince(product_path, start_time, cache=cache)
+         for product_path in python_path_list):
     if kill:
       process.terminate()
     return True
   return False
 
-def isProcessFromPidFileOlderThanDependencySet(pid_file_path, python_path_list, kill=False):
+def isProcessFromPidFileOlderThanDependencySet(pid_file_path, python_path_list,
+                                               kill=False, cache=None):
   with open(pid_file_path, "r") as f:
     pid = int(f.readline())
-  return isProcessOlderThanDependencySet(pid, python_path_list, kill=kill)
+  return isProcessOlderThanDependencySet(pid, python_path_list, kill=kill,
+                                         cache=cache)
 
-def main():
+def getOlderPidFileList(pid_file_path_list, python_path_list, kill=False,
+                        cache=None):
+  """
+    Return the pid files of pid_file_path_list whose process is older than
+    the dependency set, which is scanned only once. Missing pid files and
+    processes are ignored.
+  """
+  if cache is None:
+    cache = DirectoryMtimeCache()
+  max_mtime = max([0] + [cache.getMaxMtime(product_path)
+                         for product_path in python_path_list])
+  older_pid_file_list = []
+  for pid_file_path in pid_file_path_list:
+    try:
+      with open(pid_file_path, "r") as f:
+        process = psutil.Process(int(f.readline()))
+      if max_mtime > process.create_time():
+        if kill:
+          process.terminate()
+        older_pid_file_list.append(pid_file_path)
+    except (OSError, IOError) as err:
+      if err.errno != errno.ENOENT:
+        raise
+    except psutil.NoSuchProcess:
+      pass
+  return older_pid_file_list
+
+def main(argument_list=None):
   parser = argparse.ArgumentParser()
   parser.add_argument("-k", "--kill", action="store_true")
+  parser.add_argument("-p", "--pid-file", dest="pid_file_path_list",
+                      action="append", default=[], metavar="PID_FILE",
+                      help="Additional process to check against the same scan")
+  parser.add_argument("--cache-file", dest="cache_file",
+                      help="File where the newest modification date of every "
+                           "folder is kept, folders which were not modified "
+                           "are not scanned again")
   parser.add_argument("pid_file_path", metavar="PID_FILE")
   parser.add_argument("python_path_list", nargs="*", metavar="ADDITIONAL_PYTHON_PATH", default=[])
-  args = parser.parse_args()
+  args = parser.parse_args(argument_list)
 
+  cache = None
+  if args.cache_file:
+    cache = DirectoryMtimeCache(args.cache_file)
   try:
-    if isProcessFromPidFileOlderThanDependencySet(args.pid_file_path, sys.path + args.python_path_list, kill=args.kill):
-      return 1
-    return 0
-  except (OSError, IOError) as err:
-    if err.errno == errno.ENOENT:
+    if args.pid_file_path_list:
+      older_pid_file_list = getOlderPidFileList(
+        [args.pid_file_path] + args.pid_file_path_list,
+        sys.path + args.python_path_list, kill=args.kill, cache=cache)
+      for pid_file_path in older_pid_file_list:
+        print "Process of %s is older than its dependencies" % pid_file_path
+      return 1 if older_pid_file_list else 0
+
+    try:
+      if isProcessFromPidFileOlderThanDependencySet(args.pid_file_path, sys.path + args.python_path_list, kill=args.kill, cache=cache):
+        return 1
+      return 0
+    except (OSError, IOError) as err:
+      if err.errno == errno.ENOENT:
+        return 0
+      raise
+    except psutil.NoSuchProcess:
       return 0
-    raise
-  except psutil.NoSuchProcess:
-    return 0
+  finally:
+    if cache is not None:
+      cache.save()
 
 if __name__ == "__main__":
   sys.exit(main())
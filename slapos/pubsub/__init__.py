@@ -1,13 +1,12 @@
 import argparse
+import calendar
 import csv
 import feedparser
 import httplib # To avoid magic numbers
-import io
 import json
 import logging
 import math
 import os
-import socket
 import sys
 import time
 from datetime import datetime
@@ -19,11 +18,29 @@ from atomize import Content
 from flask import Flask
 from flask import abort
 from flask import request
+from werkzeug.http import http_date
+
+from slapos.pubsub.callbackregistry import getCallbackRegistry
+from slapos.pubsub.equeueclient import getEqueueClientPool
+from slapos.pubsub.feedindex import getFeedIndex
 app = Flask(__name__)
 
 # csv entries can be very large, increase limit.
 csv.field_size_limit(sys.maxsize)
 
+# Rendered feeds, by request, kept until the feed file changes
+_rendered_feed_dict = {}
+RENDERED_FEED_CACHE_SIZE = 128
+
+def _getIntArgument(name):
+  value = request.args.get(name)
+  if value is None:
+    return None
+  try:
+    return int(value)
+  except ValueError:
+    abort(httplib.BAD_REQUEST)
+
 @app.route('/get/<feed>')
 def get_feed(feed):
   global app
@@ -31,41 +48,58 @@ def get_feed(feed):
   if not os.path.exists(feedpath):
     abort(httplib.NOT_FOUND)
 
+  limit = _getIntArgument('limit')
+  since = _getIntArgument('since')
+  feed_index = getFeedIndex(feedpath)
+  stat = feed_index.update()
+
+  etag = '%x-%x' % (int(stat.st_mtime * 1e6), stat.st_size)
+  if request.args:
+    etag += '-' + sha512(request.query_string).hexdigest()[:16]
+  header_dict = {
+    'Content-Type': 'application/atom+xml',
+    'ETag': '"%s"' % etag,
+    'Last-Modified': http_date(stat.st_mtime),
+  }
+  if etag in request.if_none_match or (not request.if_none_match and
+      request.if_modified_since is not None and
+      calendar.timegm(request.if_modified_since.utctimetuple()) >=
+        int(stat.st_mtime)):
+    return '', httplib.NOT_MODIFIED, header_dict
+
+  cache_key = (feedpath, request.url)
+  cached = _rendered_feed_dict.get(cache_key)
+  if cached is not None and cached[0] == etag:
+    return cached[1], httplib.OK, header_dict
+
   # XXX: Add a way to specify a title
   feed_title = 'Untitled'
   feed_guid = request.url
   # XXX: Add a way to specify an author
   feed_author = 'No author'
 
+  # rows are read newest first
   entries = []
-  feed_updated = 0
-  with open(feedpath, 'r') as feed_file:
-    reader = csv.reader(feed_file)
-    for row in reader:
-      timestamp, title, content, guid = row
-
-      timestamp = int(timestamp)
-      # Keep the maximum timestamp without
-      # looping once more.
-      if timestamp > feed_updated:
-        feed_updated = timestamp
-
-      entries.append(Entry(title=title,
-                           guid=guid,
-                           updated=datetime.fromtimestamp(timestamp),
-                           content=Content(content, content_type='html'),
-                          ))
-  entries.reverse()
+  for timestamp, title, content, guid in feed_index.getRowList(limit, since):
+    entries.append(Entry(title=title,
+                         guid=guid,
+                         updated=datetime.fromtimestamp(int(timestamp)),
+                         content=Content(content, content_type='html'),
+                        ))
   feed = Feed(title=feed_title,
-              updated=datetime.fromtimestamp(feed_updated),
+              updated=datetime.fromtimestamp(feed_index.updated),
               guid=feed_guid,
               author=feed_author,
               entries=entries,
               self_link=request.url)
+  feed_string = feed.feed_string()
 
-  return (feed.feed_string(),
+  if len(_rendered_feed_dict) >= RENDERED_FEED_CACHE_SIZE:
+    _rendered_feed_dict.clear()
+  _rendered_feed_dict[cache_key] = etag, feed_string
+  return (feed_string,
           httplib.OK,
-          {'Content-Type': 'application/atom+xml'}
+          header_dict,
          )
 
 @app.route('/notify/<int:transaction_id>', methods=['POST'])
@@ -80,36 +114,29 @@ def notify(transaction_id):
     abort(httplib.BAD_REQUEST)
 
   try:
-    callback_filepath = os.path.join(app.config['CALLBACKS'],
-                                     sha512(str(feed.feed.id)).hexdigest())
-    if not os.path.exists(callback_filepath):
-      abort(httplib.NOT_FOUND)
+    callback_list = getCallbackRegistry(app.config['CALLBACKS']) \
+      .getCallbackList(str(feed.feed.id))
   except AttributeError:
     abort(httplib.BAD_REQUEST)
+  if callback_list is None:
+    abort(httplib.NOT_FOUND)
 
-
-  abort_it = False
-
-  for callback in io.open(callback_filepath, 'r', encoding='utf8'):
-    timestamp = int(math.floor(time.mktime(feed.feed.updated_parsed)))
-
-    equeue_request = json.dumps({
-        'command': '%s\0--transaction-id\0%s' % (callback, transaction_id),
-        'timestamp': timestamp,
-        })
-
-    equeue_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    equeue_socket.connect(app.config['EQUEUE_SOCKET'])
-    equeue_socket.send(equeue_request)
-    result = equeue_socket.recv(len(callback))
-    equeue_socket.close()
-
-    if result != callback:
-      abort_it = True
-
-  if abort_it:
-    # XXX if possible, communicate info about the failed callbacks
-    abort(httplib.INTERNAL_SERVER_ERROR)
+  timestamp = int(math.floor(time.mktime(feed.feed.updated_parsed)))
+  request_list = [('%s\0--transaction-id\0%s' % (callback, transaction_id),
+                   timestamp) for callback in callback_list]
+
+  # callbacks are sent in batches, through connections kept open
+  result_list = getEqueueClientPool(app.config['EQUEUE_SOCKET']) \
+    .requestConcurrently(request_list)
+
+  failed_callback_list = [callback.strip()
+    for callback, (command, _), result in zip(callback_list, request_list,
+                                              result_list)
+    if result != command]
+  if failed_callback_list:
+    return (json.dumps({'failed_callback_list': failed_callback_list}),
+            httplib.INTERNAL_SERVER_ERROR,
+            {'Content-Type': 'application/json'})
 
   return '', httplib.NO_CONTENT
 
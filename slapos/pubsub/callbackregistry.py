@@ -0,0 +1,58 @@
+"""
+In process cache of the callback files of pubsub.
+
+The callbacks of a feed are stored in a file named after the sha512 of the
+feed id. Callbacks are read again only when the callback directory or the
+callback file is modified.
+"""
+
+import io
+import os
+import threading
+from hashlib import sha512
+
+class CallbackRegistry(object):
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.directory_mtime = None
+    # feed id -> (callback file path, mtime, callback list)
+    self.callback_dict = {}
+    self.lock = threading.Lock()
+
+  def getCallbackList(self, feed_id):
+    """ Return the callbacks of feed_id, None if it has no callback file """
+    directory_mtime = os.stat(self.directory).st_mtime
+    with self.lock:
+      if directory_mtime != self.directory_mtime:
+        # callback files were added or removed
+        self.callback_dict.clear()
+        self.directory_mtime = directory_mtime
+      cached = self.callback_dict.get(feed_id)
+    if cached is None:
+      path = os.path.join(self.directory, sha512(feed_id).hexdigest())
+    else:
+      path = cached[0]
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      return None
+    if cached is not None and cached[1] == mtime:
+      return cached[2]
+    with io.open(path, 'r', encoding='utf8') as callback_file:
+      callback_list = list(callback_file)
+    with self.lock:
+      self.callback_dict[feed_id] = path, mtime, callback_list
+    return callback_list
+
+
+_registry_dict = {}
+_registry_dict_lock = threading.Lock()
+
+def getCallbackRegistry(directory):
+  with _registry_dict_lock:
+    try:
+      return _registry_dict[directory]
+    except KeyError:
+      registry = _registry_dict[directory] = CallbackRegistry(directory)
+      return registry
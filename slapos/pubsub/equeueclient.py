@@ -0,0 +1,174 @@
+"""
+Client of the newline framed protocol of slapos.equeue.
+
+Each request is a json object {"id": ..., "command": ..., "timestamp": ...}
+followed by a newline, and is answered by a json line with the same id. A
+connection can be used for any number of requests, so connections are kept
+in a pool and reused between notifications.
+
+A {"id": ..., "command": "metrics"} request, without timestamp, is answered
+by the queue metrics of equeue instead of being queued.
+"""
+
+import contextlib
+import json
+import socket
+import threading
+
+class EqueueClient(object):
+
+  def __init__(self, socket_path, timeout=None):
+    self.socket_path = socket_path
+    self.timeout = timeout
+    self.socket = None
+    self.reader = None
+    self.request_id = 0
+
+  def connect(self):
+    if self.socket is None:
+      self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.socket.settimeout(self.timeout)
+      self.socket.connect(self.socket_path)
+      self.reader = self.socket.makefile('rb')
+
+  def close(self):
+    if self.socket is not None:
+      self.reader.close()
+      self.socket.close()
+      self.socket = None
+      self.reader = None
+
+  def _request(self, parameter_list):
+    self.connect()
+    id_list = []
+    data_list = []
+    for parameter_dict in parameter_list:
+      self.request_id += 1
+      id_list.append(self.request_id)
+      data_list.append(json.dumps(dict(parameter_dict,
+                                       id=self.request_id)) + '\n')
+    # all requests are sent before reading the answers
+    self.socket.sendall(''.join(data_list))
+    answer_dict = {}
+    while len(answer_dict) < len(id_list):
+      line = self.reader.readline()
+      if not line:
+        raise socket.error('Connection closed by equeue')
+      answer = json.loads(line)
+      answer_dict[answer['id']] = answer
+    return [answer_dict.get(request_id, {}) for request_id in id_list]
+
+  def _send(self, parameter_list):
+    try:
+      return self._request(parameter_list)
+    except socket.error:
+      # equeue may have closed an idle connection, retry once with a new one
+      self.close()
+      try:
+        return self._request(parameter_list)
+      except Exception:
+        self.close()
+        raise
+    except Exception:
+      self.close()
+      raise
+
+  def request(self, request_list):
+    """
+      Send the (command, timestamp) of request_list and return the list of
+      commands acknowledged by equeue, None for refused requests.
+    """
+    if not request_list:
+      return []
+    return [answer.get('command') for answer in self._send(
+      [{'command': command, 'timestamp': timestamp}
+       for command, timestamp in request_list])]
+
+  def getMetricDict(self):
+    """ Return the queue metrics of equeue """
+    answer, = self._send([{'command': 'metrics'}])
+    return answer.get('metrics')
+
+
+class EqueueClientPool(object):
+
+  def __init__(self, socket_path, size=4, timeout=None):
+    self.socket_path = socket_path
+    self.size = size
+    self.timeout = timeout
+    self.client_list = []
+    self.lock = threading.Lock()
+
+  @contextlib.contextmanager
+  def client(self):
+    with self.lock:
+      if self.client_list:
+        client = self.client_list.pop()
+      else:
+        client = EqueueClient(self.socket_path, self.timeout)
+    try:
+      yield client
+    except Exception:
+      client.close()
+      raise
+    with self.lock:
+      if client.socket is not None and len(self.client_list) < self.size:
+        self.client_list.append(client)
+        client = None
+    if client is not None:
+      client.close()
+
+  def request(self, request_list):
+    with self.client() as client:
+      return client.request(request_list)
+
+  def getMetricDict(self):
+    with self.client() as client:
+      return client.getMetricDict()
+
+  def requestConcurrently(self, request_list, min_chunk_size=8):
+    """
+      Same as request, but request_list is split in chunks sent at the same
+      time through different connections. Requests of a chunk which could
+      not be sent are returned as refused.
+    """
+    chunk_size = max(min_chunk_size,
+                     -(-len(request_list) // self.size))
+    chunk_list = [request_list[index:index + chunk_size]
+                  for index in xrange(0, len(request_list), chunk_size)]
+    result_list = [None] * len(chunk_list)
+
+    def sendChunk(index):
+      try:
+        result_list[index] = self.request(chunk_list[index])
+      except (socket.error, ValueError, KeyError):
+        result_list[index] = [None] * len(chunk_list[index])
+
+    thread_list = [threading.Thread(target=sendChunk, args=(index,))
+                   for index in xrange(1, len(chunk_list))]
+    for thread in thread_list:
+      thread.start()
+    if chunk_list:
+      sendChunk(0)
+    for thread in thread_list:
+      thread.join()
+    return [result for chunk_result in result_list for result in chunk_result]
+
+  def close(self):
+    with self.lock:
+      client_list, self.client_list = self.client_list, []
+    for client in client_list:
+      client.close()
+
+
+_pool_dict = {}
+_pool_dict_lock = threading.Lock()
+
+def getEqueueClientPool(socket_path, timeout=None):
+  with _pool_dict_lock:
+    try:
+      return _pool_dict[socket_path]
+    except KeyError:
+      pool = _pool_dict[socket_path] = EqueueClientPool(socket_path,
+                                                        timeout=timeout)
+      return pool
@@ -0,0 +1,104 @@
+"""
+Index of the rows of the csv feed files served by pubsub.
+
+Feed files only grow: rows are appended by pubsubnotifier. The offset and
+the timestamp of every row are kept in memory and only the end of the file
+added since the previous read is scanned, so a request only reads the rows
+it returns. The index is built again if the file is truncated or replaced.
+"""
+
+import csv
+import os
+import threading
+
+class FeedIndex(object):
+
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self._reset()
+
+  def _reset(self):
+    # size of the indexed part of the file, it always ends on a row boundary
+    self.size = 0
+    self.mtime = None
+    # identity of the indexed file, to detect it was replaced
+    self.file_id = None
+    self.offset_list = []
+    self.timestamp_list = []
+    self.updated = 0
+
+  def update(self):
+    """ Index rows added since the last update, return the file stat """
+    stat = os.stat(self.path)
+    file_id = stat.st_dev, stat.st_ino
+    with self.lock:
+      if file_id == self.file_id and stat.st_mtime == self.mtime \
+          and stat.st_size == self.size:
+        return stat
+      if file_id != self.file_id or stat.st_size < self.size:
+        # file was truncated or replaced
+        self._reset()
+        self.file_id = file_id
+      self._scan()
+      self.mtime = stat.st_mtime
+    return stat
+
+  def _scan(self):
+    with open(self.path, 'rb') as feed_file:
+      feed_file.seek(self.size)
+      position = row_start = self.size
+      first_line = None
+      in_quote = False
+      for line in feed_file:
+        if first_line is None:
+          first_line = line
+        position += len(line)
+        # quotes inside a quoted field are doubled, so a newline ends the
+        # row only if an even number of quotes were read since its start
+        if line.count('"') % 2:
+          in_quote = not in_quote
+        if not in_quote and line.endswith('\n'):
+          self._addRow(row_start, first_line)
+          row_start = position
+          first_line = None
+    # an incomplete last row is indexed on next update
+    self.size = row_start
+
+  def _addRow(self, offset, first_line):
+    timestamp = int(first_line.split(',', 1)[0].strip('"'))
+    self.offset_list.append(offset)
+    self.timestamp_list.append(timestamp)
+    if timestamp > self.updated:
+      self.updated = timestamp
+
+  def getRowList(self, limit=None, since=None):
+    """
+      Return the rows with a timestamp greater than since, newest first,
+      limited to limit rows.
+    """
+    with self.lock:
+      offset_list = []
+      for index in xrange(len(self.offset_list) - 1, -1, -1):
+        if limit is not None and len(offset_list) >= limit:
+          break
+        if since is None or self.timestamp_list[index] > since:
+          offset_list.append(self.offset_list[index])
+    row_list = []
+    with open(self.path, 'rb') as feed_file:
+      for offset in offset_list:
+        feed_file.seek(offset)
+        row_list.append(next(csv.reader(feed_file)))
+    return row_list
+
+
+_index_dict = {}
+_index_dict_lock = threading.Lock()
+
+def getFeedIndex(path):
+  with _index_dict_lock:
+    try:
+      return _index_dict[path]
+    except KeyError:
+      index = _index_dict[path] = FeedIndex(path)
+      return index
@@ -2,26 +2,34 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import cgi
+import collections
 import csv
 import datetime
 import json
 import httplib
 import os
+import re
 import socket
 import subprocess
 import sys
+import threading
 import time
 import traceback
 import urllib2
 import urlparse
 import uuid
 
-def createStatusItem(item_directory, instance_name, callback, date, link, status):
+def createStatusItem(item_directory, instance_name, callback, date, link, status,
+                     summary=None):
   global app
   callback_short_name = os.path.basename(callback)
+  description = '%s run at %s' % (callback_short_name, datetime.datetime.fromtimestamp(date).isoformat())
+  if summary:
+    description += '\n' + summary
   content = json.dumps({
     'title': '%s-PBS %s : %s' % (instance_name, callback_short_name, status),
-    'description': '%s run at %s' % (callback_short_name, datetime.datetime.fromtimestamp(date).isoformat()),
+    'description': description,
     'pubDate': date,
     'link': link,
   })
@@ -30,6 +38,150 @@ def createStatusItem(item_directory, instance_name, callback, date, link, status
   with open(item_path, 'w') as file:
     file.write(content)
 
+def captureOutput(command, max_size, spool_file=None):
+  """
+    Run command and return its exit code, its output and the size of its
+    output. When the output is bigger than max_size, only its beginning and
+    its end are kept in memory. The whole output is written to spool_file.
+  """
+  process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+  head_size = max_size // 2
+  tail_size = max_size - head_size
+  head = []
+  tail = collections.deque()
+  head_length = tail_length = output_size = 0
+  fd = process.stdout.fileno()
+  while True:
+    data = os.read(fd, 65536)
+    if not data:
+      break
+    if spool_file is not None:
+      spool_file.write(data)
+    output_size += len(data)
+    if head_length < head_size:
+      part = data[:head_size - head_length]
+      head.append(part)
+      head_length += len(part)
+      data = data[len(part):]
+    if data and tail_size:
+      tail.append(data)
+      tail_length += len(data)
+      # drop chunks which are no longer in the tail
+      while tail_length - len(tail[0]) >= tail_size:
+        tail_length -= len(tail.popleft())
+  process.stdout.close()
+  exit_code = process.wait()
+  head = ''.join(head)
+  tail = ''.join(tail)[-tail_size:] if tail_size else ''
+  if output_size <= max_size:
+    return exit_code, head + tail, output_size
+  return exit_code, '%s\n[... %s bytes skipped ...]\n%s' % (
+    head, output_size - len(head) - len(tail), tail), output_size
+
+def openOutputLog(directory, executable, count):
+  """
+    Open a new file to spool the output of executable, removing the oldest
+    ones to keep count files. Logs of other executables written in the same
+    directory are kept.
+  """
+  prefix = '%s.' % os.path.basename(executable)
+  output_log_re = re.compile(r'%s\d{8}-\d{6}-\d{6}\.log$' % re.escape(prefix))
+  output_log_list = sorted(name for name in os.listdir(directory)
+                           if output_log_re.match(name))
+  for name in output_log_list[:max(0, len(output_log_list) - count + 1)]:
+    os.remove(os.path.join(directory, name))
+  return open(os.path.join(directory, '%s%s.log' % (
+    prefix, datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'))), 'w')
+
+def postNotification(connection, notification, body, headers, retry, backoff):
+  """
+    Post body to the notification url, reusing connection. Failed posts are
+    retried, waiting backoff seconds doubled at each attempt.
+  """
+  result = {'url': notification['url'], 'attempts': 0}
+  start = time.time()
+  while True:
+    result['attempts'] += 1
+    # status of the last attempt only
+    result.pop('status', None)
+    try:
+      connection.request('POST', notification['path'], body, headers)
+      response = connection.getresponse()
+      response.read()
+      result['status'] = response.status
+      if 200 <= response.status < 300:
+        result.pop('error', None)
+        break
+      result['error'] = ("The remote server at %s didn't send a successful reponse.\n"
+                         "Its response was %r\n") % (notification['url'], response.reason)
+    except (socket.error, httplib.HTTPException):
+      connection.close()
+      result['error'] = ("Connection with remote server at %s failed:\n%s" % (
+        notification['url'], traceback.format_exc()))
+    if result['attempts'] > retry:
+      break
+    time.sleep(backoff * 2 ** (result['attempts'] - 1))
+  result['latency'] = time.time() - start
+  return result
+
+def notifyHost(notification_list, body, headers, timeout, retry, backoff,
+               result_dict):
+  """
+    Send the notifications of a same host one after the other, through a
+    single keep-alive connection.
+  """
+  hostname, port = notification_list[0]['host']
+  connection = httplib.HTTPConnection(hostname, port, timeout=timeout)
+  try:
+    for notification in notification_list:
+      result_dict[notification['index']] = postNotification(connection,
+        notification, body, headers, retry, backoff)
+  finally:
+    connection.close()
+
+def notify(notification_url_list, body, headers, transaction_id=None,
+           timeout=30, retry=2, backoff=1):
+  """
+    Post body to every notification url, the hosts being notified at the
+    same time. Return the result of every url, in the order of
+    notification_url_list.
+  """
+  host_dict = {}
+  for index, notif_url in enumerate(notification_url_list):
+    notification_url = urlparse.urlparse(notif_url)
+
+    notification_port = notification_url.port
+    if notification_port is None:
+      notification_port = socket.getservbyname(notification_url.scheme)
+
+    notification_path = notification_url.path
+    if not notification_path.endswith('/'):
+      notification_path += '/'
+    notification_path += str(transaction_id if transaction_id is not None
+                             else int(time.time()*1e6))
+
+    host = notification_url.hostname, notification_port
+    host_dict.setdefault(host, []).append({'index': index, 'url': notif_url,
+      'host': host, 'path': notification_path})
+
+  result_dict = {}
+  thread_list = [threading.Thread(target=notifyHost, args=(notification_list,
+                   body, headers, timeout, retry, backoff, result_dict))
+                 for notification_list in host_dict.itervalues()]
+  for thread in thread_list:
+    thread.start()
+  for thread in thread_list:
+    thread.join()
+  return [result_dict[index] for index in xrange(len(notification_url_list))]
+
+def getNotificationSummary(result_list):
+  return '\n'.join('%s: %s in %.2fs (%s attempt(s))' % (
+      result['url'], 'OK' if 'error' not in result else
+                     'FAILED (%s)' % result.get('status', 'no response'),
+      result['latency'], result['attempts'])
+    for result in result_list)
+
 
 def main():
   parser = argparse.ArgumentParser()
@@ -51,6 +203,28 @@ def main():
   parser.add_argument('--max-run', dest='max_run',
                       type=int, default=1, required=False,
                       help="Run executable until it ends correctly, in a limit of max-run times")
+  parser.add_argument('--output-max-size', dest='output_max_size',
+                      type=int, default=1024 * 1024, required=False,
+                      help="Maximum size in bytes of the output written in the "
+                           "feed, only its beginning and its end are kept")
+  parser.add_argument('--output-log-directory', dest='output_log_directory',
+                      required=False,
+                      help="Directory where the whole output of every run is written")
+  parser.add_argument('--output-log-count', dest='output_log_count',
+                      type=int, default=10, required=False,
+                      help="Number of output logs kept in output-log-directory")
+  parser.add_argument('--output-log-url', dest='output_log_url',
+                      required=False,
+                      help="URL where output-log-directory is accessible")
+  parser.add_argument('--notification-timeout', dest='notification_timeout',
+                      type=float, default=30, required=False,
+                      help="Timeout in seconds of the feed fetch and of every notification")
+  parser.add_argument('--notification-retry', dest='notification_retry',
+                      type=int, default=2, required=False,
+                      help="Number of times a failed notification is retried")
+  parser.add_argument('--notification-backoff', dest='notification_backoff',
+                      type=float, default=1, required=False,
+                      help="Seconds to wait before the first retry, doubled at each retry")
 
   # Verbose mode
   parser.add_argument('--instance-root-name', dest='instance_root_name',
@@ -66,14 +240,16 @@ def main():
 
   if args.instance_root_name and args.log_url and args.status_item_directory:
     # Verbose mode
-    saveStatus = lambda status: createStatusItem(args.status_item_directory,
+    saveStatus = lambda status, summary=None: createStatusItem(
+                                  args.status_item_directory,
                                   args.instance_root_name,
                                   args.executable[0],
                                   time.time(),
                                   args.log_url,
-                                  status)
+                                  status,
+                                  summary)
   else:
-    saveStatus = lambda status: None
+    saveStatus = lambda status, summary=None: None
 
   saveStatus('STARTED')
 
@@ -82,29 +258,43 @@ def main():
     sys.exit(-1)
 
   while args.max_run > 0:
+    spool_file = None
+    if args.output_log_directory:
+      spool_file = openOutputLog(args.output_log_directory,
+                                 args.executable[0], args.output_log_count)
     try:
-      content = subprocess.check_output(
-          args.executable[0],
-          stderr=subprocess.STDOUT
-      )
-      exit_code = 0
+      exit_code, content, output_size = captureOutput(args.executable[0],
+        args.output_max_size, spool_file)
+    finally:
+      if spool_file is not None:
+        spool_file.close()
+    if output_size > args.output_max_size and spool_file is not None:
+      output_log = os.path.basename(spool_file.name)
+      if args.output_log_url:
+        output_log = '<a href="%s/%s">%s</a>' % (
+          args.output_log_url.rstrip('/'), output_log, output_log)
+      output_log = "<p>Full output (%s bytes): %s</p>" % (output_size,
+                                                          output_log)
+    else:
+      output_log = ''
+    if exit_code == 0:
       content = ("OK</br><p>%s ran successfully</p>"
-                    "<p>Output is: </p><pre>%s</pre>" % (
+                    "<p>Output is: </p><pre>%s</pre>%s" % (
             args.executable[0],
-            content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            cgi.escape(content),
+            output_log,
         ))
       saveStatus('FINISHED')
       break
-    except subprocess.CalledProcessError as e:
+    else:
       args.max_run -= 1
       saveStatus('ERROR')
-      content = e.output
-      exit_code = e.returncode
       content = ("FAILURE</br><p>%s Failed with returncode <em>%d</em>.</p>"
-                    "<p>Output is: </p><pre>%s</pre>" % (
+                    "<p>Output is: </p><pre>%s</pre>%s" % (
             args.executable[0],
             exit_code,
-            content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            cgi.escape(content),
+            output_log,
         ))
 
   print content
@@ -124,48 +314,25 @@ def main():
 
   print 'Fetching %s feed...' % args.feed_url[0]
 
-  feed = urllib2.urlopen(args.feed_url[0])
+  feed = urllib2.urlopen(args.feed_url[0], timeout=args.notification_timeout)
   body = feed.read()
 
-  some_notification_failed = False
-  for notif_url in args.notification_url:
-    notification_url = urlparse.urlparse(notif_url)
-
-    notification_port = notification_url.port
-    if notification_port is None:
-      notification_port = socket.getservbyname(notification_url.scheme)
-
-    notification_path = notification_url.path
-    if not notification_path.endswith('/'):
-      notification_path += '/'
-
-    transaction_id = args.transaction_id[0] if args.transaction_id else int(time.time()*1e6)
-    notification_path += str(transaction_id)
-
-    headers = {'Content-Type': feed.info().getheader('Content-Type')}
-    error_message = ""
-    try:
-      notification = httplib.HTTPConnection(notification_url.hostname,
-                                            notification_port)
-      notification.request('POST', notification_path, body, headers)
-      response = notification.getresponse()
-      if not (200 <= response.status < 300):
-        error_message = ("The remote server at %s didn't send a successful reponse.\n"
-                         "Its response was %r\n") % (notif_url, response.reason)
-        some_notification_failed = True
-    except socket.error as exc:
-      error_message = "Connection with remote server at %s failed:\n" % notif_url
-      error_message.append(traceback.format_exc(exc))
-      some_notification_failed = True
-    finally:
-      if error_message:
-        sys.stderr.write(error_message)
-        saveStatus(saveStatus('ERROR ON NOTIFYING : %s') % error_message)
+  headers = {'Content-Type': feed.info().getheader('Content-Type')}
+  result_list = notify(args.notification_url, body, headers,
+                       args.transaction_id[0] if args.transaction_id else None,
+                       args.notification_timeout, args.notification_retry,
+                       args.notification_backoff)
+  summary = getNotificationSummary(result_list)
+  print summary
 
-  if some_notification_failed:
+  error_message = ''.join(result['error'] for result in result_list
+                          if 'error' in result)
+  if error_message:
+    sys.stderr.write(error_message)
+    saveStatus('ERROR ON NOTIFYING : %s' % error_message, summary)
     sys.exit(1)
 
-  saveStatus('OK')
+  saveStatus('OK', summary)
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Compare check-feed-as-promise with feedparser and with the incremental
+parser (--fast) on a big feed.
+
+Usage: python -m slapos.test.benchmark.bench_checkfeedaspromise [--items 10000]
+"""
+
+import argparse
+import datetime
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import PyRSS2Gen as RSS2
+
+from slapos.checkfeedaspromise import checkFeedAsPromise
+
+class Option(object):
+  def __init__(self, **kw):
+    self.__dict__.update(kw)
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--items', type=int, default=10000,
+                      help='Number of items in the feed.')
+  parser.add_argument('--repeat', type=int, default=3)
+  option = parser.parse_args()
+
+  now = datetime.datetime.now()
+  feed = RSS2.RSS2(
+    title="Feed Title",
+    link="http://example.com",
+    description="Feed Description",
+    items=[RSS2.RSSItem(title='PBS run %s: OK' % index,
+                        description='Output of run %s ' % index * 20,
+                        pubDate=now - datetime.timedelta(minutes=index))
+           for index in xrange(option.items, 0, -1)]).to_xml()
+
+  base_dir = tempfile.mkdtemp()
+  try:
+    feed_path = os.path.join(base_dir, 'feed.rss')
+    with open(feed_path, 'w') as f:
+      f.write(feed)
+    print "feed of %s items, %.1f MB" % (option.items, len(feed) / 1e6)
+    # fast parser first, max rss only grows
+    for fast in (True, False):
+      promise_option = Option(title=True, description=False, time_buffer=0,
+                              ok_pattern_list=['OK'], ko_pattern_list=[],
+                              fast=fast)
+      start = time.time()
+      for _ in xrange(option.repeat):
+        assert checkFeedAsPromise(feed_path, promise_option) == ''
+      print "%-10s: %.3fs per check, max rss %s kB" % (
+        'fast' if fast else 'feedparser',
+        (time.time() - start) / option.repeat,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+  finally:
+    shutil.rmtree(base_dir)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the legacy ResourceCollect queries with the single pass
+getPartitionResourceSummary on a synthetic collector database.
+
+Usage: python -m slapos.test.benchmark.bench_collect [--rows 1000000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from slapos.monitor.collect import ResourceCollect
+from slapos.test.monitor.testcollect import CREATE_USER_TABLE, \
+  CREATE_FOLDER_TABLE
+
+def createSyntheticDatabase(db_path, row_amount, partition_amount,
+                            process_amount):
+  """
+    One sample per minute for every process of every partition, going back
+    in time from now until row_amount rows are written.
+  """
+  connection = sqlite3.connect(db_path)
+  connection.execute(CREATE_USER_TABLE)
+  connection.execute(CREATE_FOLDER_TABLE)
+  now = datetime.now().replace(second=10)
+
+  def iterUserRow():
+    sample = 0
+    while True:
+      moment = now - timedelta(minutes=sample)
+      date, time_ = moment.strftime('%Y-%m-%d'), moment.strftime('%H:%M:%S')
+      for partition in xrange(partition_amount):
+        for pid in xrange(process_amount):
+          yield ('slappart%s' % partition, pid, 'process', random.random()*100,
+                 random.random()*10, 4, random.random()*10,
+                 random.randint(1, 1024)*1024*1024, random.randint(0, 1000),
+                 random.randint(0, 1000), date, time_)
+      sample += 1
+
+  def iterFolderRow(sample_amount):
+    for sample in xrange(sample_amount):
+      moment = now - timedelta(minutes=sample)
+      for partition in xrange(partition_amount):
+        yield ('slappart%s' % partition, random.randint(1, 1024)*1024,
+               moment.strftime('%Y-%m-%d'), moment.strftime('%H:%M:%S'))
+
+  row_iterator = iterUserRow()
+  connection.executemany("""insert into user (partition, pid, process,
+    cpu_percent, cpu_time, cpu_num_threads, memory_percent, memory_rss,
+    io_rw_counter, io_cycles_counter, date, time)
+    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    (row_iterator.next() for _ in xrange(row_amount)))
+  connection.executemany("""insert into folder (partition, disk_used, date,
+    time) values (?, ?, ?, ?)""",
+    iterFolderRow(row_amount // (partition_amount * process_amount) + 1))
+  connection.commit()
+  connection.close()
+
+def runLegacy(db_path, partition_id, date_scope):
+  collector = ResourceCollect(db_path)
+  collector.getPartitionCPULoadAverage(partition_id, date_scope)
+  collector.getPartitionUsedMemoryAverage(partition_id, date_scope)
+  collector.getPartitionDiskUsedAverage(partition_id, date_scope)
+  collector.getPartitionComsumptionStatus(partition_id)
+
+def runSummary(db_path, partition_id, date_scope):
+  collector = ResourceCollect(db_path)
+  collector.getPartitionResourceSummary(partition_id, date_scope)
+  collector.close()
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--rows', type=int, default=1000000,
+                      help='Number of rows in the user table.')
+  parser.add_argument('--partitions', type=int, default=20)
+  parser.add_argument('--processes', type=int, default=10,
+                      help='Number of processes per partition.')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--db', help='Existing collector database to use.')
+  option = parser.parse_args()
+
+  base_dir = None
+  db_path = option.db
+  if db_path is None:
+    base_dir = tempfile.mkdtemp()
+    db_path = os.path.join(base_dir, 'collector.db')
+    start = time.time()
+    createSyntheticDatabase(db_path, option.rows, option.partitions,
+                            option.processes)
+    print "Created %s rows in %.2fs" % (option.rows, time.time() - start)
+
+  date_scope = datetime.now().strftime('%Y-%m-%d')
+  try:
+    for name, method in (('legacy', runLegacy), ('summary', runSummary)):
+      duration_list = []
+      for _ in xrange(option.repeat):
+        start = time.time()
+        method(db_path, 'slappart0', date_scope)
+        duration_list.append(time.time() - start)
+      print "%-8s best %.3fs, mean %.3fs" % (name, min(duration_list),
+        sum(duration_list) / len(duration_list))
+  finally:
+    if base_dir is not None:
+      shutil.rmtree(base_dir)
+
+if __name__ == '__main__':
+  main()
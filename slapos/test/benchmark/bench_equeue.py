@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Compare enqueue throughput of the legacy one connection per request
+protocol of equeue with the newline framed protocol used by pubsub.
+
+Usage: python -m slapos.test.benchmark.bench_equeue [--requests 2000]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from slapos.equeue import EqueueServer
+from slapos.pubsub.equeueclient import EqueueClient
+
+def legacyRequest(socket_path, command, timestamp):
+  equeue_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  equeue_socket.connect(socket_path)
+  equeue_socket.send(json.dumps({'command': command, 'timestamp': timestamp}))
+  result = equeue_socket.recv(len(command))
+  equeue_socket.close()
+  return result
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--requests', type=int, default=2000,
+                      help='Number of requests to enqueue.')
+  parser.add_argument('--batch', type=int, default=10,
+                      help='Requests sent at once by the framed client.')
+  option = parser.parse_args()
+
+  base_dir = tempfile.mkdtemp()
+  socket_path = os.path.join(base_dir, 'equeue.sock')
+  # the command is already run for every timestamp, so only the enqueue
+  # is measured
+  command = '/bin/true'
+  server = EqueueServer(socket_path, equeue_options=argparse.Namespace(
+    database=[os.path.join(base_dir, 'equeue.db')],
+    logfile=[os.path.join(base_dir, 'equeue.log')],
+    loglevel=['WARNING'],
+    timeout=3,
+    lockfile=os.path.join(base_dir, 'equeue.lock'),
+    max_concurrent=1,
+  ))
+  server.db[command] = str(option.requests + 1)
+  server_thread = threading.Thread(target=server.serve_forever)
+  server_thread.daemon = True
+  server_thread.start()
+  try:
+    start = time.time()
+    for timestamp in xrange(option.requests):
+      assert legacyRequest(socket_path, command, timestamp) == command
+    elapsed = time.time() - start
+    print "legacy: %.0f requests/s" % (option.requests / elapsed)
+
+    client = EqueueClient(socket_path)
+    start = time.time()
+    for timestamp in xrange(0, option.requests, option.batch):
+      result_list = client.request([(command, timestamp + index)
+                                    for index in xrange(option.batch)])
+      assert result_list == [command] * option.batch
+    elapsed = time.time() - start
+    client.close()
+    print "framed (batch of %s): %.0f requests/s" % (
+      option.batch, option.requests / elapsed)
+  finally:
+    server.shutdown()
+    server.server_close()
+    server.db.close()
+    shutil.rmtree(base_dir)
+
+if __name__ == '__main__':
+  main()
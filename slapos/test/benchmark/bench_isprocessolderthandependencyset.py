@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the full scan of is-process-older-than-dependency-set with the
+scan using the folder mtime cache, on a synthetic tree of packages.
+
+Usage: python -m slapos.test.benchmark.bench_isprocessolderthandependencyset [--files 100000]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from slapos.promise.is_process_older_than_dependency_set import \
+  DirectoryMtimeCache, moduleIsModifiedSince
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--files', type=int, default=100000,
+                      help='Number of files in the tree.')
+  parser.add_argument('--files-per-package', type=int, default=50)
+  option = parser.parse_args()
+
+  base_dir = tempfile.mkdtemp()
+  try:
+    python_path = os.path.join(base_dir, 'path')
+    for index in xrange(0, option.files, option.files_per_package):
+      package_path = os.path.join(python_path, 'product%s' % (index // 5000),
+                                  'package%s' % index)
+      os.makedirs(package_path)
+      open(os.path.join(package_path, '__init__.py'), 'w').close()
+      for file_index in xrange(option.files_per_package - 1):
+        open(os.path.join(package_path, 'module%s.py' % file_index),
+             'w').close()
+    for product in os.listdir(python_path):
+      open(os.path.join(python_path, product, '__init__.py'), 'w').close()
+    since = time.time() + 60
+    print "tree of %s files" % option.files
+
+    start = time.time()
+    assert not moduleIsModifiedSince(python_path, since)
+    print "full scan:      %.3fs" % (time.time() - start)
+
+    cache_file = os.path.join(base_dir, 'cache')
+    start = time.time()
+    cache = DirectoryMtimeCache(cache_file)
+    assert not moduleIsModifiedSince(python_path, since, cache=cache)
+    cache.save()
+    print "first cached:   %.3fs" % (time.time() - start)
+
+    start = time.time()
+    cache = DirectoryMtimeCache(cache_file)
+    assert not moduleIsModifiedSince(python_path, since, cache=cache)
+    cache.save()
+    print "next cached:    %.3fs" % (time.time() - start)
+  finally:
+    shutil.rmtree(base_dir)
+
+if __name__ == '__main__':
+  main()
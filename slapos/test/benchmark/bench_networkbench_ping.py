@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the ping probes of networkbench on localhost targets: one ping
+process per host against all hosts over a single ICMP socket.
+
+Usage: python -m slapos.test.benchmark.bench_networkbench_ping [--hosts 20]
+"""
+
+import argparse
+import os
+import resource
+import time
+
+from slapos.networkbench import icmp
+from slapos.networkbench.ping import ping
+
+def cpu_time(who):
+  usage = resource.getrusage(who)
+  return usage.ru_utime + usage.ru_stime
+
+def measure(title, function):
+  start = time.time()
+  start_cpu = cpu_time(resource.RUSAGE_SELF) + \
+              cpu_time(resource.RUSAGE_CHILDREN)
+  info_list = function()
+  print "%-10s: %.2fs, cpu %.3fs, %s/%s hosts replied" % (title,
+    time.time() - start,
+    cpu_time(resource.RUSAGE_SELF) + cpu_time(resource.RUSAGE_CHILDREN)
+    - start_cpu,
+    sum(1 for info in info_list if info[2] == 200), len(info_list))
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--hosts', type=int, default=20,
+                      help='Number of 127.0.x.y hosts to ping.')
+  parser.add_argument('--timeout', type=int, default=3,
+                      help='Time in seconds given to each ping.')
+  option = parser.parse_args()
+
+  host_list = ['127.0.%s.%s' % (index // 254, index % 254 + 1)
+               for index in xrange(option.hosts)]
+  sock = icmp.open_socket()
+  if sock is None:
+    print "native    : no ICMP socket allowed"
+  else:
+    try:
+      measure('native', lambda: icmp.ping_many(sock, host_list,
+                                               timeout=option.timeout))
+    finally:
+      sock.close()
+  if any(os.access(os.path.join(path, 'ping'), os.X_OK)
+         for path in os.environ.get('PATH', '').split(os.pathsep)):
+    measure('subprocess', lambda: [ping(host, timeout=option.timeout)
+                                   for host in host_list])
+  else:
+    print "subprocess: ping binary not found"
+
+if __name__ == '__main__':
+  main()
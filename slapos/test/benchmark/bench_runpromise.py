@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Compare wall time of the serial and concurrent promise runners of
+monitor.runpromise on synthetic promises.
+
+Usage: python -m slapos.test.benchmark.bench_runpromise [--promises 40]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from slapos.monitor.runpromise import RunPromise, parseArguments
+
+PROMISE_CONTENT = """#!/bin/sh
+echo "promise %(index)s"
+sleep %(duration)s
+exit %(exit_code)s
+"""
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--promises', type=int, default=40,
+                      help='Number of promises to run.')
+  parser.add_argument('--duration', type=float, default=0.5,
+                      help='Time spent by every promise.')
+  parser.add_argument('--workers', type=int, nargs='*', default=[4, 8, 16])
+  option = parser.parse_args()
+
+  base_dir = tempfile.mkdtemp()
+  try:
+    promise_dir = os.path.join(base_dir, 'promise')
+    os.mkdir(promise_dir)
+    for index in xrange(option.promises):
+      promise_path = os.path.join(promise_dir, 'promise_%s' % index)
+      with open(promise_path, 'w') as f:
+        f.write(PROMISE_CONTENT % {'index': index, 'duration': option.duration,
+                                   'exit_code': index % 5 == 0 and 1 or 0})
+      os.chmod(promise_path, 0755)
+
+    for worker_count in [1] + option.workers:
+      promise_runner = RunPromise(parseArguments().parse_args([
+        '--promise_folder', promise_dir,
+        '--promise_workers', str(worker_count)]))
+      start = time.time()
+      result_list = promise_runner.checkPromises([promise_dir])
+      print "%2s worker(s): %.2fs for %s promises" % (
+        worker_count, time.time() - start, len(result_list))
+  finally:
+    shutil.rmtree(base_dir)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from slapos.monitor.collect import ResourceCollect
+from slapos.monitor.rollup import ResourceRollup
+
+# subset of the schema created by slapos collect
+CREATE_USER_TABLE = """create table if not exists user
+  (partition text, pid real, process text, cpu_percent real, cpu_time real,
+   cpu_num_threads real, memory_percent real, memory_rss real,
+   io_rw_counter real, io_cycles_counter real, date text, time text,
+   reported integer NULL DEFAULT 0)"""
+
+CREATE_FOLDER_TABLE = """create table if not exists folder
+  (partition text, disk_used real, date text, time text,
+   reported integer NULL DEFAULT 0)"""
+
+def createCollectorDatabase(db_path, row_list, folder_row_list=None):
+  connection = sqlite3.connect(db_path)
+  connection.execute(CREATE_USER_TABLE)
+  connection.executemany("""insert into user (partition, pid, process,
+    cpu_percent, cpu_time, cpu_num_threads, memory_percent, memory_rss,
+    io_rw_counter, io_cycles_counter, date, time)
+    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", row_list)
+  if folder_row_list is not None:
+    connection.execute(CREATE_FOLDER_TABLE)
+    connection.executemany("""insert into folder (partition, disk_used, date,
+      time) values (?, ?, ?, ?)""", folder_row_list)
+  connection.commit()
+  connection.close()
+
+
+class MonitorCollectTest(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.db_path = os.path.join(self.base_dir, 'collector.db')
+    row_list = []
+    for time in ('10:00:10', '10:01:10', '10:02:10'):
+      for pid in (1, 2):
+        row_list.append(('slappart0', pid, 'process', 10.0, 120.0, 2, 1.5,
+                         1024*1024*4, 20, 40, '2016-10-26', time))
+    row_list.append(('slappart1', 3, 'other', 50.0, 60.0, 1, 3.0,
+                     1024*1024, 2, 4, '2016-10-26', '10:01:10'))
+    folder_row_list = [('slappart0', 2048, '2016-10-26', '10:00:10'),
+                       ('slappart0', 4096, '2016-10-26', '10:01:10')]
+    createCollectorDatabase(self.db_path, row_list, folder_row_list)
+
+  def tearDown(self):
+    if os.path.exists(self.base_dir):
+      shutil.rmtree(self.base_dir)
+
+  def test_resource_summary(self):
+    collector = ResourceCollect(self.db_path)
+    summary = collector.getPartitionResourceSummary('slappart0', '2016-10-26',
+                                                    '10:01:00', '10:01:59')
+    self.assertEquals(summary.cpu_percent_average,
+      collector.getPartitionCPULoadAverage('slappart0', '2016-10-26'))
+    self.assertEquals(summary.memory_used_average,
+      collector.getPartitionUsedMemoryAverage('slappart0', '2016-10-26'))
+    self.assertEquals(summary.disk_used_average,
+      collector.getPartitionDiskUsedAverage('slappart0', '2016-10-26'))
+    self.assertEquals(summary.cpu_percent_average, 20.0)
+    self.assertEquals(summary.memory_used_average, 8.0)
+    self.assertEquals(summary.disk_used_average, 3.0)
+
+    process_dict, memory_dict, io_dict = summary.getConsumptionStatus()
+    self.assertEquals(process_dict, {'total_process': 2, 'cpu_percent': 20.0,
+      'cpu_time': 4.0, 'cpu_num_threads': 4.0, 'date': '2016-10-26 10:01:00'})
+    self.assertEquals(memory_dict, {'memory_percent': 3.0, 'memory_rss': 8.0,
+      'date': '2016-10-26 10:01:00'})
+    self.assertEquals(io_dict, {'io_rw_counter': 40.0,
+      'io_cycles_counter': 80.0, 'disk_used': 4.0,
+      'date': '2016-10-26 10:01:00'})
+
+  def test_resource_summary_no_data(self):
+    collector = ResourceCollect(self.db_path)
+    summary = collector.getPartitionResourceSummary('slappart0', '2016-10-27',
+                                                    '10:01:00', '10:01:59')
+    collector.close()
+    self.assertEquals(summary.cpu_percent_average, None)
+    self.assertEquals(summary.memory_used_average, None)
+    self.assertEquals(summary.disk_used_average, None)
+    self.assertEquals(summary.total_process, 0)
+    self.assertEquals(summary.getIODict()['disk_used'], 0)
+
+  def test_resource_summary_without_folder_table(self):
+    createCollectorDatabase(os.path.join(self.base_dir, 'nofolder.db'),
+      [('slappart0', 1, 'process', 10.0, 120.0, 2, 1.5, 1024*1024, 20, 40,
+        '2016-10-26', '10:01:10')])
+    collector = ResourceCollect(os.path.join(self.base_dir, 'nofolder.db'))
+    summary = collector.getPartitionResourceSummary('slappart0', '2016-10-26',
+                                                    '10:01:00', '10:01:59')
+    collector.close()
+    self.assertEquals(summary.disk_used_average, None)
+    self.assertEquals(summary.disk_used, 0)
+    self.assertEquals(summary.cpu_percent_average, 10.0)
+
+  def test_rollup_summary(self):
+    rollup = ResourceRollup(os.path.join(self.base_dir, 'rollup.db'))
+    rollup.update(self.db_path, 'slappart0')
+    collector = ResourceCollect(self.db_path)
+    for min_time, max_time in (('10:01:00', '10:01:59'),
+                               ('10:02:00', '10:02:59'),
+                               ('11:00:00', '11:00:59')):
+      self.assertEquals(
+        rollup.getPartitionResourceSummary('slappart0', '2016-10-26',
+                                           min_time),
+        collector.getPartitionResourceSummary('slappart0', '2016-10-26',
+                                              min_time, max_time))
+    collector.close()
+    rollup.close()
+
+  def test_rollup_incremental_update(self):
+    rollup = ResourceRollup(os.path.join(self.base_dir, 'rollup.db'))
+    rollup.update(self.db_path, 'slappart0')
+    history = rollup.getHistory('slappart0', 'day')
+    self.assertEquals(len(history), 1)
+    self.assertEquals(history[0]['sample_count'], 3)
+    self.assertEquals(history[0]['cpu_percent'], 60.0)
+
+    # running again without new data doesn't change anything
+    rollup.update(self.db_path, 'slappart0')
+    self.assertEquals(rollup.getHistory('slappart0', 'day'), history)
+
+    createCollectorDatabase(self.db_path,
+      [('slappart0', 1, 'process', 30.0, 120.0, 2, 1.5, 1024, 20, 40,
+        '2016-10-26', '11:00:10')])
+    rollup.update(self.db_path, 'slappart0')
+    history = rollup.getHistory('slappart0', 'day')
+    self.assertEquals(history[0]['sample_count'], 4)
+    self.assertEquals(history[0]['cpu_percent'], 90.0)
+    self.assertEquals([(row['period'], row['sample_count']) for row in
+                       rollup.getHistory('slappart0', 'hour')],
+                      [('10', 3), ('11', 1)])
+    self.assertEquals(len(rollup.getHistory('slappart0', 'minute')), 4)
+    self.assertEquals(rollup.getHistory('slappart0', 'minute',
+                                        since='2016-10-27'), [])
+    self.assertEquals(rollup.getHistory('slappart1', 'minute'), [])
+    rollup.close()
+
+  def test_rollup_reused_rowid(self):
+    rollup = ResourceRollup(os.path.join(self.base_dir, 'rollup.db'))
+    rollup.update(self.db_path, 'slappart0')
+    # the tail of the table is removed, so new rows reuse its rowids
+    connection = sqlite3.connect(self.db_path)
+    connection.execute("delete from user where rowid > 4")
+    connection.commit()
+    connection.close()
+    createCollectorDatabase(self.db_path,
+      [('slappart0', 1, 'process', 30.0, 120.0, 2, 1.5, 1024, 20, 40,
+        '2016-10-26', '11:00:10')])
+    rollup.update(self.db_path, 'slappart0')
+    self.assertEquals([(row['period'], row['sample_count']) for row in
+                       rollup.getHistory('slappart0', 'hour')],
+                      [('10', 3), ('11', 1)])
+    rollup.close()
+
+if __name__ == '__main__':
+  unittest.main()
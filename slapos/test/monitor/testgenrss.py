@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+import json
+import feedparser
+
+from slapos.monitor.status2rss import genrss, parseArguments
+
+class MonitorGenRSSTest(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.public_dir = os.path.join(self.base_dir, 'public')
+    os.mkdir(self.public_dir)
+    self.feed_path = os.path.join(self.base_dir, 'feed')
+    self.index_path = os.path.join(self.base_dir, 'feed.index')
+
+  def tearDown(self):
+    if os.path.exists(self.base_dir):
+      shutil.rmtree(self.base_dir)
+
+  def writeStatus(self, name, status, change_time):
+    with open(os.path.join(self.public_dir, '%s.status.json' % name), 'w') as f:
+      f.write(json.dumps({'status': status, 'title': name,
+                          'message': '%s is %s' % (name, status),
+                          'change-time': change_time}))
+
+  def getParser(self, *extra_argument_list):
+    return parseArguments([
+      '--items_folder', self.public_dir,
+      '--output', self.feed_path,
+      '--feed_url', 'https://monitor.test.com/public/feed',
+      '--public_url', 'https://monitor.test.com/share/jio_public/',
+      '--private_url', 'https://monitor.test.com/share/jio_private/',
+      '--instance_name', 'Monitor',
+      '--hosting_name', 'Monitor ROOT',
+      '--index_file', self.index_path] + list(extra_argument_list))
+
+  def getFeedTitleList(self):
+    feed = feedparser.parse(self.feed_path)
+    self.assertFalse(feed.bozo)
+    return [entry.title for entry in feed.entries]
+
+  def test_genrss(self):
+    self.writeStatus('promise_1', 'OK', 1477468800)
+    self.writeStatus('promise_2', 'ERROR', 1477468900)
+    self.writeStatus('promise_3', 'OK', 1477468700)
+    genrss(self.getParser())
+    # items are ordered by change-time
+    self.assertEquals(self.getFeedTitleList(),
+      ['[OK] promise_3', '[OK] promise_1', '[ERROR] promise_2'])
+    self.assertEquals(sorted(json.load(open(self.index_path)).keys()),
+      ['promise_1.status.json', 'promise_2.status.json',
+       'promise_3.status.json'])
+
+    # the index is used for unmodified files
+    index_dict = json.load(open(self.index_path))
+    index_dict['promise_3.status.json']['status'] = 'WARNING'
+    with open(self.index_path, 'w') as f:
+      f.write(json.dumps(index_dict))
+    self.writeStatus('promise_2', 'OK', 1477469000)
+    genrss(self.getParser())
+    self.assertEquals(self.getFeedTitleList(),
+      ['[WARNING] promise_3', '[OK] promise_1', '[OK] promise_2'])
+
+  def test_genrss_max_items(self):
+    for i in range(5):
+      self.writeStatus('promise_%s' % i, 'OK', 1477468800 + i)
+    genrss(self.getParser('--max_items', '2'))
+    self.assertEquals(self.getFeedTitleList(),
+      ['[OK] promise_3', '[OK] promise_4'])
+
+    os.unlink(os.path.join(self.public_dir, 'promise_4.status.json'))
+    genrss(self.getParser('--max_items', '2'))
+    self.assertEquals(self.getFeedTitleList(),
+      ['[OK] promise_2', '[OK] promise_3'])
+    self.assertFalse(os.path.exists(self.feed_path + '.tmp'))
+
+if __name__ == '__main__':
+  unittest.main()
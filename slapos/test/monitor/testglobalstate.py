@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os, time
+import shutil
+import tempfile
+import unittest
+import json
+
+from slapos.monitor import globalstate
+
+class MonitorGlobalStateTest(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.public_dir = os.path.join(self.base_dir, 'public')
+    self.private_dir = os.path.join(self.base_dir, 'private')
+    os.mkdir(self.public_dir)
+    os.mkdir(self.private_dir)
+    self.monitor_config_file = os.path.join(self.base_dir, 'monitor.conf')
+    with open(self.monitor_config_file, 'w') as f:
+      f.write("""[monitor]
+private-folder = %(base_dir)s/private
+public-folder = %(base_dir)s/public
+base-url = https://monitor.test.com
+monitor-url-list =
+""" % {'base_dir': self.base_dir})
+    self.instance_config_file = os.path.join(self.base_dir, 'instance.conf')
+
+  def tearDown(self):
+    if os.path.exists(self.base_dir):
+      shutil.rmtree(self.base_dir)
+
+  def writeStatus(self, name, status):
+    with open(os.path.join(self.public_dir, '%s.status.json' % name), 'w') as f:
+      f.write(json.dumps({'status': status, 'title': name,
+                          'start-date': '2016-10-26 10:00:00',
+                          'change-time': 1477468800}))
+
+  def run_globalstate(self):
+    globalstate.run([self.monitor_config_file, self.instance_config_file])
+    with open(os.path.join(self.private_dir, 'monitor.global.json')) as f:
+      return json.load(f)
+
+  def test_global_state(self):
+    self.writeStatus('promise_1', 'OK')
+    self.writeStatus('promise_2', 'ERROR')
+    global_dict = self.run_globalstate()
+    self.assertEquals(global_dict['status'], 'ERROR')
+    self.assertEquals(global_dict['state'],
+                      {'error': 1, 'success': 1, 'warning': 0})
+    self.assertEquals(sorted(promise['title'] for promise in
+                             global_dict['_embedded']['promises']),
+                      ['promise_1', 'promise_2'])
+    with open(os.path.join(self.public_dir, '_document_list')) as f:
+      self.assertEquals(sorted(f.read().split('\n')),
+        ['monitor.global', 'promise_1.status', 'promise_2.status'])
+
+    # nothing changed, the document list is not written again but the date
+    # of the state is the date of the last run
+    global_file = os.path.join(self.private_dir, 'monitor.global.json')
+    document_list_file = os.path.join(self.public_dir, '_document_list')
+    os.utime(global_file, (0, 0))
+    os.utime(document_list_file, (0, 0))
+    time.sleep(1)
+    new_global_dict = self.run_globalstate()
+    self.assertNotEquals(new_global_dict['date'], global_dict['date'])
+    self.assertNotEquals(os.stat(global_file).st_mtime, 0)
+    self.assertEquals(os.stat(document_list_file).st_mtime, 0)
+
+    # status file written again with the same content, the index is kept
+    index_file = os.path.join(self.private_dir, '_status_index')
+    with open(index_file) as f:
+      index_dict = json.load(f)
+    self.assertEquals(sorted(len(x) for x in index_dict.values()), [3, 3])
+    self.writeStatus('promise_1', 'OK')
+    os.utime(index_file, (0, 0))
+    self.assertEquals(self.run_globalstate()['state'],
+                      {'error': 1, 'success': 1, 'warning': 0})
+    self.assertEquals(os.stat(index_file).st_mtime, 0)
+
+    # modified status file is read again
+    self.writeStatus('promise_2', 'OK')
+    global_dict = self.run_globalstate()
+    self.assertEquals(global_dict['status'], 'OK')
+    self.assertEquals(global_dict['state'],
+                      {'error': 0, 'success': 2, 'warning': 0})
+    self.assertNotEquals(os.stat(global_file).st_mtime, 0)
+    self.assertEquals(os.stat(document_list_file).st_mtime, 0)
+
+    # removed status file is removed from the state
+    os.unlink(os.path.join(self.public_dir, 'promise_1.status.json'))
+    global_dict = self.run_globalstate()
+    self.assertEquals(global_dict['state'],
+                      {'error': 0, 'success': 1, 'warning': 0})
+    with open(document_list_file) as f:
+      self.assertEquals(sorted(f.read().split('\n')),
+        ['monitor.global', 'promise_2.status'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from slapos.monitor.history import PromiseHistory, INDEX_RECORD
+
+class MonitorHistoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    if os.path.exists(self.base_dir):
+      shutil.rmtree(self.base_dir)
+
+  def test_empty_history(self):
+    history = PromiseHistory(self.base_dir, 'promise_1')
+    self.assertFalse(history.exists())
+    self.assertEquals(history.getLast(3), [])
+    self.assertEquals(history.getRange(), [])
+    self.assertEquals(history.export(), {'date': None, 'data': []})
+
+  def test_history(self):
+    history = PromiseHistory(self.base_dir, 'promise_1')
+    for i in range(10):
+      history.append({'status': 'OK', 'message': 'run %s' % i}, date=100 + i)
+    self.assertTrue(history.exists())
+    self.assertEquals(history.count(), 10)
+    self.assertEquals([status['message'] for status in history.getLast(3)],
+                      ['run 7', 'run 8', 'run 9'])
+    self.assertEquals(len(history.getLast(20)), 10)
+    self.assertEquals([status['message'] for status in
+                       history.getRange(since=102, until=104)],
+                      ['run 2', 'run 3', 'run 4'])
+    self.assertEquals([status['message'] for status in
+                       history.getRange(since=108.5)],
+                      ['run 9'])
+    self.assertEquals(history.getRange(since=200), [])
+
+    data_dict = history.export()
+    self.assertEquals(data_dict['date'], 100)
+    self.assertEquals(len(data_dict['data']), 10)
+    self.assertEquals(data_dict['data'][0], {'status': 'OK', 'message': 'run 0'})
+    self.assertEquals(history.export(last=1)['data'],
+                      [{'status': 'OK', 'message': 'run 9'}])
+
+  def test_history_not_indexed_line(self):
+    history = PromiseHistory(self.base_dir, 'promise_1')
+    history.append({'message': 'run 0'}, date=100)
+    # line written without its index record is ignored
+    with open(history.history_file, 'a') as f:
+      f.write('{"message": "lost"}\n')
+    history.append({'message': 'run 1'}, date=101)
+    self.assertEquals(history.count(), 2)
+    self.assertEquals(os.path.getsize(history.index_file),
+                      2 * INDEX_RECORD.size)
+    self.assertEquals(history.getRange(),
+                      [{'message': 'run 0'}, {'message': 'run 1'}])
+
+  def test_history_incomplete_index_record(self):
+    history = PromiseHistory(self.base_dir, 'promise_1')
+    history.append({'message': 'run 0'}, date=100)
+    # index record partially written by an interrupted append
+    with open(history.index_file, 'ab') as f:
+      f.write(INDEX_RECORD.pack(101, 0)[:5])
+    self.assertEquals(history.count(), 1)
+    history.append({'message': 'run 1'}, date=102)
+    self.assertEquals(history.count(), 2)
+    self.assertEquals(history.getLast(2),
+                      [{'message': 'run 0'}, {'message': 'run 1'}])
+    self.assertEquals(history.getRange(since=101), [{'message': 'run 1'}])
+
+  def test_import_json_history(self):
+    json_file = os.path.join(self.base_dir, 'promise_1.history.json')
+    with open(json_file, 'w') as f:
+      json.dump({'date': 100, 'data': [
+        {'status': 'OK', 'start-date': '2016-10-26 10:00:00'},
+        {'status': 'ERROR', 'start-date': '2016-10-26 10:01:00'}]}, f)
+    history = PromiseHistory(self.base_dir, 'promise_1')
+    self.assertTrue(history.importJsonFile(json_file))
+    self.assertFalse(history.importJsonFile(json_file + '.missing'))
+    self.assertEquals([status['status'] for status in history.getLast(5)],
+                      ['OK', 'ERROR'])
+    start = time.mktime(time.strptime('2016-10-26 10:01:00',
+                                      '%Y-%m-%d %H:%M:%S'))
+    self.assertEquals(history.getRange(since=start),
+      [{'status': 'ERROR', 'start-date': '2016-10-26 10:01:00'}])
+
+if __name__ == '__main__':
+  unittest.main()
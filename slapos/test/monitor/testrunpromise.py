@@ -7,6 +7,7 @@ import unittest
 import json
 from datetime import datetime
 from slapos.monitor.runpromise import RunPromise, parseArguments
+from slapos.monitor.history import PromiseHistory
 
 class MonitorPromiseTest(unittest.TestCase):
 
@@ -75,7 +76,19 @@ exit 2
     arg_parser = parseArguments()
     return arg_parser.parse_args(promise_cmd)
 
-  def getPromiseParser(self):
+  def writePromiseSleep(self, name, duration, exit_code=0):
+    content = """#!/bin/sh
+
+echo "sleeping"
+sleep %s
+exit %s
+""" % (duration, exit_code)
+    promise_path = os.path.join(self.promise_dir, name)
+    self.writeContent(promise_path, content)
+    os.chmod(promise_path, 0755)
+    return promise_path
+
+  def getPromiseParser(self, *extra_argument_list):
     pid_path = os.path.join(self.run_dir, 'monitor-promise.pid')
 
     promise_cmd = [
@@ -88,7 +101,7 @@ exit 2
       '--history_folder', self.public_dir,
       '--instance_name', 'Monitor', '--hosting_name', 'Monitor ROOT']
     arg_parser = parseArguments()
-    return arg_parser.parse_args(promise_cmd)
+    return arg_parser.parse_args(promise_cmd + list(extra_argument_list))
 
   def test_promise_OK(self):
     
@@ -364,4 +377,179 @@ exit 2
     self.assertNotEquals(change_date.strftime('%Y-%m-%d %H:%M:%S'),
       change_date2.strftime('%Y-%m-%d %H:%M:%S'))
 
+  def test_promise_concurrent(self):
+    self.writePromiseOK('promise_1')
+    self.writePromiseNOK('promise_2')
+    self.writePromiseSleep('promise_3', 1)
+    self.writePromiseSleep('promise_4', 1, exit_code=1)
+    parser = self.getPromiseParser('--promise_workers', '4')
+    promise_runner = RunPromise(parser)
+    promise_list = promise_runner.getPromiseList([self.promise_dir])
+
+    start = time.time()
+    result_list = promise_runner.checkPromisesConcurrently(promise_list, 4)
+    self.assertTrue(time.time() - start < 2)
+    # results are in the same order as promises
+    self.assertEquals([result['title'] for result in result_list],
+                      [os.path.basename(path) for path in promise_list])
+    result_dict = dict((result['title'], result) for result in result_list)
+    self.assertEquals(result_dict['promise_1']['status'], 'OK')
+    self.assertEquals(result_dict['promise_1']['message'], 'success\n')
+    self.assertEquals(result_dict['promise_2']['status'], 'ERROR')
+    self.assertEquals(result_dict['promise_2']['message'], 'failed\n')
+    self.assertEquals(result_dict['promise_3']['status'], 'OK')
+    self.assertEquals(result_dict['promise_3']['message'], 'sleeping\n')
+    self.assertEquals(result_dict['promise_4']['status'], 'ERROR')
+
+    # status files are written as in serial mode
+    promise_runner.runpromise()
+    result = json.loads(open(os.path.join(self.public_dir,
+                                          'promise_2.status.json')).read())
+    self.assertEquals(result['status'], 'ERROR')
+    self.assertEquals(result['message'], 'failed\n')
+
+  def test_promise_concurrent_timeout(self):
+    self.writePromiseSleep('promise_1', 10)
+    self.writePromiseOK('promise_2')
+    parser = self.getPromiseParser('--promise_workers', '2',
+                                   '--promise_timeout', '1')
+    promise_runner = RunPromise(parser)
+    start = time.time()
+    promise_runner.runpromise()
+    self.assertTrue(time.time() - start < 5)
+
+    result = json.loads(open(os.path.join(self.public_dir,
+                                          'promise_1.status.json')).read())
+    self.assertEquals(result['status'], 'ERROR')
+    self.assertEquals(result['message'],
+                      'sleeping\n\nPROMISE TIME OUT AFTER 1 SECONDS')
+    result = json.loads(open(os.path.join(self.public_dir,
+                                          'promise_2.status.json')).read())
+    self.assertEquals(result['status'], 'OK')
+
+  def test_promise_concurrent_timeout_ignoring_sigterm(self):
+    promise_path = os.path.join(self.promise_dir, 'promise_1')
+    self.writeContent(promise_path, """#!/bin/sh
+trap '' TERM
+echo "sleeping"
+sleep 10
+""")
+    os.chmod(promise_path, 0755)
+    self.writePromiseSleep('promise_2', 2)
+    parser = self.getPromiseParser('--promise_workers', '2',
+                                   '--promise_timeout', '1')
+    promise_runner = RunPromise(parser)
+    promise_list = promise_runner.getPromiseList([self.promise_dir])
+    start = time.time()
+    result_list = promise_runner.checkPromisesConcurrently(promise_list, 2)
+    self.assertTrue(time.time() - start < 4)
+    for result in result_list:
+      self.assertEquals(result['status'], 'ERROR')
+      self.assertEquals(result['message'],
+                        'sleeping\n\nPROMISE TIME OUT AFTER 1 SECONDS')
+
+  def test_promise_scheduling(self):
+    self.writePromiseOK('promise_1')
+    self.writePromiseNOK('promise_2')
+    parser = self.getPromiseParser('--promise_min_period', '60',
+                                   '--promise_max_period', '240')
+    promise_runner = RunPromise(parser)
+    start = time.time()
+    promise_runner.runpromise()
+
+    schedule_file = os.path.join(self.public_dir, '_promise_schedule')
+    status_file = os.path.join(self.public_dir, '_promise_status')
+    result_file = os.path.join(self.public_dir, 'promise_1.status.json')
+    result2_file = os.path.join(self.public_dir, 'promise_2.status.json')
+    schedule_dict = json.load(open(schedule_file))
+    self.assertEquals(schedule_dict['promise_1']['period'], 60)
+    self.assertEquals(schedule_dict['promise_2']['period'], 0)
+    # next run is computed from the start of the run
+    self.assertTrue(start + 60 <= schedule_dict['promise_1']['next-run']
+                    < start + 61)
+    result1 = json.load(open(result_file))
+    result2 = json.load(open(result2_file))
+    state_dict = json.load(open(status_file))
+
+    # second run: successful promise is not run again, failing one is
+    time.sleep(1)
+    promise_runner.runpromise()
+    self.assertEquals(json.load(open(result_file)), result1)
+    self.assertNotEquals(json.load(open(result2_file))['start-date'],
+                         result2['start-date'])
+    self.assertAlmostEquals(json.load(open(result2_file))['change-time'],
+                            result2['change-time'], places=1)
+    self.assertEquals(json.load(open(status_file)), state_dict)
+
+    # period doubles every time the promise succeeds again
+    for period in (120, 240, 240):
+      schedule_dict = json.load(open(schedule_file))
+      schedule_dict['promise_1']['next-run'] = time.time() - 1
+      with open(schedule_file, 'w') as f:
+        json.dump(schedule_dict, f)
+      promise_runner.runpromise()
+      self.assertEquals(
+        json.load(open(schedule_file))['promise_1']['period'], period)
+    self.assertAlmostEquals(json.load(open(result_file))['change-time'],
+                            result1['change-time'], places=1)
+
+    # promise runs if its next run is only a few seconds away
+    result1 = json.load(open(result_file))
+    schedule_dict = json.load(open(schedule_file))
+    schedule_dict['promise_1']['next-run'] = time.time() + 2
+    with open(schedule_file, 'w') as f:
+      json.dump(schedule_dict, f)
+    time.sleep(1)
+    promise_runner.runpromise()
+    self.assertNotEquals(json.load(open(result_file))['start-date'],
+                         result1['start-date'])
+
+    # modified promise is run immediately
+    self.writePromiseNOK('promise_1')
+    os.utime(os.path.join(self.promise_dir, 'promise_1'),
+             (time.time() + 10, time.time() + 10))
+    promise_runner.runpromise()
+    result = json.load(open(result_file))
+    self.assertEquals(result['status'], 'ERROR')
+    self.assertNotEquals(result['change-time'], result1['change-time'])
+    self.assertEquals(json.load(open(schedule_file))['promise_1']['period'], 0)
+
+    # removed promise is removed from the schedule
+    os.unlink(os.path.join(self.promise_dir, 'promise_2'))
+    promise_runner.runpromise()
+    self.assertEquals(json.load(open(schedule_file)).keys(), ['promise_1'])
+
+  def test_promise_history_jsonl(self):
+    self.writePromiseOK('promise_1')
+    parser = self.getPromiseParser('--history_format', 'jsonl')
+    promise_runner = RunPromise(parser)
+    promise_runner.runpromise()
+    promise_runner.runpromise()
+
+    self.assertFalse(os.path.exists(
+      os.path.join(self.public_dir, 'promise_1.history.json')))
+    history = PromiseHistory(self.public_dir, 'promise_1')
+    history_dict = history.export()
+    self.assertEquals(len(history_dict['data']), 2)
+    self.assertEquals(history_dict['data'][0]['title'], 'promise_1')
+    self.assertEquals(history_dict['data'][0]['status'], 'OK')
+    self.assertFalse('_links' in history_dict['data'][0])
+    self.assertFalse('title' in history_dict['data'][1])
+    self.assertEquals(history_dict['data'][1]['message'], 'success\n')
+
+  def test_promise_history_jsonl_import(self):
+    self.writePromiseOK('promise_1')
+    promise_runner = RunPromise(self.getPromiseParser())
+    promise_runner.runpromise()
+    self.assertTrue(os.path.exists(
+      os.path.join(self.public_dir, 'promise_1.history.json')))
+
+    # history written in the json format is kept
+    parser = self.getPromiseParser('--history_format', 'jsonl')
+    promise_runner = RunPromise(parser)
+    promise_runner.runpromise()
+    history_dict = PromiseHistory(self.public_dir, 'promise_1').export()
+    self.assertEquals(len(history_dict['data']), 2)
+    self.assertEquals(history_dict['data'][0]['title'], 'promise_1')
+    self.assertFalse('title' in history_dict['data'][1])
 
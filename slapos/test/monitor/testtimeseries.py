@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from slapos.monitor.timeseries import TimeSeriesStore, appendToSeries, \
+  parseRetentionPolicy, DATE_FORMAT
+
+class MonitorTimeSeriesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.db_path = os.path.join(self.base_dir, 'timeseries.db')
+    self.start = time.mktime(time.strptime('2016-10-01 00:00:00', DATE_FORMAT))
+
+  def tearDown(self):
+    if os.path.exists(self.base_dir):
+      shutil.rmtree(self.base_dir)
+
+  def formatDate(self, timestamp):
+    return time.strftime(DATE_FORMAT, time.localtime(timestamp))
+
+  def fillStore(self, store, minute_amount):
+    store.createSeries('state', 'Date, Success, Error, Warning')
+    for minute in range(minute_amount):
+      store.append('state', '%s, %s, %s, 0' % (
+        self.formatDate(self.start + minute * 60), minute % 2, 1))
+
+  def test_parseRetentionPolicy(self):
+    self.assertEquals(parseRetentionPolicy('24h:0,30d:5m,365d:1h'),
+      ((86400, 0), (30 * 86400, 300), (365 * 86400, 3600)))
+    # collected rows are only kept by a first tier with a 0 resolution
+    self.assertRaises(ValueError, parseRetentionPolicy, '24h:1m,30d:1h')
+    self.assertRaises(ValueError, parseRetentionPolicy, '24h:0,30d:0')
+
+  def test_export(self):
+    store = TimeSeriesStore(self.db_path)
+    self.fillStore(store, 10)
+    data_dict = store.export('state')
+    self.assertEquals(len(data_dict['data']), 11)
+    self.assertEquals(data_dict['data'][0], 'Date, Success, Error, Warning')
+    self.assertEquals(data_dict['data'][1], '2016-10-01 00:00:00, 0, 1, 0')
+    self.assertEquals(data_dict['data'][-1], '2016-10-01 00:09:00, 1, 1, 0')
+
+    data_dict = store.export('state', since=self.start + 120,
+                             until=self.start + 179)
+    self.assertEquals(data_dict['data'][1:], ['2016-10-01 00:02:00, 0, 1, 0'])
+    store.close()
+
+  def test_compact(self):
+    store = TimeSeriesStore(self.db_path, ((600, 0), (3600, 300), (7200, 3600)))
+    self.fillStore(store, 60)
+    # the first 50 minutes are merged in 5 minutes buckets
+    store.compact(now=self.start + 60 * 60)
+    data_list = store.export('state')['data'][1:]
+    self.assertEquals(len(data_list), 10 + 10)
+    self.assertEquals(data_list[0], '2016-10-01 00:00:00, 0.4, 1.0, 0.0')
+    self.assertEquals(data_list[1], '2016-10-01 00:05:00, 0.6, 1.0, 0.0')
+    self.assertEquals(data_list[10], '2016-10-01 00:50:00, 0, 1, 0')
+
+    # compacting again is idempotent
+    store.compact(now=self.start + 60 * 60)
+    self.assertEquals(store.export('state')['data'][1:], data_list)
+
+    # later, everything is in hourly buckets then dropped
+    store.compact(now=self.start + 2 * 3600)
+    self.assertEquals(store.export('state')['data'][1:],
+                      ['2016-10-01 00:00:00, 0.5, 1.0, 0.0'])
+    store.compact(now=self.start + 3 * 3600)
+    self.assertEquals(store.export('state')['data'][1:], [])
+    store.close()
+
+  def test_appendToSeries(self):
+    json_file = os.path.join(self.base_dir, 'monitor_state.data.json')
+    with open(json_file, 'w') as f:
+      f.write(json.dumps({'date': 12, 'data': [
+        'Date, Success, Error, Warning',
+        '%s, 2, 0, 0' % self.formatDate(time.time() - 60)]}))
+    appendToSeries(self.db_path, json_file,
+                   '%s, 1, 1, 0' % self.formatDate(time.time()))
+    with open(json_file) as f:
+      data_dict = json.load(f)
+    self.assertEquals(data_dict['date'], 12)
+    self.assertEquals(len(data_dict['data']), 3)
+    self.assertTrue(data_dict['data'][2].endswith(', 1, 1, 0'))
+
+    # the store is now the reference, the file is only an export
+    os.unlink(json_file)
+    with open(json_file, 'w') as f:
+      f.write(json.dumps({'date': 13, 'data': ['Date, Success, Error, Warning']}))
+    appendToSeries(self.db_path, json_file,
+                   '%s, 0, 1, 0' % self.formatDate(time.time() + 60))
+    with open(json_file) as f:
+      data_dict = json.load(f)
+    self.assertEquals(data_dict['date'], 12)
+    self.assertEquals(len(data_dict['data']), 4)
+
+  def test_appendToSeriesWithoutCompaction(self):
+    json_file = os.path.join(self.base_dir, 'monitor_state.data.json')
+    with open(json_file, 'w') as f:
+      f.write(json.dumps({'date': 12, 'data': [
+        'Date, Success, Error, Warning',
+        'malformed row',
+        '%s, 2, 0, 0' % self.formatDate(time.time() - 60)]}))
+    appendToSeries(self.db_path, json_file,
+                   '%s, 1, 1, 0' % self.formatDate(time.time()))
+    store = TimeSeriesStore(self.db_path)
+    last_compaction = store.getProperty('last_compaction')
+    store.close()
+    self.assertNotEquals(last_compaction, None)
+
+    # until next compaction, rows are appended to the exported file
+    appendToSeries(self.db_path, json_file,
+                   '%s, 0, 2, 0' % self.formatDate(time.time() + 60))
+    store = TimeSeriesStore(self.db_path)
+    self.assertEquals(store.getProperty('last_compaction'), last_compaction)
+    with open(json_file) as f:
+      data_dict = json.load(f)
+    self.assertEquals(data_dict, store.export('monitor_state'))
+    self.assertEquals(len(data_dict['data']), 4)
+    self.assertTrue(data_dict['data'][3].endswith(', 0, 2, 0'))
+    store.close()
+
+if __name__ == '__main__':
+  unittest.main()
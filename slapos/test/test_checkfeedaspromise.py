@@ -1,11 +1,16 @@
+import BaseHTTPServer
 import datetime
 import feedparser
+import os
+import shutil
+import tempfile
+import threading
 import time
 import unittest
 
 import PyRSS2Gen as RSS2
 
-from slapos.checkfeedaspromise import checkFeedAsPromise
+from slapos.checkfeedaspromise import checkFeedAsPromise, parseDate
 
 class Option(dict):
     def __init__(self, **kw): 
@@ -126,5 +131,98 @@ class TestCheckFeedAsPromise(unittest.TestCase):
     self.assertEquals(checkFeedAsPromise(feed, option), "")
 
 
+
+class TestCheckFeedAsPromiseFast(TestCheckFeedAsPromise):
+  def getOptionObject(self, **kw):
+    kw.setdefault('fast', True)
+    return TestCheckFeedAsPromise.getOptionObject(self, **kw)
+
+
+  def test_malformedFeed(self):
+    option = self.getOptionObject(title=True)
+    self.assertTrue(checkFeedAsPromise('<rss><channel>', option).startswith(
+      'Feed malformed'))
+
+
+  def test_parseDate(self):
+    expected = time.gmtime(1477476000)
+    self.assertEquals(parseDate('Wed, 26 Oct 2016 10:00:00 GMT'), expected)
+    self.assertEquals(parseDate('Wed, 26 Oct 2016 12:00:00 +0200'), expected)
+    self.assertEquals(parseDate('2016-10-26T10:00:00Z'), expected)
+    self.assertEquals(parseDate('2016-10-26T12:00:00.5+02:00'), expected)
+    self.assertEquals(parseDate('yesterday'), None)
+
+
+  def test_atomFeed(self):
+    option = self.getOptionObject(title=True, ok_pattern_list=['OK'],
+                                  time_buffer=3600)
+    feed = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>Feed</title>
+<entry><title>Doing Something</title><updated>%(date)s</updated></entry>
+<entry><title>Still running</title><updated>%(date)s</updated></entry>
+</feed>""" % {'date': time.strftime('%Y-%m-%dT%H:%M:%SZ')}
+    self.assertEquals(checkFeedAsPromise(feed, option), "")
+    option.time_buffer = 0
+    self.assertTrue(checkFeedAsPromise(feed, option).startswith('Stalled'))
+
+
+  def test_feedFile(self):
+    option = self.getOptionObject(title=True, ok_pattern_list=['OK'])
+    feed_directory = tempfile.mkdtemp()
+    try:
+      feed_path = os.path.join(feed_directory, 'feed')
+      with open(feed_path, 'w') as f:
+        f.write(self.generateOKFeed())
+      self.assertEquals(checkFeedAsPromise(feed_path, option), "")
+    finally:
+      shutil.rmtree(feed_directory)
+
+
+  def test_conditionalFetch(self):
+    feed_content = [self.generateOKFeed()]
+    request_list = []
+
+    class FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+      def log_message(self, *args):
+        pass
+
+      def do_GET(self):
+        request_list.append(self.headers.get('If-None-Match'))
+        etag = '"%s"' % hash(feed_content[0])
+        if self.headers.get('If-None-Match') == etag:
+          self.send_response(304)
+          self.end_headers()
+          return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(feed_content[0])
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    cache_directory = tempfile.mkdtemp()
+    try:
+      url = 'http://127.0.0.1:%s/feed' % server.server_address[1]
+      option = self.getOptionObject(title=True, ok_pattern_list=['OK'],
+        cache_file=os.path.join(cache_directory, 'cache'))
+      self.assertEquals(checkFeedAsPromise(url, option), "")
+      # not modified, last item is read from the cache
+      self.assertEquals(checkFeedAsPromise(url, option), "")
+      self.assertEquals(request_list[0], None)
+      self.assertNotEquals(request_list[1], None)
+
+      feed_content[0] = self.generateKOFeed()
+      self.assertNotEquals(checkFeedAsPromise(url, option), "")
+      self.assertEquals(len(request_list), 3)
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+      shutil.rmtree(cache_directory)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from slapos.equeue import EqueueServer
+from slapos.pubsub.equeueclient import EqueueClient, EqueueClientPool
+
+class EqueueTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.base_dir = tempfile.mkdtemp()
+    self.log_file = os.path.join(self.base_dir, 'equeue.log')
+    self.server = None
+
+  def tearDown(self):
+    if self.server is not None:
+      self.server.server_close()
+      self.server.db.close()
+      # EQueue logger is global, don't log in files of the next tests
+      for handler in self.server.logger.handlers[:]:
+        self.server.logger.removeHandler(handler)
+        handler.close()
+    shutil.rmtree(self.base_dir)
+
+  def getServer(self, **kw):
+    option_dict = dict(
+      database=[os.path.join(self.base_dir, 'equeue.db')],
+      logfile=[self.log_file],
+      loglevel=['INFO'],
+      timeout=3,
+      lockfile=os.path.join(self.base_dir, 'equeue.lock'),
+      max_concurrent=1,
+    )
+    option_dict.update(kw)
+    self.server = EqueueServer(os.path.join(self.base_dir, 'equeue.sock'),
+                               equeue_options=argparse.Namespace(**option_dict))
+    return self.server
+
+  def writeCommand(self, name, duration=0.5):
+    """
+      Write a script which logs its start and end time in <name>.run
+    """
+    path = os.path.join(self.base_dir, name)
+    with open(path, 'w') as f:
+      f.write("""#!/bin/sh
+echo "start $(date +%%s.%%N)" >> %(output)s
+sleep %(duration)s
+echo "end $(date +%%s.%%N)" >> %(output)s
+""" % {'output': path + '.run', 'duration': duration})
+    os.chmod(path, 0700)
+    return path
+
+  def getRunList(self, command):
+    """ Return (start, end) of every run of command """
+    try:
+      with open(command + '.run') as f:
+        line_list = [line.split() for line in f]
+    except IOError:
+      return []
+    start_list = [float(value) for key, value in line_list if key == 'start']
+    end_list = [float(value) for key, value in line_list if key == 'end']
+    return zip(start_list, end_list)
+
+  def runConcurrently(self, server, *command_timestamp_list):
+    thread_list = [threading.Thread(target=server._runCommandIfNeeded,
+                                    args=command_timestamp)
+                   for command_timestamp in command_timestamp_list]
+    for thread in thread_list:
+      thread.start()
+      # keep the order of the commands when they wait for the same lock
+      time.sleep(0.1)
+    for thread in thread_list:
+      thread.join()
+
+
+class TestEqueueServer(EqueueTestCase):
+
+  def test_differentCommandsRunConcurrently(self):
+    server = self.getServer(max_concurrent=2)
+    first = self.writeCommand('first')
+    second = self.writeCommand('second')
+    self.runConcurrently(server, (first, 1), (second, 1))
+    (first_start, first_end), = self.getRunList(first)
+    (second_start, second_end), = self.getRunList(second)
+    self.assertTrue(first_start < second_end and second_start < first_end)
+    self.assertEquals(server.db[first], '1')
+    self.assertEquals(server.db[second], '1')
+    self.assertFalse(server.lockfile.is_locked())
+
+  def test_differentCommandsSerialisedByDefault(self):
+    server = self.getServer()
+    first = self.writeCommand('first')
+    second = self.writeCommand('second')
+    self.runConcurrently(server, (first, 1), (second, 1))
+    run_list = sorted(self.getRunList(first) + self.getRunList(second))
+    self.assertEquals(len(run_list), 2)
+    self.assertTrue(run_list[0][1] <= run_list[1][0])
+
+  def test_sameCommandSerialised(self):
+    server = self.getServer(max_concurrent=4)
+    command = self.writeCommand('command')
+    self.runConcurrently(server, (command, 1), (command, 2))
+    run_list = sorted(self.getRunList(command))
+    self.assertEquals(len(run_list), 2)
+    self.assertTrue(run_list[0][1] <= run_list[1][0])
+    self.assertEquals(server.db[command], '2')
+
+  def test_commandAlreadyRun(self):
+    server = self.getServer(max_concurrent=4)
+    command = self.writeCommand('command', 0)
+    server._runCommandIfNeeded(command, 2)
+    server._runCommandIfNeeded(command, 1)
+    server._runCommandIfNeeded(command, 2)
+    self.assertEquals(len(self.getRunList(command)), 1)
+    self.assertEquals(server.db[command], '2')
+
+  def test_burstCoalesced(self):
+    server = self.getServer(max_concurrent=4)
+    command = self.writeCommand('command')
+    running = threading.Thread(target=server._runCommandIfNeeded,
+                               args=(command, 1))
+    running.start()
+    time.sleep(0.1)
+    burst_list = [threading.Thread(target=server._runCommandIfNeeded,
+                                   args=(command, timestamp))
+                  for timestamp in range(2, 52)]
+    for thread in burst_list:
+      thread.start()
+    for thread in [running] + burst_list:
+      thread.join()
+    self.assertEquals(len(self.getRunList(command)), 2)
+    self.assertEquals(server.db[command], '51')
+    metric_dict = server.getQueueMetricDict()
+    self.assertEquals(metric_dict['received'], 51)
+    self.assertEquals(metric_dict['coalesced'], 49)
+    self.assertEquals(metric_dict['run'], 2)
+    self.assertEquals(metric_dict['pending'], 0)
+    self.assertTrue(metric_dict['max_wait_time'] >= 0.3)
+
+  def test_lockFailureDoesNotBlockCommand(self):
+    server = self.getServer()
+    command = self.writeCommand('command', 0)
+    acquire = server.lockfile.acquire
+    def failingAcquire(*args, **kw):
+      raise IOError("cannot acquire lock")
+    server.lockfile.acquire = failingAcquire
+    self.assertRaises(IOError, server._runCommandIfNeeded, command, 1)
+    self.assertEquals(server.getQueueMetricDict()['pending'], 0)
+    server.lockfile.acquire = acquire
+    server._runCommandIfNeeded(command, 2)
+    self.assertEquals(len(self.getRunList(command)), 1)
+    self.assertEquals(server.db[command], '2')
+
+  def test_takeoverTriggered(self):
+    takeover_file = os.path.join(self.base_dir, 'takeover')
+    open(takeover_file, 'w').close()
+    server = self.getServer(max_concurrent=4,
+                            takeover_triggered_file_path=[takeover_file])
+    command = self.writeCommand('command', 0)
+    server._runCommandIfNeeded(command, 1)
+    self.assertEquals(self.getRunList(command), [])
+    self.assertFalse(command in server.db)
+
+
+class TestEqueueProtocol(EqueueTestCase):
+
+  def setUp(self):
+    EqueueTestCase.setUp(self)
+    self.socket_path = os.path.join(self.base_dir, 'equeue.sock')
+    self.server = self.getServer(max_concurrent=4)
+    self.server_thread = threading.Thread(target=self.server.serve_forever,
+                                          kwargs={'poll_interval': 0.05})
+    self.server_thread.daemon = True
+    self.server_thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server_thread.join()
+    EqueueTestCase.tearDown(self)
+
+  def waitForRun(self, command, timestamp=1):
+    for _ in xrange(100):
+      with self.server.db_lock:
+        if command in self.server.db and \
+            self.server.db[command] == str(timestamp):
+          return
+      time.sleep(0.05)
+    self.fail('%s was not run' % command)
+
+  def test_legacyClient(self):
+    command = self.writeCommand('command', 0)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(self.socket_path)
+    start = time.time()
+    client.send(json.dumps({'command': command, 'timestamp': 1}))
+    self.assertEquals(client.recv(len(command)), command)
+    # answered without waiting for the end of the connection
+    self.assertTrue(time.time() - start < self.server.options.timeout)
+    client.close()
+    self.waitForRun(command)
+
+  def test_legacyClientInvalidRequest(self):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(self.socket_path)
+    client.send('{"command": "foo"}')
+    self.assertEquals(client.recv(3), '127')
+    client.close()
+
+  def test_framedClient(self):
+    first = self.writeCommand('first', 0)
+    second = self.writeCommand('second', 0)
+    client = EqueueClient(self.socket_path)
+    try:
+      self.assertEquals(client.request([(first, 1), (second, 1)]),
+                        [first, second])
+      self.waitForRun(first)
+      self.waitForRun(second)
+      # same connection
+      self.assertEquals(client.request([(first, 2)]), [first])
+    finally:
+      client.close()
+    self.waitForRun(first, 2)
+    self.assertEquals(self.server.db[first], '2')
+
+  def test_framedClientInvalidRequest(self):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(self.socket_path)
+    reader = client.makefile('rb')
+    client.sendall('{"id": 1, "command": "foo"}\nnot json\n')
+    self.assertEquals(json.loads(reader.readline()),
+                      {'id': 1, 'error': 'Invalid request'})
+    self.assertEquals(json.loads(reader.readline()),
+                      {'id': None, 'error': 'Invalid request'})
+    reader.close()
+    client.close()
+
+  def test_metrics(self):
+    command = self.writeCommand('command', 0)
+    pool = EqueueClientPool(self.socket_path, size=1)
+    try:
+      self.assertEquals(pool.request([(command, 1)]), [command])
+      self.waitForRun(command)
+      metric_dict = pool.getMetricDict()
+    finally:
+      pool.close()
+    self.assertEquals((metric_dict['received'], metric_dict['run'],
+                       metric_dict['pending']), (1, 1, 0))
+    self.assertTrue('average_wait_time' in metric_dict)
+    # a command named metrics is still queued
+    client = EqueueClient(self.socket_path)
+    try:
+      self.assertEquals(client.request([('metrics', 1)]), ['metrics'])
+    finally:
+      client.close()
+
+  def test_clientPool(self):
+    command = self.writeCommand('command', 0)
+    pool = EqueueClientPool(self.socket_path, size=1)
+    try:
+      self.assertEquals(pool.request([(command, 1)]), [command])
+      client, = pool.client_list
+      self.assertEquals(pool.request([(command, 2)]), [command])
+      self.assertEquals(pool.client_list, [client])
+      # a connection closed by equeue is replaced
+      client.socket.shutdown(socket.SHUT_RDWR)
+      self.assertEquals(pool.request([(command, 3)]), [command])
+    finally:
+      pool.close()
+    self.waitForRun(command, 3)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -123,5 +123,47 @@ class TestGenerateFeed(unittest.TestCase):
     self.assertItemsEqual(remaining_status_item_list,
                           expected_remaining_item_list)
 
+  def test_generateFeedWithIndex(self):
+    option = self.getOptionObject(max_item=3,
+      index_file=os.path.join(self.item_directory, 'index'))
+    for i in range(4):
+      self.saveAsStatusItem('%s.item' % i, {
+        'description': 'description %s' % i,
+        'link': 'http://example.com',
+        'pubDate': 1000000000 + i,
+        'title': 'title %s' % i,
+      })
+
+    feed = feedparser.parse(generateFeed(option))
+    self.assertFalse(feed.bozo)
+    self.assertEqual([entry.title for entry in feed.entries],
+                     ['title 1', 'title 2', 'title 3'])
+    self.assertItemsEqual(os.listdir(self.item_directory),
+                          ['1.item', '2.item', '3.item', 'index'])
+
+    # the index only keeps the date and mtime of items
+    with open(option.index_file) as f:
+      self.assertEqual(sorted(json.load(f))[0][:2],
+                       [1000000001, os.path.join(self.item_directory,
+                                                 '1.item')])
+
+    # items which can't be opened, like one removed after being listed, and
+    # items being written are skipped
+    os.mkdir(os.path.join(self.item_directory, '5.item'))
+    with open(os.path.join(self.item_directory, '6.item'), 'w') as f:
+      f.write('{"title": ')
+    self.saveAsStatusItem('4.item', {
+      'description': 'description 4',
+      'link': 'http://example.com',
+      'pubDate': 1000000004,
+      'title': 'title 4',
+    })
+    feed = feedparser.parse(generateFeed(option))
+    self.assertEqual([entry.title for entry in feed.entries],
+                     ['title 2', 'title 3', 'title 4'])
+    self.assertItemsEqual(os.listdir(self.item_directory),
+                          ['2.item', '3.item', '4.item', '5.item', '6.item',
+                           'index'])
+
 if __name__ == '__main__':
   unittest.main()
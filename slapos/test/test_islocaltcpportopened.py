@@ -0,0 +1,42 @@
+import socket
+import unittest
+
+from slapos.promise.is_local_tcp_port_opened import \
+  getClosedLocalTcpPortList, isLocalTcpPortOpened, main
+
+class TestIsLocalTcpPortOpened(unittest.TestCase):
+
+  def setUp(self):
+    self.server = socket.socket()
+    self.server.bind(('127.0.0.1', 0))
+    self.server.listen(1)
+    self.port = self.server.getsockname()[1]
+    # established connection, whose local port is not listening
+    self.client = socket.create_connection(('127.0.0.1', self.port))
+    self.client_port = self.client.getsockname()[1]
+
+  def tearDown(self):
+    self.client.close()
+    self.server.close()
+
+  def test_isLocalTcpPortOpened(self):
+    self.assertTrue(isLocalTcpPortOpened('127.0.0.1', self.port))
+    self.assertFalse(isLocalTcpPortOpened('127.0.0.1', self.client_port))
+    self.assertFalse(isLocalTcpPortOpened('127.0.0.2', self.port))
+
+  def test_getClosedLocalTcpPortList(self):
+    self.assertEquals(getClosedLocalTcpPortList([
+      ('127.0.0.1', self.port),
+      ('127.0.0.1', self.client_port),
+      ('::1', self.port),
+    ]), [('127.0.0.1', self.client_port), ('::1', self.port)])
+
+  def test_main(self):
+    self.assertEquals(main(['127.0.0.1', str(self.port)]), 0)
+    self.assertEquals(main(['127.0.0.1', str(self.client_port)]), 1)
+    self.assertEquals(main(['127.0.0.1:%s' % self.port]), 0)
+    self.assertEquals(main(['127.0.0.1:%s' % self.port,
+                            '[::1]:%s' % self.port]), 1)
+
+if __name__ == '__main__':
+  unittest.main()
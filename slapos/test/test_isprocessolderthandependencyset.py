@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from slapos.promise.is_process_older_than_dependency_set import \
+  DirectoryMtimeCache, getOlderPidFileList, main, moduleIsModifiedSince
+
+class TestIsProcessOlderThanDependencySet(unittest.TestCase):
+
+  def setUp(self):
+    self.base_directory = tempfile.mkdtemp()
+    self.python_path = os.path.join(self.base_directory, 'path')
+    self.old_time = time.time() - 3600
+    for path in ('package/__init__.py', 'package/module.py',
+                 'package/sub/__init__.py', 'package/sub/module.py',
+                 'notpackage/module.py', 'top.py'):
+      self.writeFile(path, self.old_time)
+    self.cache_file = os.path.join(self.base_directory, 'cache')
+    self.pid_file = os.path.join(self.base_directory, 'pid')
+    with open(self.pid_file, 'w') as f:
+      f.write(str(os.getpid()))
+
+  def tearDown(self):
+    shutil.rmtree(self.base_directory)
+
+  def writeFile(self, path, mtime=None):
+    path = os.path.join(self.python_path, path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      f.write('')
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+
+  def test_cachedScan(self):
+    since = self.old_time + 1
+    self.assertFalse(moduleIsModifiedSince(self.python_path, since))
+    cache = DirectoryMtimeCache(self.cache_file)
+    self.assertFalse(moduleIsModifiedSince(self.python_path, since,
+                                           cache=cache))
+    cache.save()
+
+    # files outside of packages and .pyc are ignored
+    self.writeFile('notpackage/new.py')
+    self.writeFile('top2.py')
+    self.writeFile('package/sub/module.pyc')
+    cache = DirectoryMtimeCache(self.cache_file)
+    self.assertFalse(moduleIsModifiedSince(self.python_path, since,
+                                           cache=cache))
+    cache.save()
+
+    self.writeFile('package/sub/new.py')
+    self.assertTrue(moduleIsModifiedSince(self.python_path, since))
+    cache = DirectoryMtimeCache(self.cache_file)
+    self.assertTrue(moduleIsModifiedSince(self.python_path, since,
+                                          cache=cache))
+
+  def test_cacheEntry(self):
+    sub_path = os.path.join(self.python_path, 'package', 'sub')
+    package_path = os.path.join(self.python_path, 'package')
+    os.utime(package_path, (self.old_time, self.old_time))
+    cache = DirectoryMtimeCache(self.cache_file)
+    cache.getMaxMtime(self.python_path)
+    cache.save()
+    with open(self.cache_file) as f:
+      entry_dict = json.load(f)
+    self.assertEquals(entry_dict[package_path][0], self.old_time)
+    # sub was modified in this second, so it may be modified again without
+    # its modification date changing
+    self.assertEquals(entry_dict[sub_path][0], None)
+
+    # removed folders are removed from the cache
+    shutil.rmtree(sub_path)
+    os.utime(package_path, (self.old_time + 1, self.old_time + 1))
+    cache = DirectoryMtimeCache(self.cache_file)
+    cache.getMaxMtime(self.python_path)
+    cache.save()
+    with open(self.cache_file) as f:
+      entry_dict = json.load(f)
+    self.assertTrue(package_path in entry_dict)
+    self.assertFalse(sub_path in entry_dict)
+
+  def test_getOlderPidFileList(self):
+    missing_pid_file = os.path.join(self.base_directory, 'missing')
+    self.assertEquals(getOlderPidFileList([self.pid_file, missing_pid_file],
+                                          [self.python_path]), [])
+    self.writeFile('package/new.py', time.time() + 60)
+    self.assertEquals(getOlderPidFileList([self.pid_file, missing_pid_file],
+                                          [self.python_path]),
+                      [self.pid_file])
+
+  def test_main(self):
+    self.assertEquals(main(['--cache-file', self.cache_file, self.pid_file,
+                            self.python_path]), 0)
+    self.assertTrue(os.path.exists(self.cache_file))
+    self.writeFile('package/new.py', time.time() + 60)
+    self.assertEquals(main(['--cache-file', self.cache_file, self.pid_file,
+                            self.python_path]), 1)
+    self.assertEquals(main(['-p', self.pid_file, self.pid_file,
+                            self.python_path]), 1)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -26,10 +26,26 @@
 ##############################################################################
 
 import unittest
+import gzip
+import json
+import sys
+import logging
 import os.path
-from slapos.networkbench import dnsbench
-from slapos.networkbench.ping import ping, ping6
-from slapos.networkbench.http import request
+import shutil
+import tempfile
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+from slapos.networkbench import dnsbench, run_all
+from slapos.networkbench import icmp, sink
+from slapos.networkbench.engine import get_task_list
+from slapos.networkbench.daemon import ConfigurationLoader, \
+  NetworkBenchDaemon, RollingStatistics
+from slapos.networkbench.ping import ping, ping6, ping_list
+from slapos.networkbench.http import request, request_multi, TextScanner
+from slapos.networkbench import httpbench
 
 
 DNS_EXPECTED_LIST = ["85.118.38.162", "176.31.129.213"]
@@ -121,6 +137,77 @@ class TestPing(unittest.TestCase):
     self.assertEquals(info[5], 'Fail to parser ping output')
 
 
+class TestNativePing(unittest.TestCase):
+
+  def pingMany(self, host_list, protocol="4", timeout=2):
+    sock = icmp.open_socket(protocol)
+    if sock is None:
+      self.skipTest("ICMP sockets are not allowed")
+    try:
+      return icmp.ping_many(sock, host_list, timeout=timeout,
+                            protocol=protocol, count=3, interval=0.1)
+    finally:
+      sock.close()
+
+  def test_checksum(self):
+    # RFC 1071 example
+    self.assertEquals(icmp.checksum('\x00\x01\xf2\x03\xf4\xf5\xf6\xf7'),
+                      ~0xddf2 & 0xffff)
+    packet = icmp.build_echo_request(8, 1234, 1)
+    self.assertEquals(icmp.checksum(packet), 0)
+
+  def test_ping_many_ok(self):
+    begin = time.time()
+    info_list = self.pingMany(["127.0.0.1", "127.0.0.2", "localhost"])
+    # hosts are pinged at the same time, and replies end the ping early
+    self.assertLess(time.time() - begin, 1)
+    self.assertEquals([info[1] for info in info_list],
+                      ["127.0.0.1", "127.0.0.2", "localhost"])
+    for info in info_list:
+      self.assertEquals(info[0], 'PING')
+      self.assertEquals(info[2], 200)
+      self.assertTrue(float(info[3]) < 100)
+      self.assertEquals(info[4], '0')
+      self.assertEquals(info[5], 'min %s max %s avg %s' % tuple(
+        "%.3f" % float(x) for x in info[5].split()[1::2]))
+
+  def test_ping6_many_ok(self):
+    info = self.pingMany(["::1"], protocol="6")[0]
+    self.assertEquals(info[0], 'PING6')
+    self.assertEquals(info[1], '::1')
+    self.assertEquals(info[2], 200)
+    self.assertEquals(info[4], '0')
+
+  def test_ping_many_fail(self):
+    info_list = self.pingMany(["127.0.0.1", "couscous.invalid"], timeout=1)
+    self.assertEquals(info_list[0][2], 200)
+    self.assertEquals(info_list[1],
+      ('PING', 'couscous.invalid', 600, 'failed', -1, "Cannot resolve host"))
+
+  def test_ping_list(self):
+    if not icmp.is_available("4"):
+      self.skipTest("ICMP sockets are not allowed")
+    info_list = ping_list(["127.0.0.1", "127.0.0.2"], timeout=2)
+    self.assertEquals([(info[1], info[2], info[4]) for info in info_list],
+                      [("127.0.0.1", 200, '0'), ("127.0.0.2", 200, '0')])
+
+  def test_native_ping_only_when_requested(self):
+    is_available = icmp.is_available
+    icmp.is_available = lambda protocol="4": True
+    try:
+      config_dict = {"ping": ["127.0.0.1", "127.0.0.2"]}
+      logger_dict = {"ping": None}
+      # the default path keeps running the ping command
+      self.assertEquals([task[1:] for task in get_task_list(config_dict,
+                                                            logger_dict)],
+                        [(ping, ("127.0.0.1",)), (ping, ("127.0.0.2",))])
+      self.assertEquals([task[1:] for task in get_task_list(config_dict,
+        logger_dict, native_ping=True)],
+        [(ping_list, (["127.0.0.1", "127.0.0.2"], 10, "4"))])
+    finally:
+      icmp.is_available = is_available
+
+
 class TestHTTPBench(unittest.TestCase):
 
   def test_request_ok(self):
@@ -209,6 +296,412 @@ class TestHTTPBench(unittest.TestCase):
     self.assertEquals(info[4], "UNEXPECTED (COUSCOUS not in page content)")
 
 
+class SlowHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    time.sleep(0.3)
+    code = 404 if self.path == '/missing' else 200
+    self.send_response(code)
+    self.send_header('Content-Type', 'text/plain')
+    self.end_headers()
+    self.wfile.write('Hello %s' % self.path)
+
+  def log_message(self, *args):
+    pass
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  request_queue_size = 64
+
+class TestHTTPBenchConcurrent(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ThreadedHTTPServer(('127.0.0.1', 0), SlowHandler)
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.base_url = 'http://127.0.0.1:%s' % self.server.server_port
+    self.log_folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.log_folder)
+
+  def getUrlDict(self):
+    url_dict = dict(('%s/%s' % (self.base_url, i), {"expected_text": str(i)})
+                    for i in xrange(6))
+    url_dict['%s/missing' % self.base_url] = {"expected_response": 200}
+    return url_dict
+
+  def test_request_multi(self):
+    url_dict = self.getUrlDict()
+    info_list = []
+    begin = time.time()
+    request_multi(url_dict, info_list.append, max_concurrency=len(url_dict))
+    # requests are not run one after the other
+    self.assertLess(time.time() - begin, 0.3 * len(url_dict) / 2)
+
+    self.assertEquals(sorted(info[1] for info in info_list), sorted(url_dict))
+    for info in info_list:
+      expected = request(info[1], url_dict[info[1]])
+      self.assertEquals(info[0], expected[0])
+      self.assertEquals(info[2], expected[2])
+      self.assertEquals(len(info[3].split(';')), 5)
+      self.assertEquals(info[4], expected[4])
+    self.assertEquals(
+      [info[4] for info in info_list if info[4] != "OK"],
+      ["UNEXPECTED (200 != 404)"])
+
+  def test_request_multi_max_concurrency(self):
+    url_dict = self.getUrlDict()
+    info_list = []
+    begin = time.time()
+    request_multi(url_dict, info_list.append, max_concurrency=1)
+    self.assertGreaterEqual(time.time() - begin, 0.3 * len(url_dict))
+    self.assertEquals(len(info_list), len(url_dict))
+
+  def test_request_multi_fail(self):
+    info_list = []
+    request_multi({'http://127.0.0.1:1/': {}}, info_list.append)
+    self.assertEquals(len(info_list), 1)
+    self.assertEquals(info_list[0][2], 0)
+    self.assertEquals(info_list[0][4], "FAIL")
+
+  def runAll(self, config_dict, max_concurrency):
+    try:
+      run_all(config_dict, self.log_folder, False,
+              max_concurrency=max_concurrency)
+    finally:
+      for name in ("dns", "ping", "ping6", "http"):
+        logger = logging.getLogger(name)
+        for handler in logger.handlers[:]:
+          logger.removeHandler(handler)
+          handler.close()
+
+  def test_run_all(self):
+    url_dict = self.getUrlDict()
+    log_path = os.path.join(self.log_folder, 'network_bench.http.log')
+    for max_concurrency in (1, 4):
+      self.runAll({"url": url_dict}, max_concurrency)
+    with open(log_path) as f:
+      line_list = f.read().splitlines()
+    self.assertEquals(len(line_list), 2 * len(url_dict))
+    for line_list in line_list[:len(url_dict)], line_list[len(url_dict):]:
+      self.assertEquals(sorted(line.split(';')[3] for line in line_list),
+                        sorted(url_dict))
+
+
+class TestSegmentSink(unittest.TestCase):
+
+  def setUp(self):
+    self.sink_folder = tempfile.mkdtemp()
+    self.day = time.mktime(time.strptime('2016-03-01 12:00', '%Y-%m-%d %H:%M'))
+
+  def tearDown(self):
+    shutil.rmtree(self.sink_folder)
+
+  def writeHttpResult(self, writer, timestamp, url, total, result="OK"):
+    writer.write(timestamp, 'bot', ('GET', url, 200,
+      "0.001;0.002;0.003;%s;%s" % (total, total), result))
+
+  def test_get_row(self):
+    self.assertEquals(sink.get_row('dns',
+        ('DNS', 'www.erp5.com', 200, 0.0125, 'OK', [u'85.118.38.162'])),
+      ['www.erp5.com', 200, '12.500', 'OK', u'85.118.38.162'])
+    self.assertEquals(sink.get_row('ping',
+        ('PING', 'localhost', 200, '0.365', '0',
+         'min 0.178 max 0.646 avg 0.365')),
+      ['localhost', 200, '0.365', '0', '0.178', '0.646',
+       'min 0.178 max 0.646 avg 0.365'])
+    self.assertEquals(sink.get_row('ping6',
+        ('PING6', '::1', 600, 'failed', '100', 'Cannot ping host')),
+      ['::1', 600, '', '100', '', '', 'Cannot ping host'])
+    self.assertEquals(sink.get_row('http',
+        ('GET', 'http://a', 0, "0.0;0.0;0.0;0.0;0.5", 'FAIL')),
+      ['http://a', 0, '0.000', '0.000', '0.000', '0.000', '500.000', 'FAIL'])
+
+  def test_daily_segments(self):
+    writer = sink.SegmentWriter(self.sink_folder, 'http')
+    for index in xrange(100):
+      self.writeHttpResult(writer, self.day + index, 'http://a', index / 1000.)
+    self.writeHttpResult(writer, self.day + 100, 'http://b', 1, "FAIL")
+    # next day
+    self.writeHttpResult(writer, self.day + 86400, 'http://a', 0.5)
+    writer.close()
+
+    self.assertEquals(sorted(os.listdir(self.sink_folder)), [
+      'network_bench.http.2016-03-01.csv.gz',
+      'network_bench.http.2016-03-02.csv'])
+    with gzip.open(os.path.join(self.sink_folder,
+                                'network_bench.http.2016-03-01.csv.gz')) as f:
+      line_list = f.read().splitlines()
+    self.assertEquals(line_list[0], 'timestamp,bot,url,code,namelookup,'
+                      'connect,pretransfer,starttransfer,total,result')
+    self.assertEquals(len(line_list), 102)
+
+    summary_dict = sink.get_latency_summary(self.sink_folder, 'http',
+                                            percentile_list=(50, 100))
+    self.assertEquals(summary_dict, {
+      'http://a': (101, 0, [50., 500.]),
+      'http://b': (1, 1, [None, None]),
+    })
+    # time range only reads the matching segments
+    self.assertEquals(sink.get_segment_list(self.sink_folder, 'http',
+                                            self.day + 86400),
+      [os.path.join(self.sink_folder, 'network_bench.http.2016-03-02.csv')])
+    summary_dict = sink.get_latency_summary(self.sink_folder, 'http',
+      self.day + 10, self.day + 20, percentile_list=(50, 90))
+    self.assertEquals(summary_dict, {'http://a': (10, 0, [14., 18.])})
+
+  def test_query(self):
+    writer = sink.SegmentWriter(self.sink_folder, 'http')
+    for index in xrange(10):
+      self.writeHttpResult(writer, self.day + index, 'http://a', index / 1000.)
+    writer.close()
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+      sink.query(['--sink-dir', self.sink_folder, '--kind', 'http',
+                  '--begin', '2016-03-01', '--end', '2016-03-02',
+                  '-p', '50', '-p', '90'])
+    finally:
+      sys.stdout = stdout
+    self.assertEquals(output.getvalue().splitlines(), [
+      'target\tcount\tfailed\tp50 (ms)\tp90 (ms)',
+      'http://a\t10\t0\t4.000\t8.000'])
+
+  def test_segment_handler(self):
+    logger = logging.getLogger('test_segment_handler')
+    logger.setLevel(logging.INFO)
+    handler = sink.SegmentHandler(self.sink_folder, 'dns', 'bot')
+    logger.addHandler(handler)
+    try:
+      logger.info('not a result')
+      logger.info('result', extra={'info_list':
+        ('DNS', 'www.erp5.com', 600, 0.5, 'Cannot resolve the hostname', [])})
+    finally:
+      logger.removeHandler(handler)
+      handler.close()
+    name, = os.listdir(self.sink_folder)
+    with open(os.path.join(self.sink_folder, name)) as f:
+      line_list = f.read().splitlines()
+    self.assertEquals(len(line_list), 2)
+    self.assertEquals(line_list[1].split(',')[1:],
+      ['bot', 'www.erp5.com', '600', '500.000',
+       'Cannot resolve the hostname', ''])
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """ Serve the body of the server, with an ETag, on kept alive
+      connections.
+  """
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.server.request_count += 1
+    self.server.client_port_set.add(self.client_address[1])
+    etag = '"%s"' % hash(self.server.body)
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response(304)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    self.send_response(200)
+    self.send_header('ETag', etag)
+    self.send_header('Content-Length', str(len(self.server.body)))
+    self.end_headers()
+    self.wfile.write(self.server.body)
+
+  def log_message(self, *args):
+    pass
+
+class TestNetworkBenchDaemon(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ThreadedHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    self.server.body = '{}'
+    self.server.request_count = 0
+    self.server.client_port_set = set()
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.url = 'http://127.0.0.1:%s/' % self.server.server_port
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.folder)
+
+  def test_configuration_loader_url(self):
+    loader = ConfigurationLoader(self.url)
+    self.server.body = json.dumps({"url": {"http://a": {}}})
+    try:
+      self.assertTrue(loader.refresh())
+      self.assertEquals(loader.config_dict, {"url": {"http://a": {}}})
+      self.assertFalse(loader.refresh())
+      self.assertEquals(self.server.request_count, 2)
+      self.server.body = json.dumps({"url": {"http://b": {}}})
+      self.assertTrue(loader.refresh())
+      self.assertEquals(loader.config_dict, {"url": {"http://b": {}}})
+      # invalid configuration is ignored
+      self.server.body = '{'
+      self.assertFalse(loader.refresh())
+      self.assertEquals(loader.config_dict, {"url": {"http://b": {}}})
+      # same connection
+      self.assertEquals(len(self.server.client_port_set), 1)
+    finally:
+      loader.close()
+
+  def test_configuration_loader_file(self):
+    path = os.path.join(self.folder, 'config.json')
+    with open(path, 'w') as f:
+      json.dump({"ping": ["127.0.0.1"]}, f)
+    loader = ConfigurationLoader(path)
+    self.assertTrue(loader.refresh())
+    self.assertEquals(loader.config_dict, {"ping": ["127.0.0.1"]})
+    self.assertFalse(loader.refresh())
+    with open(path, 'w') as f:
+      json.dump({"ping": ["127.0.0.2"]}, f)
+    os.utime(path, (0, 0))
+    self.assertTrue(loader.refresh())
+    self.assertEquals(loader.config_dict, {"ping": ["127.0.0.2"]})
+
+  def test_rolling_statistics(self):
+    statistics = RollingStatistics(window=60)
+    for index in xrange(10):
+      statistics.add('http', 1000 + index, ('GET', 'http://a', 200,
+        "0;0;0;0;%s" % ((index + 1) / 1000.), 'OK'))
+    statistics.add('http', 1010, ('GET', 'http://a', 0, "0;0;0;0;0", 'FAIL'))
+    statistics.add('ping', 1010, ('PING', 'localhost', 200, '0.500', '0',
+                                  'min 0.400 max 0.600 avg 0.500'))
+    self.assertEquals(statistics.get_summary(now=1020), {
+      'http': {'http://a': {'count': 11, 'failed': 1, 'last': None,
+                            'p50': 5., 'p90': 9., 'p99': 10.}},
+      'ping': {'localhost': {'count': 1, 'failed': 0, 'last': 0.5,
+                             'p50': 0.5, 'p90': 0.5, 'p99': 0.5}},
+    })
+    # old results are dropped
+    self.assertEquals(statistics.get_summary(now=1065), {
+      'http': {'http://a': {'count': 6, 'failed': 1, 'last': None,
+                            'p50': 8., 'p90': 10., 'p99': 10.}},
+      'ping': {'localhost': {'count': 1, 'failed': 0, 'last': 0.5,
+                             'p50': 0.5, 'p90': 0.5, 'p99': 0.5}},
+    })
+    self.assertEquals(statistics.get_summary(now=2000), {})
+
+  def test_daemon(self):
+    target_url = self.url + 'target'
+    config_path = os.path.join(self.folder, 'config.json')
+    with open(config_path, 'w') as f:
+      json.dump({"url": {target_url: {"expected_response": 200}}}, f)
+    logger = logging.getLogger('test_daemon')
+    logger.setLevel(logging.INFO)
+    result_list = []
+    statistics = RollingStatistics()
+    class Handler(logging.Handler):
+      def emit(self, record):
+        result_list.append(record.info_list)
+        statistics.add('http', record.created, record.info_list)
+    handler = Handler()
+    logger.addHandler(handler)
+    daemon = NetworkBenchDaemon(ConfigurationLoader(config_path),
+      {'http': logger}, {'http': 0.1, 'dns': 0}, jitter=0.1,
+      statistics=statistics)
+    try:
+      threading.Timer(1, daemon.stop).start()
+      daemon.run()
+    finally:
+      logger.removeHandler(handler)
+    self.assertGreater(len(result_list), 5)
+    for info in result_list:
+      self.assertEquals(info[1], target_url)
+      self.assertEquals(info[4], 'OK')
+    # the connection is kept between runs
+    self.assertEquals(len(self.server.client_port_set), 1)
+    summary_dict = statistics.get_summary()
+    self.assertEquals(summary_dict['http'][target_url]['count'],
+                      len(result_list))
+
+
+class TestHTTPBenchMode(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ThreadedHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    self.server.body = 'x' * 100000 + 'NEEDLE' + 'x' * 100000
+    self.server.request_count = 0
+    self.server.client_port_set = set()
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    self.url = 'http://127.0.0.1:%s/' % self.server.server_port
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_text_scanner(self):
+    for text, chunk_list, found in (
+        ('NEEDLE', ['xxNEE', 'DLExx'], True),
+        ('NEEDLE', ['N', 'E', 'E', 'D', 'L', 'E'], True),
+        ('NEEDLE', ['NEEDL', 'xE'], False),
+        ('', [], True),
+        (None, ['NEEDLE'], False)):
+      scanner = TextScanner(text)
+      for chunk in chunk_list:
+        scanner.write(chunk)
+      self.assertEquals(scanner.found, found)
+      self.assertTrue(len(scanner.tail) < len(text or ' '))
+
+  def test_bench(self):
+    sample_dict = httpbench.bench(self.url, {"expected_text": "NEEDLE"},
+                                  count=8, concurrency=4)
+    self.assertEquals(sorted(sample_dict), sorted(httpbench.MODE_LIST))
+    for mode, sample_list in sample_dict.iteritems():
+      self.assertEquals(len(sample_list), 8)
+      for sample in sample_list:
+        self.assertEquals(sample['result'], 'OK')
+        self.assertEquals(sample['code'], 200)
+        self.assertEquals(sample['size'], len(self.server.body))
+        self.assertTrue(0 < sample['total'] < 5000)
+      connect_count = sum(sample['connect_count'] for sample in sample_list)
+      if mode.endswith('cold'):
+        self.assertEquals(connect_count, 8)
+      elif mode.startswith('sequential'):
+        self.assertEquals(connect_count, 1)
+      else:
+        self.assertLessEqual(connect_count, 4)
+
+    summary_dict = httpbench.get_summary(sample_dict['sequential-keepalive'])
+    self.assertEquals(summary_dict['count'], 8)
+    self.assertEquals(summary_dict['failed'], 0)
+    self.assertEquals(summary_dict['size'],
+      dict.fromkeys(('p50', 'p90', 'p99'), len(self.server.body)))
+
+  def test_bench_unexpected(self):
+    sample_list = httpbench.bench_sequential(self.url,
+      {"expected_text": "COUSCOUS"}, count=2)
+    self.assertEquals([sample['result'] for sample in sample_list],
+      ["UNEXPECTED (COUSCOUS not in page content)"] * 2)
+    summary_dict = httpbench.get_summary(sample_list)
+    self.assertEquals(summary_dict['failed'], 2)
+    self.assertEquals(summary_dict['total'],
+                      dict.fromkeys(('p50', 'p90', 'p99')))
+
+  def test_main(self):
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+      httpbench.main(['-n', '3', '-m', 'concurrent-keepalive', '-j', self.url])
+    finally:
+      sys.stdout = stdout
+    result_dict = json.loads(output.getvalue())
+    self.assertEquals(list(result_dict), [self.url])
+    self.assertEquals(result_dict[self.url]['concurrent-keepalive']['count'],
+                      3)
+
 
 #def request(url, expected_dict):
 #  
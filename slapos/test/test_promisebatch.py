@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+from cStringIO import StringIO
+
+from slapos.promise import batch
+
+class TestPromiseBatch(unittest.TestCase):
+
+  def setUp(self):
+    self.base_directory = tempfile.mkdtemp()
+    self.output_directory = os.path.join(self.base_directory, 'output')
+    os.mkdir(self.output_directory)
+    self.config_file = os.path.join(self.base_directory, 'promise.cfg')
+    # module used as promise
+    with open(os.path.join(self.base_directory, 'batch_test_promise.py'),
+              'w') as f:
+      f.write(textwrap.dedent("""\
+        import sys
+        import time
+        def main(argument_list):
+          print 'sleep %s' % argument_list[0]
+          time.sleep(float(argument_list[0]))
+          if argument_list[1:]:
+            sys.exit(argument_list[1])
+          return 0
+        """))
+    sys.path.insert(0, self.base_directory)
+    self.listening_socket = socket.socket()
+    self.listening_socket.bind(('127.0.0.1', 0))
+    self.listening_socket.listen(1)
+
+  def tearDown(self):
+    self.listening_socket.close()
+    sys.path.remove(self.base_directory)
+    shutil.rmtree(self.base_directory)
+
+  def writeConfig(self, check_dict):
+    with open(self.config_file, 'w') as f:
+      for title, (promise, argument_list) in sorted(check_dict.items()):
+        f.write('[%s]\npromise = %s\nargument-list = %s\n' % (
+          title, promise, argument_list))
+
+  def getStatus(self, title):
+    with open(os.path.join(self.output_directory,
+                           '%s.status.json' % title)) as f:
+      return json.load(f)
+
+  def runBatch(self, *argument_list):
+    return batch.main(['--config', self.config_file,
+                       '--output', self.output_directory,
+                       '--instance_name', 'instance'] + list(argument_list))
+
+  def test_runChecks(self):
+    port = self.listening_socket.getsockname()[1]
+    self.writeConfig({
+      'port-opened': ('is-local-tcp-port-opened', '127.0.0.1 %s' % port),
+      'port-closed': ('is-local-tcp-port-opened', '127.0.0.1 1'),
+      'custom': ('batch_test_promise', '0'),
+      'custom-failed': ('batch_test_promise', '0 "went wrong"'),
+      'missing': ('no_such_promise_module', ''),
+    })
+    self.assertEquals(self.runBatch(), 1)
+    self.assertEquals(self.getStatus('port-opened')['status'], 'OK')
+    self.assertEquals(self.getStatus('port-closed')['status'], 'ERROR')
+    status = self.getStatus('custom')
+    self.assertEquals((status['status'], status['message']),
+                      ('OK', 'sleep 0\n'))
+    self.assertEquals(status['instance'], 'instance')
+    self.assertEquals(status['type'], 'status')
+    status = self.getStatus('custom-failed')
+    self.assertEquals((status['status'], status['message']),
+                      ('ERROR', 'sleep 0\nwent wrong'))
+    self.assertEquals(self.getStatus('missing')['status'], 'ERROR')
+
+  def test_changeTimeKept(self):
+    self.writeConfig({'custom': ('batch_test_promise', '0')})
+    self.assertEquals(self.runBatch(), 0)
+    change_time = self.getStatus('custom')['change-time']
+    self.assertEquals(self.runBatch(), 0)
+    self.assertEquals(self.getStatus('custom')['change-time'], change_time)
+
+  def test_concurrentAndTimeout(self):
+    self.writeConfig(dict(('check-%s' % index, ('batch_test_promise', '0.5'))
+                          for index in xrange(4)))
+    start = time.time()
+    self.assertEquals(self.runBatch('--workers', '4'), 0)
+    self.assertTrue(time.time() - start < 1.5)
+
+    self.writeConfig({'slow': ('batch_test_promise', '2')})
+    start = time.time()
+    self.assertEquals(self.runBatch('--timeout', '0.2'), 1)
+    self.assertTrue(time.time() - start < 1)
+    self.assertEquals(self.getStatus('slow')['message'],
+                      'PROMISE TIME OUT AFTER 0.2 SECONDS')
+
+  def test_timeoutWithFullWorkers(self):
+    start = time.time()
+    result_list = batch.runCheckList([
+      ('slow', 'batch_test_promise', ['3']),
+      ('fast', 'batch_test_promise', ['0']),
+    ], worker_count=1, timeout=0.5)
+    self.assertTrue(time.time() - start < 1.5)
+    self.assertEquals([(result['title'], result['status'], result['message'])
+                       for result in result_list], [
+      ('slow', 'ERROR', 'PROMISE TIME OUT AFTER 0.5 SECONDS'),
+      ('fast', 'OK', 'sleep 0\n'),
+    ])
+
+  def test_lateOutputIgnored(self):
+    with open(os.path.join(self.base_directory, 'batch_test_late.py'),
+              'w') as f:
+      f.write(textwrap.dedent("""\
+        import time
+        def main(argument_list):
+          time.sleep(0.3)
+          print 'late output'
+          return 0
+        """))
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+      result_list = batch.runCheckList([
+        ('late', 'batch_test_late', []),
+        ('slow', 'batch_test_promise', ['0.6']),
+      ], worker_count=2, timeout=0.1)
+    finally:
+      sys.stdout = stdout
+    self.assertEquals([result['message'] for result in result_list],
+                      ['PROMISE TIME OUT AFTER 0.1 SECONDS'] * 2)
+    self.assertEquals(output.getvalue(), '')
+
+  def test_outputRestored(self):
+    stdout, stderr = sys.stdout, sys.stderr
+    batch.runCheckList([('custom', 'batch_test_promise', ['0'])])
+    self.assertIs(sys.stdout, stdout)
+    self.assertIs(sys.stderr, stderr)
+
+if __name__ == '__main__':
+  unittest.main()
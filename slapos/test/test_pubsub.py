@@ -0,0 +1,213 @@
+import SocketServer
+import csv
+import feedparser
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from hashlib import sha512
+
+from slapos import pubsub
+from slapos.pubsub.callbackregistry import CallbackRegistry
+
+NOTIFICATION = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>Feed</title>
+  <id>%s</id>
+  <updated>2016-01-01T00:00:00Z</updated>
+</feed>
+"""
+
+class FakeEqueueHandler(SocketServer.StreamRequestHandler):
+  """ Acknowledge framed requests, except the commands containing fail """
+
+  def handle(self):
+    for line in self.rfile:
+      request = json.loads(line)
+      self.server.request_list.append(request)
+      answer = {'id': request['id']}
+      if 'fail' not in request['command']:
+        answer['command'] = request['command']
+      self.wfile.write(json.dumps(answer) + '\n')
+
+class TestPubsubGetFeed(unittest.TestCase):
+
+  def setUp(self):
+    self.feed_directory = tempfile.mkdtemp()
+    self.feed_path = os.path.join(self.feed_directory, 'feed')
+    pubsub.app.config.update(FEEDS=self.feed_directory, TESTING=True)
+    self.client = pubsub.app.test_client()
+
+  def tearDown(self):
+    shutil.rmtree(self.feed_directory)
+
+  def writeRow(self, timestamp, content):
+    with open(self.feed_path, 'a') as feed_file:
+      csv.writer(feed_file).writerow([timestamp, 'title %s' % timestamp,
+                                      content, 'guid-%s' % timestamp])
+    # mtime is used to detect changes
+    os.utime(self.feed_path, (timestamp, timestamp))
+
+  def getEntryIdList(self, query_string=''):
+    response = self.client.get('/get/feed' + query_string)
+    self.assertEquals(response.status_code, 200)
+    return [entry.id for entry in feedparser.parse(response.data).entries]
+
+  def test_notFound(self):
+    self.assertEquals(self.client.get('/get/missing').status_code, 404)
+
+  def test_multilineRows(self):
+    self.writeRow(1000, 'first line\nsecond "quoted"\nline')
+    self.writeRow(1001, '"\n"')
+    self.writeRow(1002, 'simple')
+    self.assertEquals(self.getEntryIdList(),
+                      ['guid-1002', 'guid-1001', 'guid-1000'])
+    response = self.client.get('/get/feed')
+    entry = feedparser.parse(response.data).entries[-1]
+    self.assertEquals(entry.content[0].value,
+                      'first line\nsecond "quoted"\nline')
+
+  def test_limitAndSince(self):
+    for timestamp in xrange(1000, 1010):
+      self.writeRow(timestamp, 'content %s' % timestamp)
+    self.assertEquals(self.getEntryIdList('?limit=2'),
+                      ['guid-1009', 'guid-1008'])
+    self.assertEquals(self.getEntryIdList('?since=1007'),
+                      ['guid-1009', 'guid-1008'])
+    self.assertEquals(self.getEntryIdList('?since=1004&limit=1'),
+                      ['guid-1009'])
+    self.assertEquals(self.client.get('/get/feed?limit=a').status_code, 400)
+
+  def test_appendedRows(self):
+    self.writeRow(1000, 'content')
+    self.assertEquals(self.getEntryIdList(), ['guid-1000'])
+    # an incomplete row is not served until it is complete
+    with open(self.feed_path, 'a') as feed_file:
+      feed_file.write('1001,title,"incomplete\n')
+    os.utime(self.feed_path, (1001, 1001))
+    self.assertEquals(self.getEntryIdList(), ['guid-1000'])
+    with open(self.feed_path, 'a') as feed_file:
+      feed_file.write('content",guid-1001\r\n')
+    os.utime(self.feed_path, (1002, 1002))
+    self.assertEquals(self.getEntryIdList(), ['guid-1001', 'guid-1000'])
+
+  def test_replacedFile(self):
+    self.writeRow(1000, 'content')
+    self.assertEquals(self.getEntryIdList(), ['guid-1000'])
+    # the feed is replaced by a bigger file, as when it is rotated
+    os.rename(self.feed_path, self.feed_path + '.old')
+    self.writeRow(2000, 'new content which is longer than the previous one')
+    self.writeRow(2001, 'content')
+    self.assertEquals(self.getEntryIdList(), ['guid-2001', 'guid-2000'])
+
+  def test_notModified(self):
+    self.writeRow(1000, 'content')
+    response = self.client.get('/get/feed')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    self.assertEquals(self.client.get('/get/feed', headers={
+      'If-None-Match': etag}).status_code, 304)
+    self.assertEquals(self.client.get('/get/feed', headers={
+      'If-Modified-Since': last_modified}).status_code, 304)
+    # parameters are part of the etag
+    self.assertEquals(self.client.get('/get/feed?limit=1', headers={
+      'If-None-Match': etag}).status_code, 200)
+
+    self.writeRow(1001, 'content')
+    self.assertEquals(self.client.get('/get/feed', headers={
+      'If-None-Match': etag}).status_code, 200)
+    self.assertEquals(self.client.get('/get/feed', headers={
+      'If-Modified-Since': last_modified}).status_code, 200)
+
+
+class TestCallbackRegistry(unittest.TestCase):
+
+  def setUp(self):
+    self.callback_directory = tempfile.mkdtemp()
+    self.registry = CallbackRegistry(self.callback_directory)
+
+  def tearDown(self):
+    shutil.rmtree(self.callback_directory)
+
+  def writeCallback(self, feed_id, callback_list, mtime):
+    path = os.path.join(self.callback_directory, sha512(feed_id).hexdigest())
+    with open(path, 'w') as callback_file:
+      callback_file.write(''.join('%s\n' % callback
+                                  for callback in callback_list))
+    os.utime(path, (mtime, mtime))
+
+  def test_getCallbackList(self):
+    self.assertEquals(self.registry.getCallbackList('feed'), None)
+    self.writeCallback('feed', ['/bin/a'], 1000)
+    self.assertEquals(self.registry.getCallbackList('feed'), ['/bin/a\n'])
+    self.writeCallback('feed', ['/bin/a', '/bin/b'], 1001)
+    self.assertEquals(self.registry.getCallbackList('feed'),
+                      ['/bin/a\n', '/bin/b\n'])
+    # not read again while unchanged
+    self.writeCallback('feed', ['/bin/c'], 1001)
+    self.assertEquals(self.registry.getCallbackList('feed'),
+                      ['/bin/a\n', '/bin/b\n'])
+
+
+class TestPubsubNotify(unittest.TestCase):
+
+  def setUp(self):
+    self.base_directory = tempfile.mkdtemp()
+    self.callback_directory = os.path.join(self.base_directory, 'callbacks')
+    os.mkdir(self.callback_directory)
+    socket_path = os.path.join(self.base_directory, 'equeue.sock')
+    self.equeue = SocketServer.ThreadingUnixStreamServer(socket_path,
+                                                         FakeEqueueHandler)
+    self.equeue.daemon_threads = True
+    self.equeue.request_list = []
+    self.equeue_thread = threading.Thread(target=self.equeue.serve_forever,
+                                          kwargs={'poll_interval': 0.05})
+    self.equeue_thread.daemon = True
+    self.equeue_thread.start()
+    pubsub.app.config.update(CALLBACKS=self.callback_directory,
+                             EQUEUE_SOCKET=socket_path, TESTING=True)
+    self.client = pubsub.app.test_client()
+
+  def tearDown(self):
+    pubsub.getEqueueClientPool(self.equeue.server_address).close()
+    self.equeue.shutdown()
+    self.equeue.server_close()
+    self.equeue_thread.join()
+    shutil.rmtree(self.base_directory)
+
+  def writeCallback(self, feed_id, callback_list):
+    path = os.path.join(self.callback_directory, sha512(feed_id).hexdigest())
+    with open(path, 'w') as callback_file:
+      callback_file.write(''.join('%s\n' % callback
+                                  for callback in callback_list))
+
+  def notify(self, feed_id):
+    return self.client.post('/notify/42', data=NOTIFICATION % feed_id)
+
+  def test_unknownFeed(self):
+    self.assertEquals(self.notify('unknown').status_code, 404)
+
+  def test_notify(self):
+    callback_list = ['/bin/callback%s' % index for index in xrange(20)]
+    self.writeCallback('feed', callback_list)
+    self.assertEquals(self.notify('feed').status_code, 204)
+    request_list = self.equeue.request_list
+    self.assertEquals(sorted(request['command'] for request in request_list),
+                      sorted('%s\n\0--transaction-id\x0042' % callback
+                             for callback in callback_list))
+    self.assertEquals(set(request['timestamp'] for request in request_list),
+                      set([int(time.mktime(time.strptime(
+                        '2016-01-01', '%Y-%m-%d')))]))
+
+  def test_failedCallback(self):
+    self.writeCallback('feed', ['/bin/ok', '/bin/fail'])
+    response = self.notify('feed')
+    self.assertEquals(response.status_code, 500)
+    self.assertEquals(json.loads(response.data),
+                      {'failed_callback_list': ['/bin/fail']})
+
+if __name__ == '__main__':
+  unittest.main()
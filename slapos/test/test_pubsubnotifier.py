@@ -0,0 +1,197 @@
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from slapos.pubsub.notifier import captureOutput, createStatusItem, \
+  getNotificationSummary, notify, openOutputLog, postNotification
+
+class NotificationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_POST(self):
+    server = self.server
+    self.rfile.read(int(self.headers['Content-Length']))
+    server.request_list.append((self.path, self.client_address))
+    if self.path.startswith('/hang'):
+      time.sleep(1)
+    status = 204
+    if self.path.startswith('/fail'):
+      status = 500
+    elif self.path.startswith('/flaky') and \
+        len([path for path, _ in server.request_list
+             if path.startswith('/flaky')]) < 2:
+      status = 503
+    self.send_response(status)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+
+class NotificationServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+class TestNotify(unittest.TestCase):
+
+  def setUp(self):
+    self.server_list = []
+
+  def tearDown(self):
+    for server, thread in self.server_list:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+
+  def startServer(self):
+    server = NotificationServer(('127.0.0.1', 0), NotificationHandler)
+    server.request_list = []
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    self.server_list.append((server, thread))
+    return server, 'http://127.0.0.1:%s' % server.server_address[1]
+
+  def test_keepAlive(self):
+    server, url = self.startServer()
+    result_list = notify(['%s/a' % url, '%s/b/' % url], 'body', {}, 42,
+                         timeout=5, retry=0)
+    self.assertEquals([result['status'] for result in result_list],
+                      [204, 204])
+    self.assertEquals([path for path, _ in server.request_list],
+                      ['/a/42', '/b/42'])
+    # both notifications were sent through the same connection
+    self.assertEquals(len(set(address for _, address in server.request_list)),
+                      1)
+
+  def test_hungTarget(self):
+    hung_server, hung_url = self.startServer()
+    server, url = self.startServer()
+    start = time.time()
+    result_list = notify(['%s/hang' % hung_url, '%s/ok' % url], 'body', {},
+                         42, timeout=0.2, retry=0)
+    self.assertTrue(time.time() - start < 1)
+    self.assertTrue('error' in result_list[0])
+    self.assertEquals(result_list[1]['status'], 204)
+    self.assertFalse('error' in result_list[1])
+    self.assertTrue(result_list[1]['latency'] < 0.5)
+
+  def test_retry(self):
+    server, url = self.startServer()
+    result_list = notify(['%s/flaky' % url, '%s/fail' % url], 'body', {}, 42,
+                         timeout=5, retry=2, backoff=0.01)
+    flaky, fail = result_list
+    self.assertEquals((flaky['status'], flaky['attempts']), (204, 2))
+    self.assertFalse('error' in flaky)
+    self.assertEquals((fail['status'], fail['attempts']), (500, 3))
+    self.assertTrue('error' in fail)
+    summary = getNotificationSummary(result_list)
+    self.assertTrue('%s/flaky: OK in ' % url in summary)
+    self.assertTrue('%s/fail: FAILED (500) in ' % url in summary)
+
+  def test_retryConnectionError(self):
+    class Response(object):
+      status = 503
+      reason = 'Service Unavailable'
+      def read(self):
+        return ''
+    class Connection(object):
+      request_count = 0
+      def request(self, *args):
+        self.request_count += 1
+        if self.request_count > 1:
+          raise socket.error('connection refused')
+      def getresponse(self):
+        return Response()
+      def close(self):
+        pass
+    result = postNotification(Connection(), {'url': 'http://example.com/a',
+                                             'path': '/a/42'},
+                              'body', {}, retry=1, backoff=0.01)
+    self.assertEquals(result['attempts'], 2)
+    self.assertFalse('status' in result)
+    self.assertTrue('failed' in result['error'])
+    self.assertTrue(getNotificationSummary([result]).startswith(
+      'http://example.com/a: FAILED (no response) in '))
+
+
+class TestCreateStatusItem(unittest.TestCase):
+
+  def setUp(self):
+    self.item_directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.item_directory)
+
+  def test_summary(self):
+    createStatusItem(self.item_directory, 'instance', '/bin/callback',
+                     time.time(), 'http://example.com', 'OK', 'summary')
+    item_name, = os.listdir(self.item_directory)
+    with open(os.path.join(self.item_directory, item_name)) as item_file:
+      item = json.load(item_file)
+    self.assertEquals(item['title'], 'instance-PBS callback : OK')
+    self.assertTrue(item['description'].endswith('\nsummary'))
+
+
+class TestCaptureOutput(unittest.TestCase):
+
+  def setUp(self):
+    self.base_directory = tempfile.mkdtemp()
+    self.executable = os.path.join(self.base_directory, 'executable')
+
+  def tearDown(self):
+    shutil.rmtree(self.base_directory)
+
+  def writeExecutable(self, size, exit_code=0):
+    """ Write an executable printing size bytes: 0123456789012... """
+    with open(self.executable, 'w') as f:
+      f.write("#!%s\nimport sys\nsys.stdout.write(''.join(str(i %% 10) "
+              "for i in range(%s)))\nsys.exit(%s)\n" % (
+                sys.executable, size, exit_code))
+    os.chmod(self.executable, 0700)
+    return ''.join(str(i % 10) for i in xrange(size))
+
+  def test_smallOutput(self):
+    output = self.writeExecutable(100, 3)
+    self.assertEquals(captureOutput(self.executable, 100),
+                      (3, output, 100))
+
+  def test_bigOutput(self):
+    output = self.writeExecutable(300000)
+    with open(os.path.join(self.base_directory, 'spool'), 'w') as spool_file:
+      exit_code, content, size = captureOutput(self.executable, 1001,
+                                               spool_file)
+    self.assertEquals((exit_code, size), (0, 300000))
+    self.assertEquals(content, '%s\n[... 298999 bytes skipped ...]\n%s' % (
+      output[:500], output[-501:]))
+    with open(spool_file.name) as f:
+      self.assertEquals(f.read(), output)
+
+  def test_openOutputLog(self):
+    # logs of another executable are kept
+    other_output_log = openOutputLog(self.base_directory, '/bin/backup.sh', 2)
+    other_output_log.close()
+    name_list = []
+    for _ in xrange(4):
+      output_log = openOutputLog(self.base_directory, '/bin/backup', 2)
+      output_log.close()
+      name_list.append(os.path.basename(output_log.name))
+    self.assertEquals(sorted(name for name in os.listdir(self.base_directory)
+                             if name.startswith('backup.') and
+                                not name.startswith('backup.sh.')),
+                      name_list[-2:])
+    self.assertTrue(os.path.exists(other_output_log.name))
+
+if __name__ == '__main__':
+  unittest.main()